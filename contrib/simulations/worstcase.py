@@ -2,6 +2,7 @@
 import csv
 import os
 import subprocess
+import sys
 
 #
 # Constants
@@ -44,118 +45,143 @@ def collect_times():
 #
 # Size calculations
 #
+# Transactions and blocks are built with the RPC test framework, and sized
+# with its serialized_size(), so that the sizes follow the serialization
+# code instead of a separate set of formulas.
+#
 
-def compact_size_size(nSize):
-    if nSize < 253:
-        return 1
-    elif nSize <= 0xFFFF:
-        return 3
-    elif nSize <= 0xFFFFFFFF:
-        return 5
-    else:
-        return 9
-
-def script_size(script):
-    return (
-        compact_size_size(len(script)) +
-        len(script)
-    )
-
-def tx_in_size(scriptSig):
-    return (
-        32 + # prevout.hash
-        4  + # prevout.n
-        script_size(scriptSig) +
-        4    # nSequence
-    )
-
-def tx_out_size(scriptPubKey):
-    return (
-        8 + # nValue
-        script_size(scriptPubKey)
-    )
-
-def v4_tx_size(vin, vout, nShieldedSpend, nShieldedOutput, nJoinSplit):
-    return (
-        4 + # header
-        4 + # nVersionGroupId
-        compact_size_size(len(vin)) +
-        sum([tx_in_size(scriptSig) for scriptSig in vin]) +
-        compact_size_size(len(vout)) +
-        sum([tx_out_size(scriptPubKey) for scriptPubKey in vout]) +
-        4 + # lock_time
-        4 + # nExpiryHeight
-        4 + # valueBalance
-        compact_size_size(nShieldedSpend) +
-        (384 * nShieldedSpend) +
-        compact_size_size(nShieldedOutput) +
-        (948 * nShieldedOutput) +
-        compact_size_size(nJoinSplit) +
-        (1698 * nJoinSplit) +
-        ((32 + 64) if nJoinSplit > 0 else 0) + # joinSplitPubKey + joinSplitSig
-        (64 if (nShieldedSpend + nShieldedOutput) > 0 else 0) # bindingSig
-    )
-
-def block_size(vtx):
-    return (
-        4  + # nVersion
-        32 + # hashPrevBlock
-        32 + # hashMerkleRoot
-        32 + # hashFinalSaplingRoot
-        4  + # nTime
-        4  + # nBits
-        32 + # nNonce
-        compact_size_size(1344) + # solutionSize
-        1344 + # solution
-        compact_size_size(len(vtx)) +
-        sum([v4_tx_size(**tx) for tx in vtx])
-    )
+sys.path.append(os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+    'qa', 'rpc-tests'))
+from test_framework.mininode import (
+    CBlock,
+    CTransaction,
+    CTxIn,
+    CTxOut,
+    Groth16Proof,
+    JSDescription,
+    OutputDescription,
+    RedJubjubSignature,
+    SpendDescription,
+    ZC_NOTECIPHERTEXT_SIZE,
+    ZC_NUM_JS_OUTPUTS,
+)
+
+EQUIHASH_SOLUTION_SIZE = 1344
+
+# The elements are filled with zeroes, so that they can be serialized.
+
+def groth16_proof():
+    proof = Groth16Proof()
+    proof.data = bytes(192)
+    return proof
+
+def redjubjub_signature():
+    sig = RedJubjubSignature()
+    sig.data = bytes(64)
+    return sig
+
+def spend_description():
+    spend = SpendDescription()
+    spend.cv = 0
+    spend.anchor = 0
+    spend.nullifier = 0
+    spend.rk = 0
+    spend.zkproof = groth16_proof()
+    spend.spendAuthSig = redjubjub_signature()
+    return spend
+
+def output_description():
+    output = OutputDescription()
+    output.cv = 0
+    output.cmu = 0
+    output.ephemeralKey = 0
+    output.encCiphertext = bytes(580)
+    output.outCiphertext = bytes(80)
+    output.zkproof = groth16_proof()
+    return output
+
+def joinsplit():
+    js = JSDescription()
+    js.proof = groth16_proof()
+    js.ciphertexts = [bytes(ZC_NOTECIPHERTEXT_SIZE) for i in range(ZC_NUM_JS_OUTPUTS)]
+    return js
+
+# The transaction field, and a constructor for its elements, for each item
+# counted in a transaction template.
+ITEMS = {
+    'nShieldedSpend': ('shieldedSpends', spend_description),
+    'nShieldedOutput': ('shieldedOutputs', output_description),
+    'nJoinSplit': ('vJoinSplit', joinsplit),
+}
+
+def v4_tx(vin, vout, nShieldedSpend, nShieldedOutput, nJoinSplit):
+    tx = CTransaction()
+    tx.vin = [CTxIn(scriptSig=scriptSig) for scriptSig in vin]
+    tx.vout = [CTxOut(scriptPubKey=scriptPubKey) for scriptPubKey in vout]
+    tx.shieldedSpends = [spend_description() for i in range(nShieldedSpend)]
+    tx.shieldedOutputs = [output_description() for i in range(nShieldedOutput)]
+    tx.vJoinSplit = [joinsplit() for i in range(nJoinSplit)]
+    # Only serialized if there are JoinSplits, or Sapling spends or outputs.
+    tx.joinSplitPubKey = 0
+    tx.joinSplitSig = bytes(64)
+    tx.bindingSig = redjubjub_signature()
+    return tx
+
+def empty_block():
+    block = CBlock()
+    block.nSolution = bytes(EQUIHASH_SOLUTION_SIZE)
+    return block
 
 #
 # Runners
 #
 
 def worst_case_many_identical_txs(tx):
-    vtx = []
+    block = empty_block()
+    tx = v4_tx(**tx)
     while True:
-        vtx.append(tx)
-        if block_size(vtx) > MAX_BLOCK_SIZE:
+        block.vtx.append(tx)
+        if block.serialized_size() > MAX_BLOCK_SIZE:
             # Keep under the size limit
-            vtx.pop()
+            block.vtx.pop()
             break
-    return vtx
+    return block
 
 def worst_case_one_tx_containing(item):
-    vtx = [{
-        'vin': [],
-        'vout': [],
-        'nShieldedSpend': 0,
-        'nShieldedOutput': 0,
-        'nJoinSplit': 0,
-    }]
+    block = empty_block()
+    tx = v4_tx([], [], 0, 0, 0)
+    block.vtx.append(tx)
+    (field, make) = ITEMS[item]
+    items = getattr(tx, field)
     while True:
-        vtx[0][item] += 1
-        if block_size(vtx) > MAX_BLOCK_SIZE:
+        items.append(make())
+        if block.serialized_size() > MAX_BLOCK_SIZE:
             # Keep under the size limit
-            vtx[0][item] -= 1
+            items.pop()
             break
-    return vtx
+    return block
+
+def print_makeup(block, times):
+    vtx = block.vtx
 
-def print_makeup(vtx, times):
     # One proof per Sapling spend, Sapling output, and JoinSplit
-    proofs = sum([tx['nShieldedSpend'] + tx['nShieldedOutput'] + tx['nJoinSplit'] for tx in vtx])
+    proofs = sum([len(tx.shieldedSpends) + len(tx.shieldedOutputs) + len(tx.vJoinSplit) for tx in vtx])
 
     # One ECDSA signature per transparent input
-    ecdsa_sigs = sum([len(tx['vin']) for tx in vtx])
+    ecdsa_sigs = sum([len(tx.vin) for tx in vtx])
 
     # One RedJubjub signature per Sapling spend (spendAuthSig) and per transaction (bindingSig)
-    redjubjub_sigs = sum([tx['nShieldedSpend'] + (
-        1 if tx['nShieldedSpend'] + tx['nShieldedOutput'] > 0 else 0) for tx in vtx])
+    redjubjub_sigs = sum([len(tx.shieldedSpends) + (
+        1 if len(tx.shieldedSpends) + len(tx.shieldedOutputs) > 0 else 0) for tx in vtx])
 
     # One Ed25519 signature per transaction that contains JoinSplits
-    ed25519_sigs = sum([1 if tx['nJoinSplit'] > 0 else 0 for tx in vtx])
+    ed25519_sigs = sum([1 if len(tx.vJoinSplit) > 0 else 0 for tx in vtx])
+
+    size = block.serialized_size()
+    assert len(block.serialize()) == size
 
-    print('- Block size:          ', block_size(vtx), 'bytes')
+    print('- Block size:          ', size, 'bytes')
     print('- Transactions:        ', len(vtx))
     print('- Proofs:              ', proofs)
     print('- ECDSA signatures:    ', ecdsa_sigs)
@@ -173,7 +199,7 @@ def print_makeup(vtx, times):
 #
 
 def worst_case_one_sapling_spend_per_tx(times):
-    vtx = worst_case_many_identical_txs({
+    block = worst_case_many_identical_txs({
         'vin': [],
         'vout': [],
         'nShieldedSpend': 1,
@@ -181,17 +207,17 @@ def worst_case_one_sapling_spend_per_tx(times):
         'nJoinSplit': 0,
     })
     print('One Sapling spend per transaction:')
-    print_makeup(vtx, times)
+    print_makeup(block, times)
     print()
 
 def worst_case_one_tx_containing_sapling_spends(times):
-    vtx = worst_case_one_tx_containing('nShieldedSpend')
+    block = worst_case_one_tx_containing('nShieldedSpend')
     print('One transaction containing Sapling spends:')
-    print_makeup(vtx, times)
+    print_makeup(block, times)
     print()
 
 def worst_case_one_sapling_output_per_tx(times):
-    vtx = worst_case_many_identical_txs({
+    block = worst_case_many_identical_txs({
         'vin': [],
         'vout': [],
         'nShieldedSpend': 0,
@@ -199,17 +225,17 @@ def worst_case_one_sapling_output_per_tx(times):
         'nJoinSplit': 0,
     })
     print('One Sapling output per transaction:')
-    print_makeup(vtx, times)
+    print_makeup(block, times)
     print()
 
 def worst_case_one_tx_containing_sapling_outputs(times):
-    vtx = worst_case_one_tx_containing('nShieldedOutput')
+    block = worst_case_one_tx_containing('nShieldedOutput')
     print('One transaction containing Sapling outputs:')
-    print_makeup(vtx, times)
+    print_makeup(block, times)
     print()
 
 def worst_case_one_joinsplit_per_tx(times):
-    vtx = worst_case_many_identical_txs({
+    block = worst_case_many_identical_txs({
         'vin': [],
         'vout': [],
         'nShieldedSpend': 0,
@@ -217,13 +243,13 @@ def worst_case_one_joinsplit_per_tx(times):
         'nJoinSplit': 1,
     })
     print('One JoinSplit per transaction:')
-    print_makeup(vtx, times)
+    print_makeup(block, times)
     print()
 
 def worst_case_one_tx_containing_joinsplits(times):
-    vtx = worst_case_one_tx_containing('nJoinSplit')
+    block = worst_case_one_tx_containing('nJoinSplit')
     print('One transaction containing JoinSplits:')
-    print_makeup(vtx, times)
+    print_makeup(block, times)
     print()
 
 
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 The Zcash developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://www.opensource.org/licenses/mit-license.php .
+
+#
+# blockfiles.py
+#
+# Streaming access to the blk?????.dat files written by a node, so that a
+# test (or a one-off analysis) can walk a whole chain without fetching every
+# block over RPC.
+#
+# Each record in a block file is the network magic, a uint32 length, and the
+# serialized block. Zcash headers carry a variable-length Equihash solution,
+# so unlike contrib/linearize/linearize-data.py this never assumes a fixed
+# header size: records are delimited by their length prefix, and headers are
+# measured by decoding the solution's compact size. Files are memory-mapped,
+# and blocks are decoded as LazyBlocks over the mapping, so transaction data
+# is neither copied nor parsed until it is accessed.
+#
+
+from collections import namedtuple
+import mmap
+import os
+import re
+
+from .mininode import (
+    _HEADER_FIELDS,
+    _UINT32,
+    BytesCursor,
+    CBlockHeader,
+    LazyBlock,
+    NodeConn,
+    deser_compact_size,
+    hash256,
+    uint256_from_str,
+)
+
+REGTEST_MAGIC = NodeConn.MAGIC_BYTES["regtest"]
+
+_BLOCK_FILE_NAME = re.compile(r"^blk(\d{5})\.dat$")
+
+# The location of a serialized block: the file holding it, the offset of the
+# block itself (after the magic and length), and its size in bytes.
+BlockExtent = namedtuple("BlockExtent", ["path", "offset", "size"])
+
+
+def node_blocks_dir(dirname, n_node):
+    """The blocks directory of regtest node n_node under dirname (see
+    util.initialize_datadir)."""
+    return os.path.join(dirname, "node" + str(n_node), "regtest", "blocks")
+
+
+def block_file_paths(blocks_dir):
+    """The paths of the blk?????.dat files in blocks_dir, in file number
+    order."""
+    numbered = []
+    for name in os.listdir(blocks_dir):
+        m = _BLOCK_FILE_NAME.match(name)
+        if m is not None:
+            numbered.append((int(m.group(1)), os.path.join(blocks_dir, name)))
+    return [path for (_, path) in sorted(numbered)]
+
+
+def header_size(buf, offset=0):
+    """The size of the block header serialized at offset in buf."""
+    f = BytesCursor(buf, offset + _HEADER_FIELDS.size)
+    solution_size = deser_compact_size(f)
+    return f.tell() - offset + solution_size
+
+
+class BlockFile(object):
+    """A read-only memory mapping of one block file.
+
+    Blocks returned by blocks() and block() are views of the mapping. close()
+    releases the mapping immediately if none of them are still referenced, and
+    otherwise when the last one is garbage collected.
+    """
+    def __init__(self, path, magic=REGTEST_MAGIC):
+        self.path = path
+        self.magic = magic
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.buf = memoryview(self.map)
+            else:
+                # An empty file cannot be mapped.
+                self.map = None
+                self.buf = memoryview(b"")
+
+    def close(self):
+        if self.map is not None:
+            self.buf.release()
+            try:
+                self.map.close()
+            except BufferError:
+                # Some decoded block still holds a view of the mapping.
+                pass
+            self.map = None
+        self.buf = memoryview(b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def extents(self):
+        """Yield the BlockExtent of every complete record in the file.
+
+        Scanning stops at the zero-filled space that the node preallocates
+        past the last record, and at a truncated record (one that the node is
+        still writing).
+        """
+        buf = self.buf
+        end = len(buf)
+        offset = 0
+        while offset + 8 <= end:
+            magic = buf[offset:offset + 4]
+            if magic != self.magic:
+                if magic == b"\x00\x00\x00\x00":
+                    return
+                raise ValueError("%s: unexpected message start %s at offset %d"
+                                 % (self.path, magic.hex(), offset))
+            (size,) = _UINT32.unpack_from(buf, offset + 4)
+            offset += 8
+            if offset + size > end:
+                return
+            yield BlockExtent(self.path, offset, size)
+            offset += size
+
+    def read(self, extent):
+        """A view of the serialized block at extent."""
+        return self.buf[extent.offset:extent.offset + extent.size]
+
+    def block(self, extent, block_class=LazyBlock):
+        """Decode the block at extent, which must fill it exactly."""
+        f = BytesCursor(self.read(extent))
+        block = block_class()
+        block.deserialize(f)
+        if f.remaining() != 0:
+            raise ValueError("%s: %d bytes left after the block at offset %d"
+                             % (self.path, f.remaining(), extent.offset))
+        return block
+
+    def header(self, extent):
+        """Decode only the header of the block at extent."""
+        header = CBlockHeader()
+        header.deserialize(BytesCursor(self.read(extent)))
+        return header
+
+    def header_hash(self, extent):
+        """The block hash of the block at extent, without decoding it."""
+        buf = self.read(extent)
+        return uint256_from_str(hash256(buf[:header_size(buf)]))
+
+    def blocks(self, block_class=LazyBlock):
+        """Yield (extent, block) for every block in the file."""
+        for extent in self.extents():
+            yield (extent, self.block(extent, block_class))
+
+
+def iter_blocks(blocks_dir, magic=REGTEST_MAGIC, block_class=LazyBlock):
+    """Yield (extent, block) for every block in every block file in
+    blocks_dir, in storage order.
+
+    Storage order is not chain order: a node may store blocks that are not in
+    its best chain, and may store a block before its parent. Use index_blocks()
+    and chain_extents() to walk a chain.
+    """
+    for path in block_file_paths(blocks_dir):
+        with BlockFile(path, magic) as block_file:
+            for item in block_file.blocks(block_class):
+                yield item
+
+
+def index_blocks(blocks_dir, magic=REGTEST_MAGIC):
+    """Map the hash of every stored block to (hashPrevBlock, extent), reading
+    only the headers."""
+    index = {}
+    for path in block_file_paths(blocks_dir):
+        with BlockFile(path, magic) as block_file:
+            for extent in block_file.extents():
+                start = extent.offset
+                hashPrevBlock = uint256_from_str(block_file.buf[start + 4:start + 36])
+                index[block_file.header_hash(extent)] = (hashPrevBlock, extent)
+    return index
+
+
+def chain_extents(index, tip):
+    """The extents of the chain ending at the block with hash tip, from the
+    earliest stored ancestor to tip, given an index from index_blocks()."""
+    extents = []
+    block_hash = tip
+    while block_hash in index:
+        (block_hash, extent) = index[block_hash]
+        extents.append(extent)
+    extents.reverse()
+    return extents
+
+
+def read_chain(blocks_dir, tip, magic=REGTEST_MAGIC, block_class=LazyBlock):
+    """Yield (extent, block) for the chain ending at tip, in height order.
+
+    A block file is mapped when the chain first reaches a block stored in it,
+    and unmapped when the chain moves on to another file.
+    """
+    block_file = None
+    try:
+        for extent in chain_extents(index_blocks(blocks_dir, magic), tip):
+            if block_file is None or block_file.path != extent.path:
+                if block_file is not None:
+                    block_file.close()
+                block_file = BlockFile(extent.path, magic)
+            yield (extent, block_file.block(extent, block_class))
+    finally:
+        if block_file is not None:
+            block_file.close()
@@ -4,10 +4,9 @@
 #             and for constructing a getheaders message
 #
 
-from .mininode import CBlock, CBlockHeader, CBlockLocator, CTransaction, msg_block, msg_headers, msg_tx
+from .mininode import BytesCursor, CBlockHeader, CBlockLocator, CTransaction, LazyBlock, msg_block, msg_headers, msg_tx
 
 import sys
-from io import BytesIO
 import dbm.ndbm
 
 class BlockStore():
@@ -25,8 +24,8 @@ class BlockStore():
             serialized_block = self.blockDB[repr(blockhash)]
         except KeyError:
             return None
-        f = BytesIO(serialized_block)
-        ret = CBlock()
+        f = BytesCursor(serialized_block)
+        ret = LazyBlock()
         ret.deserialize(f)
         ret.calc_sha256()
         return ret
@@ -119,7 +118,7 @@ class TxStore(object):
             serialized_tx = self.txDB[repr(txhash)]
         except KeyError:
             return None
-        f = BytesIO(serialized_tx)
+        f = BytesCursor(serialized_tx)
         ret = CTransaction()
         ret.deserialize(f)
         ret.calc_sha256()
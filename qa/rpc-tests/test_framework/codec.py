@@ -0,0 +1,656 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 The Zcash developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://www.opensource.org/licenses/mit-license.php .
+
+#
+# codec.py
+#
+# Encoders and decoders generated from declarative field schemas.
+#
+# A class lists its wire fields in a schema attribute, and the schema_codec
+# decorator generates flat deserialize, serialize_into and serialized_size
+# methods for it when the class is defined. Runs of consecutive fixed-width
+# fields are read and written with a single precompiled Struct, compact
+# sizes are parsed inline, and vectors of fixed-width elements are decoded
+# with one iter_unpack, so the per-field work of the hand-written methods
+# is done once, at import time. Decoders have a second body for a
+# BytesCursor, which unpacks the fixed-width fields from its buffer in place:
+#
+#     @schema_codec
+#     class CBlockLocator(Serializable):
+#         schema = (
+#             ("nVersion", INT32),
+#             ("vHave", Vector(UINT256)),
+#         )
+#
+# A field type is a Fixed, VarBytes, LazyBytes or Vector instance, or a
+# class whose instances implement deserialize(f) and serialize_into(w). An
+# If entry makes a group of fields conditional on an expression over the
+# fields decoded before it.
+#
+
+import linecache
+import socket
+import struct
+
+_UINT8 = struct.Struct("<B")
+_UINT16 = struct.Struct("<H")
+_UINT32 = struct.Struct("<I")
+_UINT64 = struct.Struct("<Q")
+_COMPACT_SIZE_TAILS = {253: _UINT16, 254: _UINT32, 255: _UINT64}
+
+
+class BytesCursor(object):
+    """A read cursor over an immutable byte buffer.
+
+    This can be passed to any deserialize(f) in place of a BytesIO. Instead of
+    copying, read() returns memoryview slices of the underlying buffer, so
+    large fields (proofs, ciphertexts, Equihash solutions) are only copied if
+    and when they are accessed (see LazySlice), while fixed-width fields are
+    unpacked straight from the buffer (see deser_struct). Unlike BytesIO,
+    read(n) raises ValueError if fewer than n bytes are left.
+    """
+    def __init__(self, data, offset=0):
+        if isinstance(data, bytearray):
+            # Slices must not observe later writes to the source buffer.
+            data = bytes(data)
+        self.buf = memoryview(data)
+        # Fixed-width fields are unpacked from the source itself when it is
+        # bytes, which is faster than going through the view.
+        self.data = data if type(data) is bytes else self.buf
+        self.offset = offset
+
+    def read(self, n=-1):
+        start = self.offset
+        if n < 0:
+            end = len(self.buf)
+        else:
+            end = start + n
+            if end > len(self.buf):
+                raise ValueError("read past end of buffer")
+        self.offset = end
+        return self.buf[start:end]
+
+    def skip(self, n):
+        if self.offset + n > len(self.buf):
+            raise ValueError("read past end of buffer")
+        self.offset += n
+
+    def tell(self):
+        return self.offset
+
+    def seek(self, offset):
+        self.offset = offset
+
+    def remaining(self):
+        return len(self.buf) - self.offset
+
+
+def read_exact(f, n):
+    """Read n bytes from f, raising ValueError if it ends first."""
+    data = f.read(n)
+    if len(data) != n:
+        raise ValueError("read past end of buffer")
+    return data
+
+
+def deser_struct(f, s):
+    """Decode the fields of the Struct s from f, raising ValueError if it
+    ends first. A BytesCursor is decoded in place, without slicing."""
+    if type(f) is BytesCursor:
+        offset = f.offset
+        end = offset + s.size
+        if end > len(f.data):
+            raise ValueError("read past end of buffer")
+        f.offset = end
+        return s.unpack_from(f.data, offset)
+    data = f.read(s.size)
+    if len(data) != s.size:
+        raise ValueError("read past end of buffer")
+    return s.unpack(data)
+
+
+def deser_compact_size(f):
+    if type(f) is BytesCursor:
+        offset = f.offset
+        if offset >= len(f.data):
+            raise ValueError("read past end of buffer")
+        nit = f.data[offset]
+        f.offset = offset + 1
+    else:
+        nit = deser_struct(f, _UINT8)[0]
+    if nit >= 253:
+        nit = read_compact_size_tail(f, nit)
+    return nit
+
+
+def read_compact_size_tail(f, first):
+    """Read the rest of a compact size whose first byte (253, 254 or 255)
+    has already been read."""
+    return deser_struct(f, _COMPACT_SIZE_TAILS[first])[0]
+
+
+def ser_compact_size(l):
+    if l < 253:
+        return _UINT8.pack(l)
+    elif l < 0x10000:
+        return b"\xfd" + _UINT16.pack(l)
+    elif l < 0x100000000:
+        return b"\xfe" + _UINT32.pack(l)
+    else:
+        return b"\xff" + _UINT64.pack(l)
+
+
+def compact_size_len(l):
+    """The length of ser_compact_size(l) (GetSizeOfCompactSize)."""
+    if l < 253:
+        return 1
+    elif l < 0x10000:
+        return 3
+    elif l < 0x100000000:
+        return 5
+    else:
+        return 9
+
+
+#
+# Field types
+#
+
+class Fixed(object):
+    """A fixed-width field, encoded with the struct format fmt.
+
+    decode and encode are optional expressions, with {} standing for the
+    value, that convert between the unpacked value and the attribute.
+    """
+    def __init__(self, fmt, decode=None, encode=None):
+        if fmt[0] in "<>":
+            (self.order, self.code) = (fmt[0], fmt[1:])
+        else:
+            (self.order, self.code) = ("<", fmt)
+        if self.code.endswith("s"):
+            # Byte strings can share a Struct with either byte order.
+            self.order = None
+        self.size = struct.calcsize("<" + self.code)
+        self.decode = decode
+        self.encode = encode
+
+
+class VarBytes(object):
+    """A byte string prefixed with its compact size length."""
+
+
+class LazyBytes(object):
+    """A byte string of the given size, for large fields such as proofs and
+    ciphertexts. Decoding a BytesCursor sets the field to a memoryview slice
+    of its buffer, so the class must declare it as a LazySlice (see
+    mininode.py), whose raw value in '_' + name is what is encoded."""
+    def __init__(self, size):
+        self.size = size
+        # Skipped by the Struct of the run the field is decoded in.
+        self.code = "%dx" % size
+        self.order = None
+
+
+class Vector(object):
+    """A compact size count followed by that many elements."""
+    def __init__(self, element):
+        if isinstance(element, (Vector, If, LazyBytes)):
+            raise TypeError("vectors of %r are not supported" % (element,))
+        self.element = element
+
+
+def FixedBytes(size):
+    return Fixed("%ds" % size)
+
+
+class If(object):
+    """Fields that are present only when condition, an expression over
+    self, is true. When decoding an encoding without them they are set to
+    absent, or left unchanged if absent is UNCHANGED."""
+    def __init__(self, condition, fields, absent=None):
+        self.condition = condition
+        self.fields = tuple(fields)
+        self.absent = absent
+
+
+UNCHANGED = object()
+
+UINT8 = Fixed("<B")
+UINT16 = Fixed("<H")
+UINT16_BE = Fixed(">H")
+INT32 = Fixed("<i")
+UINT32 = Fixed("<I")
+INT64 = Fixed("<q")
+UINT64 = Fixed("<Q")
+UINT256 = Fixed("32s",
+                decode="int.from_bytes({}, 'little')",
+                encode="({} & UINT256_MASK).to_bytes(32, 'little')")
+IPV4 = Fixed("4s", decode="inet_ntoa({})", encode="inet_aton({})")
+STRING = VarBytes()
+
+
+#
+# Code generation
+#
+
+class _CodeWriter(object):
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.lines = []
+        self.depth = 1
+        self.temps = 0
+
+    def line(self, text):
+        self.lines.append("    " * self.depth + text)
+
+    def generate(self, gen, *args):
+        """Run gen(self, *args) and return the lines it emitted."""
+        start = len(self.lines)
+        gen(self, *args)
+        return self.lines[start:]
+
+    def temp(self, prefix="_v"):
+        self.temps += 1
+        return "%s%d" % (prefix, self.temps)
+
+    def ref(self, value, prefix="_K"):
+        """A name for value in the generated code's globals."""
+        for (name, existing) in self.namespace.items():
+            if existing is value and name.startswith(prefix):
+                return name
+        name = "%s%d" % (prefix, len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+
+def _fixed_runs(fields, lazy=False):
+    """Split fields into runs of consecutive Fixed fields that can share a
+    Struct, and single other entries. With lazy, runs include the LazyBytes
+    fields among them."""
+    kinds = (Fixed, LazyBytes) if lazy else Fixed
+    run = []
+    order = None
+    for entry in fields:
+        if isinstance(entry, If) or not isinstance(entry[1], kinds):
+            if run:
+                yield (order or "<", run)
+                (run, order) = ([], None)
+            yield (None, entry)
+            continue
+        kind = entry[1]
+        if run and kind.order is not None and order is not None and kind.order != order:
+            yield (order, run)
+            (run, order) = ([], None)
+        run.append(entry)
+        order = order or kind.order
+    if run:
+        yield (order or "<", run)
+
+
+def _run_struct(code, order, run):
+    return code.ref(struct.Struct(order + "".join(kind.code for (_, kind) in run)), "_S")
+
+
+def _field_names(fields):
+    for entry in fields:
+        if isinstance(entry, If):
+            for name in _field_names(entry.fields):
+                yield name
+        else:
+            yield entry[0]
+
+
+def _read_compact_size(code, target, cursor):
+    if cursor:
+        code.line("%s = _r[_p]" % target)
+        code.line("_p += 1")
+        code.line("if %s >= 253:" % target)
+        code.line("    f.offset = _p")
+        code.line("    %s = read_compact_size_tail(f, %s)" % (target, target))
+        code.line("    _p = f.offset")
+    else:
+        code.line("%s = deser_compact_size(f)" % target)
+
+
+def _gen_decode(code, fields, cursor, obj="self"):
+    for (order, entry) in _fixed_runs(fields, lazy=True):
+        if order is not None:
+            targets = []
+            conversions = []
+            slices = []
+            offset = 0
+            for (name, kind) in entry:
+                if isinstance(kind, LazyBytes):
+                    slices.append((name, offset, offset + kind.size))
+                elif kind.decode is None:
+                    targets.append("%s.%s" % (obj, name))
+                else:
+                    temp = code.temp()
+                    targets.append(temp)
+                    conversions.append("%s.%s = %s" % (obj, name, kind.decode.format(temp)))
+                offset += kind.size
+            s = _run_struct(code, order, entry)
+            unpacked = "(%s,) = " % ", ".join(targets) if targets else ""
+            if cursor:
+                # The unpack also checks that the slices are inside the
+                # buffer.
+                code.line("%s%s.unpack_from(_r, _p)" % (unpacked, s))
+                for (name, start, end) in slices:
+                    if obj != "self":
+                        # A new object, which cannot have owners to
+                        # invalidate yet, so the raw value is set directly.
+                        name = "_" + name
+                    code.line("%s.%s = _b[_p + %d:_p + %d]" % (obj, name, start, end))
+                code.line("_p += %d" % offset)
+            elif not slices:
+                code.line("%s%s.unpack(read_exact(f, %d))" % (unpacked, s, offset))
+            else:
+                code.line("_d = read_exact(f, %d)" % offset)
+                code.line("%s%s.unpack(_d)" % (unpacked, s))
+                for (name, start, end) in slices:
+                    code.line("%s.%s = _d[%d:%d]" % (obj, name, start, end))
+            for conversion in conversions:
+                code.line(conversion)
+        elif isinstance(entry, If):
+            code.line("if %s:" % entry.condition)
+            code.depth += 1
+            _gen_decode(code, entry.fields, cursor, obj)
+            code.depth -= 1
+            if entry.absent is not UNCHANGED:
+                absent = code.ref(entry.absent)
+                code.line("else:")
+                for name in _field_names(entry.fields):
+                    code.line("    %s.%s = %s" % (obj, name, absent))
+        else:
+            (name, kind) = entry
+            code.line("%s.%s = %s" % (obj, name, _decode_value(code, kind, cursor)))
+
+
+def _decode_value(code, kind, cursor):
+    """Emit the statements that decode a value of kind, and return an
+    expression for it."""
+    if isinstance(kind, Fixed):
+        s = code.ref(struct.Struct((kind.order or "<") + kind.code), "_S")
+        if cursor:
+            value = code.temp()
+            code.line("%s = %s.unpack_from(_r, _p)[0]" % (value, s))
+            code.line("_p += %d" % kind.size)
+        else:
+            value = "%s.unpack(read_exact(f, %d))[0]" % (s, kind.size)
+        return value if kind.decode is None else kind.decode.format(value)
+    if isinstance(kind, VarBytes):
+        n = code.temp("_n")
+        _read_compact_size(code, n, cursor)
+        if not cursor:
+            return "bytes(read_exact(f, %s))" % n
+        end = code.temp("_e")
+        _check_end(code, end, n)
+        value = code.temp()
+        code.line("%s = _r[_p:%s] if _r is not _b else bytes(_b[_p:%s])" % (value, end, end))
+        code.line("_p = %s" % end)
+        return value
+    if isinstance(kind, Vector):
+        n = code.temp("_n")
+        _read_compact_size(code, n, cursor)
+        element = kind.element
+        if isinstance(element, Fixed):
+            s = code.ref(struct.Struct((element.order or "<") + element.code), "_S")
+            value = "_e" if element.decode is None else element.decode.format("_e")
+            if not cursor:
+                return "[%s for (_e,) in %s.iter_unpack(read_exact(f, %s * %d))]" % (value, s, n, element.size)
+            end = code.temp("_e")
+            _check_end(code, end, "%s * %d" % (n, element.size))
+            items = code.temp("_items")
+            code.line("%s = [%s for (_e,) in %s.iter_unpack(_r[_p:%s])]" % (items, value, s, end))
+            code.line("_p = %s" % end)
+            return items
+        items = code.temp("_items")
+        code.line("%s = []" % items)
+        code.line("for _ in range(%s):" % n)
+        code.depth += 1
+        code.line("%s.append(%s)" % (items, _decode_value(code, element, cursor)))
+        code.depth -= 1
+        return items
+    # A class
+    obj = code.temp("_o")
+    code.line("%s = %s()" % (obj, code.ref(kind, "_C")))
+    if cursor and _inlinable(kind):
+        # Decode the fields in place, instead of syncing the cursor around
+        # a call to the class's own decoder.
+        _gen_decode(code, kind.schema, True, obj)
+    elif cursor:
+        code.line("f.offset = _p")
+        code.line("%s.deserialize(f)" % obj)
+        code.line("_p = f.offset")
+    else:
+        code.line("%s.deserialize(f)" % obj)
+    return obj
+
+
+def _inlinable(cls):
+    """Whether the decoder of cls is one generated from its schema, without
+    conditions on its own fields, which can be emitted in place of a call
+    to it."""
+    schema = cls.__dict__.get("schema")
+    return (schema is not None and
+            cls.__dict__.get("deserialize") is cls.__dict__.get("deserialize_fields") and
+            not any(isinstance(entry, If) for entry in schema))
+
+
+def _check_end(code, end, size):
+    """Emit statements that set end to the offset size bytes past _p, and
+    raise ValueError if that is past the end of the cursor's buffer."""
+    code.line("%s = _p + %s" % (end, size))
+    code.line("if %s > len(_r):" % end)
+    code.line("    raise ValueError('read past end of buffer')")
+
+
+def _gen_decoder(code, gen):
+    """Emit a decoder with two bodies: gen(code, True) reads a BytesCursor
+    in place, unpacking fixed-width fields from its buffer at the offset
+    _p, and gen(code, False) reads any other stream."""
+    if not _CodeWriter(code.namespace).generate(gen, False):
+        # Nothing to decode.
+        return
+    code.line("if type(f) is BytesCursor:")
+    code.depth += 1
+    code.line("(_b, _r, _p) = (f.buf, f.data, f.offset)")
+    code.line("try:")
+    code.depth += 1
+    gen(code, True)
+    code.line("f.offset = _p")
+    code.depth -= 1
+    # unpack_from and indexing fail this way at the end of the buffer.
+    code.line("except (struct.error, IndexError):")
+    code.line("    raise ValueError('read past end of buffer') from None")
+    code.depth -= 1
+    code.line("else:")
+    code.depth += 1
+    gen(code, False)
+    code.depth -= 1
+
+
+def _gen_encode(code, fields):
+    for (order, entry) in _fixed_runs(fields):
+        if order is not None:
+            values = []
+            for (name, kind) in entry:
+                value = "self.%s" % name
+                values.append(value if kind.encode is None else kind.encode.format(value))
+            code.line("w += %s.pack(%s)" % (_run_struct(code, order, entry), ", ".join(values)))
+        elif isinstance(entry, If):
+            code.line("if %s:" % entry.condition)
+            code.depth += 1
+            _gen_encode(code, entry.fields)
+            code.depth -= 1
+        elif isinstance(entry[1], LazyBytes):
+            code.line("w += self._%s" % entry[0])
+        else:
+            (name, kind) = entry
+            _encode_value(code, kind, "self.%s" % name)
+
+
+def _encode_value(code, kind, value):
+    if isinstance(kind, Fixed):
+        s = code.ref(struct.Struct((kind.order or "<") + kind.code), "_S")
+        code.line("w += %s.pack(%s)" % (s, value if kind.encode is None else kind.encode.format(value)))
+    elif isinstance(kind, VarBytes):
+        v = code.temp()
+        code.line("%s = %s" % (v, value))
+        code.line("w += ser_compact_size(len(%s))" % v)
+        code.line("w += %s" % v)
+    elif isinstance(kind, Vector):
+        v = code.temp()
+        code.line("%s = %s" % (v, value))
+        code.line("w += ser_compact_size(len(%s))" % v)
+        element = kind.element
+        if isinstance(element, Fixed) and element.code.endswith("s"):
+            # Byte string elements need no packing.
+            value = "_e" if element.encode is None else element.encode.format("_e")
+            code.line("w += b''.join([%s for _e in %s])" % (value, v))
+        elif isinstance(element, Fixed) and element.encode is None:
+            code.line("w += struct.pack('%s%%d%s' %% len(%s), *%s)"
+                      % (element.order, element.code, v, v))
+        elif isinstance(element, Fixed):
+            s = code.ref(struct.Struct(element.order + element.code), "_S")
+            code.line("w += b''.join([%s.pack(%s) for _e in %s])"
+                      % (s, element.encode.format("_e"), v))
+        else:
+            e = code.temp("_e")
+            code.line("for %s in %s:" % (e, v))
+            code.depth += 1
+            _encode_value(code, element, e)
+            code.depth -= 1
+    else:
+        code.line("%s.serialize_into(w)" % value)
+
+
+def _gen_size(code, fields):
+    """Emit statements adding the variable part of the size of fields to
+    size, and return the fixed part."""
+    fixed = 0
+    for entry in fields:
+        if isinstance(entry, If):
+            code.line("if %s:" % entry.condition)
+            code.depth += 1
+            start = len(code.lines)
+            inner = _gen_size(code, entry.fields)
+            if inner:
+                code.line("size += %d" % inner)
+            elif len(code.lines) == start:
+                code.line("pass")
+            code.depth -= 1
+            continue
+        (name, kind) = entry
+        if isinstance(kind, (Fixed, LazyBytes)):
+            fixed += kind.size
+            continue
+        v = code.temp()
+        code.line("%s = self.%s" % (v, name))
+        if isinstance(kind, VarBytes):
+            code.line("size += compact_size_len(len(%s)) + len(%s)" % (v, v))
+        elif isinstance(kind, Vector):
+            element = kind.element
+            if isinstance(element, Fixed):
+                code.line("size += compact_size_len(len(%s)) + len(%s) * %d" % (v, v, element.size))
+            elif isinstance(element, VarBytes):
+                code.line("size += compact_size_len(len(%s)) + sum([compact_size_len(len(_e)) + len(_e) for _e in %s])" % (v, v))
+            else:
+                code.line("size += compact_size_len(len(%s)) + sum([_e.serialized_size() for _e in %s])" % (v, v))
+        else:
+            code.line("size += %s.serialized_size()" % v)
+    return fixed
+
+
+def _compile(qualname, code, signature, prologue=(), epilogue=()):
+    name = qualname.rsplit(".", 1)[-1]
+    body = list(prologue) + code.lines + list(epilogue)
+    if not body:
+        body = ["    pass"]
+    source = "def %s(%s):\n%s\n" % (name, signature, "\n".join(body))
+    filename = "<codec %s>" % qualname
+    # Make the generated source visible in tracebacks.
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    exec(compile(source, filename, "exec"), code.namespace)
+    function = code.namespace.pop(name)
+    function.__qualname__ = qualname
+    function.source = source
+    return function
+
+
+def _namespace():
+    return {
+        "struct": struct,
+        "inet_aton": socket.inet_aton,
+        "inet_ntoa": socket.inet_ntoa,
+        "UINT256_MASK": (1 << 256) - 1,
+        "BytesCursor": BytesCursor,
+        "deser_compact_size": deser_compact_size,
+        "read_compact_size_tail": read_compact_size_tail,
+        "read_exact": read_exact,
+        "ser_compact_size": ser_compact_size,
+        "compact_size_len": compact_size_len,
+    }
+
+
+def schema_codec(cls):
+    """Class decorator that generates the codec for cls.schema.
+
+    The generated methods are always installed as deserialize_fields and
+    serialize_fields_into, and as deserialize, serialize_into and
+    serialized_size unless cls defines those itself, so a class can wrap
+    the generated codec with its own fixups. deserialize_vector(f) decodes
+    a compact size count of instances of cls in one loop.
+    """
+    schema = cls.__dict__["schema"]
+    prefix = cls.__qualname__ + "."
+
+    code = _CodeWriter(_namespace())
+    _gen_decoder(code, lambda code, cursor: _gen_decode(code, schema, cursor))
+    decode = _compile(prefix + "deserialize_fields", code, "self, f")
+
+    code = _CodeWriter(_namespace())
+    _gen_encode(code, schema)
+    encode = _compile(prefix + "serialize_fields_into", code, "self, w")
+
+    code = _CodeWriter(_namespace())
+    fixed = _gen_size(code, schema)
+    size = _compile(prefix + "serialized_size", code, "self",
+                    prologue=["    size = %d" % fixed], epilogue=["    return size"])
+
+    cls.deserialize_fields = decode
+    cls.serialize_fields_into = encode
+    for (name, function) in (("deserialize", decode),
+                             ("serialize_into", encode),
+                             ("serialized_size", size)):
+        function.__module__ = cls.__module__
+        if name not in cls.__dict__:
+            setattr(cls, name, function)
+    # Generated last, so that the elements are decoded in place if the
+    # generated decoder is cls's own.
+    cls.deserialize_vector = staticmethod(
+        _vector_decoder(cls, prefix + "deserialize_vector"))
+    return cls
+
+
+def _vector_decoder(element, qualname):
+    def gen(code, cursor):
+        code.line("_result = %s" % _decode_value(code, Vector(element), cursor))
+
+    code = _CodeWriter(_namespace())
+    _gen_decoder(code, gen)
+    return _compile(qualname, code, "f", epilogue=["    return _result"])
+
+
+def vector_codec(element):
+    """Generate a (deser, ser) pair of functions for a vector of element,
+    where deser(f) returns a list and ser(l) returns bytes."""
+    deser = _vector_decoder(element, "vector_codec.deser")
+
+    code = _CodeWriter(_namespace())
+    _encode_value(code, Vector(element), "l")
+    ser = _compile("vector_codec.ser", code, "l",
+                   prologue=["    w = bytearray()"], epilogue=["    return bytes(w)"])
+    return (deser, ser)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 The Zcash developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://www.opensource.org/licenses/mit-license.php .
+
+#
+# columnar.py
+#
+# Columnar representation of v5 Sapling and Orchard bundles, backed by NumPy
+# structured arrays. Each description is a fixed-size record, so a bundle's
+# spends, outputs and actions can be held as one array per vector in exactly
+# their wire layout: serialization is a single copy of each array, and the
+# ZIP 244 digests hash contiguous column buffers instead of iterating over
+# Python objects (see zip244.py).
+#
+# NumPy is optional; the rest of the test framework does not depend on this
+# module's classes being usable.
+#
+
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .mininode import (
+    BytesCursor,
+    CBlock,
+    CTransaction,
+    DigestCache,
+    ORCHARD_FLAGS_ENABLE_OUTPUTS,
+    ORCHARD_FLAGS_ENABLE_SPENDS,
+    OrchardBundle,
+    SaplingBundle,
+    TrackedObject,
+    deser_compact_size,
+    compact_size_len,
+    deser_struct,
+    deser_uint256,
+    read_exact,
+    ser_compact_size,
+    ser_uint256,
+)
+
+GROTH16_PROOF_SIZE = 192
+SIGNATURE_SIZE = 64
+
+_UINT8 = struct.Struct("B")
+_INT64 = struct.Struct("<q")
+
+if np is not None:
+    def _byte_fields(*fields):
+        return np.dtype([(name, np.uint8, (size,)) for (name, size) in fields])
+
+    # vSpendsSapling
+    SAPLING_SPEND_DTYPE = _byte_fields(
+        ("cv", 32), ("nullifier", 32), ("rk", 32))
+    # vOutputsSapling
+    SAPLING_OUTPUT_DTYPE = _byte_fields(
+        ("cv", 32), ("cmu", 32), ("ephemeralKey", 32),
+        ("encCiphertext", 580), ("outCiphertext", 80))
+    # vActionsOrchard
+    ORCHARD_ACTION_DTYPE = _byte_fields(
+        ("cv", 32), ("nullifier", 32), ("rk", 32), ("cmx", 32),
+        ("ephemeralKey", 32), ("encCiphertext", 580), ("outCiphertext", 80))
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("the columnar bundle representation requires NumPy")
+
+
+def read_records(f, dtype, count):
+    """Read count fixed-size records of dtype from f.
+
+    When f is a BytesCursor the array is a read-only view of its buffer.
+    """
+    return np.frombuffer(read_exact(f, count * dtype.itemsize), dtype=dtype)
+
+
+def read_rows(f, width, count):
+    return np.frombuffer(read_exact(f, count * width), dtype=np.uint8).reshape(count, width)
+
+
+def row_bytes(records, *columns):
+    """Concatenate the given columns of every record, record by record, into
+    one buffer.
+
+    A column is a field name, a (name, start, stop) byte range within a
+    field, or a bytes value that is repeated for every record.
+    """
+    parts = []
+    for column in columns:
+        if isinstance(column, str):
+            parts.append(records[column])
+        elif isinstance(column, tuple):
+            (name, start, stop) = column
+            parts.append(records[name][:, start:stop])
+        else:
+            row = np.frombuffer(column, dtype=np.uint8)
+            parts.append(np.broadcast_to(row, (len(records), len(row))))
+    return np.concatenate(parts, axis=1).tobytes()
+
+
+class ColumnarSaplingBundle(DigestCache, TrackedObject):
+    """A SaplingBundle held as arrays.
+
+    spends and outputs are structured arrays in the layout of
+    vSpendsSapling and vOutputsSapling; spendProofs, spendAuthSigs and
+    outputProofs have one row per description. Replacing an array
+    invalidates the enclosing transaction and the bundle's cached digests,
+    but modifying one in place does not; arrays decoded from a BytesCursor
+    are read-only views of its buffer.
+    """
+    def __init__(self):
+        require_numpy()
+        self.spends = np.zeros(0, dtype=SAPLING_SPEND_DTYPE)
+        self.outputs = np.zeros(0, dtype=SAPLING_OUTPUT_DTYPE)
+        self.valueBalance = 0
+        self.anchor = None
+        self.spendProofs = np.zeros((0, GROTH16_PROOF_SIZE), dtype=np.uint8)
+        self.spendAuthSigs = np.zeros((0, SIGNATURE_SIZE), dtype=np.uint8)
+        self.outputProofs = np.zeros((0, GROTH16_PROOF_SIZE), dtype=np.uint8)
+        self.bindingSig = None
+
+    @classmethod
+    def from_bundle(cls, bundle):
+        columnar = cls()
+        columnar.deserialize(BytesCursor(bundle.serialize()))
+        return columnar
+
+    def to_bundle(self):
+        bundle = SaplingBundle()
+        bundle.deserialize(BytesCursor(self.serialize()))
+        return bundle
+
+    def deserialize(self, f):
+        self.spends = read_records(f, SAPLING_SPEND_DTYPE, deser_compact_size(f))
+        self.outputs = read_records(f, SAPLING_OUTPUT_DTYPE, deser_compact_size(f))
+        nSpends = len(self.spends)
+        nOutputs = len(self.outputs)
+        has_sapling = (nSpends + nOutputs) > 0
+        if has_sapling:
+            self.valueBalance = deser_struct(f, _INT64)[0]
+        if nSpends > 0:
+            self.anchor = deser_uint256(f)
+        self.spendProofs = read_rows(f, GROTH16_PROOF_SIZE, nSpends)
+        self.spendAuthSigs = read_rows(f, SIGNATURE_SIZE, nSpends)
+        self.outputProofs = read_rows(f, GROTH16_PROOF_SIZE, nOutputs)
+        if has_sapling:
+            self.bindingSig = bytes(read_exact(f, SIGNATURE_SIZE))
+
+    def serialize_into(self, w):
+        w += ser_compact_size(len(self.spends))
+        w += self.spends.tobytes()
+        w += ser_compact_size(len(self.outputs))
+        w += self.outputs.tobytes()
+        has_sapling = (len(self.spends) + len(self.outputs)) > 0
+        if has_sapling:
+            w += struct.pack("<q", self.valueBalance)
+        if len(self.spends) > 0:
+            w += ser_uint256(self.anchor)
+        w += self.spendProofs.tobytes()
+        w += self.spendAuthSigs.tobytes()
+        w += self.outputProofs.tobytes()
+        if has_sapling:
+            w += self.bindingSig
+
+    def serialized_size(self):
+        size = (compact_size_len(len(self.spends)) + self.spends.nbytes +
+                compact_size_len(len(self.outputs)) + self.outputs.nbytes +
+                self.spendProofs.nbytes + self.spendAuthSigs.nbytes +
+                self.outputProofs.nbytes)
+        if (len(self.spends) + len(self.outputs)) > 0:
+            size += 8 + SIGNATURE_SIZE
+        if len(self.spends) > 0:
+            size += 32
+        return size
+
+    def __repr__(self):
+        return "ColumnarSaplingBundle(spends=%i, outputs=%i, valueBalance=%i)" \
+            % (len(self.spends), len(self.outputs), self.valueBalance)
+
+
+class ColumnarOrchardBundle(DigestCache, TrackedObject):
+    """An OrchardBundle held as arrays.
+
+    actions is a structured array in the layout of vActionsOrchard, and
+    spendAuthSigs has one row per action. The same caveats as for
+    ColumnarSaplingBundle apply to in-place modification.
+    """
+    def __init__(self):
+        require_numpy()
+        self.actions = np.zeros(0, dtype=ORCHARD_ACTION_DTYPE)
+        self.enableSpends = False
+        self.enableOutputs = False
+        self.valueBalance = 0
+        self.anchor = None
+        self.proofs = b""
+        self.spendAuthSigs = np.zeros((0, SIGNATURE_SIZE), dtype=np.uint8)
+        self.bindingSig = None
+
+    @classmethod
+    def from_bundle(cls, bundle):
+        columnar = cls()
+        columnar.deserialize(BytesCursor(bundle.serialize()))
+        return columnar
+
+    def to_bundle(self):
+        bundle = OrchardBundle()
+        bundle.deserialize(BytesCursor(self.serialize()))
+        return bundle
+
+    def deserialize(self, f):
+        self.actions = read_records(f, ORCHARD_ACTION_DTYPE, deser_compact_size(f))
+        if len(self.actions) > 0:
+            flags = deser_struct(f, _UINT8)[0]
+            self.enableSpends = (flags & ORCHARD_FLAGS_ENABLE_SPENDS) != 0
+            self.enableOutputs = (flags & ORCHARD_FLAGS_ENABLE_OUTPUTS) != 0
+            self.valueBalance = deser_struct(f, _INT64)[0]
+            self.anchor = deser_uint256(f)
+            self.proofs = bytes(read_exact(f, deser_compact_size(f)))
+            self.spendAuthSigs = read_rows(f, SIGNATURE_SIZE, len(self.actions))
+            self.bindingSig = bytes(read_exact(f, SIGNATURE_SIZE))
+
+    def serialize_into(self, w):
+        w += ser_compact_size(len(self.actions))
+        w += self.actions.tobytes()
+        if len(self.actions) > 0:
+            w += struct.pack("B", self.flags())
+            w += struct.pack("<q", self.valueBalance)
+            w += ser_uint256(self.anchor)
+            w += ser_compact_size(len(self.proofs))
+            w += self.proofs
+            w += self.spendAuthSigs.tobytes()
+            w += self.bindingSig
+
+    def serialized_size(self):
+        size = compact_size_len(len(self.actions)) + self.actions.nbytes
+        if len(self.actions) > 0:
+            size += (1 + 8 + 32 + compact_size_len(len(self.proofs)) +
+                     len(self.proofs) + self.spendAuthSigs.nbytes + SIGNATURE_SIZE)
+        return size
+
+    flags = OrchardBundle.flags
+
+    def __repr__(self):
+        return "ColumnarOrchardBundle(actions=%i, enableSpends=%s, enableOutputs=%s, valueBalance=%i)" \
+            % (len(self.actions), self.enableSpends, self.enableOutputs, self.valueBalance)
+
+
+class ColumnarTransaction(CTransaction):
+    """A CTransaction whose v5 bundles are decoded into columnar form."""
+    sapling_bundle_class = ColumnarSaplingBundle
+    orchard_bundle_class = ColumnarOrchardBundle
+
+
+class ColumnarBlock(CBlock):
+    """A CBlock whose transactions are ColumnarTransactions."""
+    transaction_class = ColumnarTransaction
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 The Zcash developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://www.opensource.org/licenses/mit-license.php .
+
+#
+# corpus.py
+#
+# An indexed file format for saving serialized blocks and transactions once
+# and reloading them cheaply, e.g. for large generated test suites.
+#
+# Layout (all integers little-endian):
+#
+#   header   "ZcCorpus", uint32 version
+#   records  uint32 size, serialized object; repeated
+#   index    uint256 hash, uint8 type, uint64 offset, uint32 size; one entry
+#            per object, sorted by hash
+#   trailer  uint64 index offset, uint64 entry count, "ZcCorpus"
+#
+# The type is the CInv type of the object (1 for a transaction, 2 for a
+# block), and the offset is that of the serialized object within the file.
+# A Corpus memory-maps the file and binary-searches the index, so opening it
+# does not read the records, and looking an object up reads only the log2(n)
+# index entries visited and the object itself.
+#
+# Corpora are append-only: a CorpusWriter opened on an existing corpus cuts
+# off the index, appends new records after the old ones, and writes the
+# merged index when it is closed.
+#
+
+import mmap
+import os
+import struct
+
+from .blockfiles import REGTEST_MAGIC, BlockFile, block_file_paths
+from .mininode import (
+    _UINT32,
+    BytesCursor,
+    CTransaction,
+    LazyBlock,
+    msg_block,
+    msg_tx,
+    ser_uint256,
+    uint256_from_str,
+)
+
+CORPUS_MAGIC = b"ZcCorpus"
+CORPUS_VERSION = 1
+
+MSG_TX = 1
+MSG_BLOCK = 2
+
+_CORPUS_HEADER = struct.Struct("<8sI")
+_INDEX_ENTRY = struct.Struct("<32sBQI")
+_CORPUS_TRAILER = struct.Struct("<QQ8s")
+
+
+class CorpusError(Exception):
+    pass
+
+
+class Corpus(object):
+    """A read-only view of a corpus file.
+
+    Objects are looked up by hash (an integer, as in CBlock.sha256 and
+    CTransaction.sha256). Raw records and decoded objects are views of the
+    mapping; see blockfiles.BlockFile for how closing interacts with them.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _CORPUS_HEADER.size + _CORPUS_TRAILER.size:
+                raise CorpusError("%s: too short to be a corpus" % path)
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buf = memoryview(self.map)
+        (magic, version) = _CORPUS_HEADER.unpack_from(self.buf, 0)
+        if magic != CORPUS_MAGIC:
+            self.close()
+            raise CorpusError("%s: not a corpus" % path)
+        if version != CORPUS_VERSION:
+            self.close()
+            raise CorpusError("%s: unsupported corpus version %d" % (path, version))
+        (self.index_offset, self.count, magic) = _CORPUS_TRAILER.unpack_from(
+            self.buf, len(self.buf) - _CORPUS_TRAILER.size)
+        if (magic != CORPUS_MAGIC or
+                self.index_offset + self.count * _INDEX_ENTRY.size !=
+                len(self.buf) - _CORPUS_TRAILER.size):
+            self.close()
+            raise CorpusError("%s: missing or damaged index (was the writer closed?)" % path)
+
+    def close(self):
+        if self.map is not None:
+            self.buf.release()
+            try:
+                self.map.close()
+            except BufferError:
+                pass
+            self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def _entry(self, i):
+        return _INDEX_ENTRY.unpack_from(self.buf, self.index_offset + i * _INDEX_ENTRY.size)
+
+    def _find(self, key):
+        target = ser_uint256(key)
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self._entry(mid)
+            if entry[0] < target:
+                lo = mid + 1
+            elif entry[0] > target:
+                hi = mid
+            else:
+                return entry
+        return None
+
+    def entries(self):
+        """Yield (hash, type, offset, size) for every object, in index
+        order."""
+        for i in range(self.count):
+            (key, obj_type, offset, size) = self._entry(i)
+            yield (uint256_from_str(key), obj_type, offset, size)
+
+    def keys(self, obj_type=None):
+        """The hashes of the objects of the given type (default: all), in
+        the order in which they were added."""
+        entries = [entry for entry in self.entries()
+                   if obj_type is None or entry[1] == obj_type]
+        entries.sort(key=lambda entry: entry[2])
+        return [entry[0] for entry in entries]
+
+    def get_raw(self, key):
+        """(type, view of the serialized object), or None."""
+        entry = self._find(key)
+        if entry is None:
+            return None
+        (_, obj_type, offset, size) = entry
+        return (obj_type, self.buf[offset:offset + size])
+
+    def get(self, key):
+        """The object with the given hash, decoded as a LazyBlock or a
+        CTransaction, or None."""
+        raw = self.get_raw(key)
+        if raw is None:
+            return None
+        (obj_type, data) = raw
+        if obj_type == MSG_BLOCK:
+            obj = LazyBlock()
+        elif obj_type == MSG_TX:
+            obj = CTransaction()
+        else:
+            raise CorpusError("%s: unknown object type %d" % (self.path, obj_type))
+        obj.deserialize(BytesCursor(data))
+        obj.calc_sha256()
+        return obj
+
+    def get_block(self, key):
+        raw = self.get_raw(key)
+        if raw is None or raw[0] != MSG_BLOCK:
+            return None
+        return self.get(key)
+
+    def get_transaction(self, key):
+        raw = self.get_raw(key)
+        if raw is None or raw[0] != MSG_TX:
+            return None
+        return self.get(key)
+
+    # These match BlockStore.get_blocks and TxStore.get_transactions, so a
+    # corpus can answer getdata requests directly.
+    def get_blocks(self, inv):
+        responses = []
+        for i in inv:
+            if i.type == MSG_BLOCK:
+                block = self.get_block(i.hash)
+                if block is not None:
+                    responses.append(msg_block(block))
+        return responses
+
+    def get_transactions(self, inv):
+        responses = []
+        for i in inv:
+            if i.type == MSG_TX:
+                tx = self.get_transaction(i.hash)
+                if tx is not None:
+                    responses.append(msg_tx(tx))
+        return responses
+
+
+class CorpusWriter(object):
+    """Builds a corpus file, or appends to an existing one.
+
+    The index is only written by close(), so a corpus whose writer was not
+    closed cannot be opened. Adding an object whose hash is already present
+    replaces it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with Corpus(path) as corpus:
+                for (key, obj_type, offset, size) in corpus.entries():
+                    self.index[key] = (obj_type, offset, size)
+                end = corpus.index_offset
+            self.f = open(path, "r+b")
+            self.f.truncate(end)
+            self.f.seek(end)
+        else:
+            self.f = open(path, "wb")
+            self.f.write(_CORPUS_HEADER.pack(CORPUS_MAGIC, CORPUS_VERSION))
+
+    def add(self, key, obj_type, data):
+        self.f.write(_UINT32.pack(len(data)))
+        offset = self.f.tell()
+        self.f.write(data)
+        self.index[key] = (obj_type, offset, len(data))
+
+    def add_block(self, block):
+        block.calc_sha256()
+        self.add(block.sha256, MSG_BLOCK, block.serialize())
+
+    def add_transaction(self, tx):
+        tx.calc_sha256()
+        self.add(tx.sha256, MSG_TX, tx.serialize())
+
+    def close(self):
+        if self.f is None:
+            return
+        index_offset = self.f.tell()
+        entries = sorted((ser_uint256(key), value) for (key, value) in self.index.items())
+        for (key, (obj_type, offset, size)) in entries:
+            self.f.write(_INDEX_ENTRY.pack(key, obj_type, offset, size))
+        self.f.write(_CORPUS_TRAILER.pack(index_offset, len(entries), CORPUS_MAGIC))
+        self.f.close()
+        self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _add_raw_block(writer, raw, transactions):
+    block = LazyBlock()
+    block.deserialize(BytesCursor(raw))
+    writer.add_block(block)
+    if transactions:
+        for tx in block.vtx:
+            writer.add_transaction(tx)
+
+
+def corpus_from_node(node, path, start=0, end=None, transactions=True):
+    """Add the blocks at heights start to end (default: the tip) of node's
+    best chain to the corpus at path, and their transactions unless
+    transactions is False. Returns the number of blocks added."""
+    if end is None:
+        end = node.getblockcount()
+    with CorpusWriter(path) as writer:
+        for height in range(start, end + 1):
+            raw = bytes.fromhex(node.getblock(node.getblockhash(height), 0))
+            _add_raw_block(writer, raw, transactions)
+    return end + 1 - start
+
+
+def corpus_from_block_files(blocks_dir, path, magic=REGTEST_MAGIC, transactions=True):
+    """Add every block stored in blocks_dir (see blockfiles.py) to the corpus
+    at path, and their transactions unless transactions is False. Returns the
+    number of blocks added."""
+    count = 0
+    with CorpusWriter(path) as writer:
+        for block_path in block_file_paths(blocks_dir):
+            with BlockFile(block_path, magic) as block_file:
+                for extent in block_file.extents():
+                    _add_raw_block(writer, block_file.read(extent), transactions)
+                    count += 1
+    return count
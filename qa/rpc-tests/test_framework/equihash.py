@@ -1,7 +1,13 @@
+from array import array
 from operator import itemgetter
 import struct
 from functools import reduce
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 DEBUG = False
 VERBOSE = False
 
@@ -228,7 +234,252 @@ def gbp_basic(digest, n, k):
             j -= 1
     return [get_minimal_from_indices(soln, collision_length+1) for soln in solns]
 
+def tree_indices(parents, level, ref):
+    '''The indices of the row ref of the list after round level of
+    gbp_compact, in the order gbp_basic keeps them.'''
+    refs = [ref]
+    for (lefts, rights) in reversed(parents[:level]):
+        refs = [x for r in refs for x in (lefts[r], rights[r])]
+    return refs
+
+def gbp_compact(digest, n, k):
+    '''gbp_basic with the index tuples of each list replaced by references
+    to the rows of the previous list that were combined, so each row holds
+    one index instead of up to 2^(k-1).
+
+    A pair is only checked for duplicates on those references: it is
+    dropped if the rows share a row of the previous list. Rows whose indices
+    overlap further down the tree are kept, and filtered out when the
+    indices of a solution are rebuilt at the end, which is the only time
+    they are. Returns the same solutions as gbp_basic, in the same order.'''
+    validate_params(n, k)
+    collision_length = n//(k+1)
+    hash_length = (k+1)*((collision_length+7)//8)
+    indices_per_hash_output = 512//n
+
+    # Rows are (hash, first index, reference). The rows of the list after
+    # round r refer to entries of parents[r-1], which hold the references of
+    # the rows combined to make them; a row of the first list refers to its
+    # index.
+    X = []
+    tmp_hash = b''
+    for i in range(0, 2**(collision_length+1)):
+        r = i % indices_per_hash_output
+        if r == 0:
+            curr_digest = digest.copy()
+            hash_xi(curr_digest, i//indices_per_hash_output)
+            tmp_hash = curr_digest.digest()
+        X.append((
+            bytes(expand_array(bytearray(tmp_hash[r*n//8:(r+1)*n//8]),
+                               hash_length, collision_length)),
+            i, i
+        ))
+
+    parents = []
+    for i in range(1, k):
+        X.sort(key=itemgetter(0))
+        Xc = []
+        lefts = array('I')
+        rights = array('I')
+        # The rows of the first list are single indices, which are distinct.
+        (prev_lefts, prev_rights) = parents[-1] if parents else (None, None)
+        while len(X) > 0:
+            j = 1
+            while j < len(X):
+                if not has_collision(X[-1][0], X[-1-j][0], i, collision_length):
+                    break
+                j += 1
+
+            for l in range(0, j-1):
+                for m in range(l+1, j):
+                    (a, b) = (X[-1-l], X[-1-m])
+                    if prev_lefts is not None:
+                        (al, ar) = (prev_lefts[a[2]], prev_rights[a[2]])
+                        (bl, br) = (prev_lefts[b[2]], prev_rights[b[2]])
+                        if al == bl or al == br or ar == bl or ar == br:
+                            continue
+                    if b[1] < a[1]:
+                        (a, b) = (b, a)
+                    Xc.append((bytes(xor(a[0], b[0])), a[1], len(lefts)))
+                    lefts.append(a[2])
+                    rights.append(b[2])
+
+            del X[-j:]
+        parents.append((lefts, rights))
+        X = Xc
+
+    X.sort(key=itemgetter(0))
+    solns = []
+    while len(X) > 0:
+        j = 1
+        while j < len(X):
+            if not (has_collision(X[-1][0], X[-1-j][0], k, collision_length) and
+                    has_collision(X[-1][0], X[-1-j][0], k+1, collision_length)):
+                break
+            j += 1
+
+        for l in range(0, j-1):
+            for m in range(l+1, j):
+                res = xor(X[-1-l][0], X[-1-m][0])
+                if count_zeroes(res) == 8*hash_length:
+                    (a, b) = (X[-1-l], X[-1-m])
+                    if b[1] < a[1]:
+                        (a, b) = (b, a)
+                    indices = (tree_indices(parents, k-1, a[2]) +
+                               tree_indices(parents, k-1, b[2]))
+                    if len(set(indices)) == len(indices):
+                        solns.append(indices)
+
+        del X[-j:]
+    return [get_minimal_from_indices(soln, collision_length+1) for soln in solns]
+
+def require_numpy():
+    if np is None:
+        raise ImportError('the vectorized Equihash solver requires NumPy')
+
+def expand_rows(rows, n, k):
+    '''expand_array applied to each row of a uint8 array of n-bit hashes.'''
+    collision_length = n//(k+1)
+    width = (collision_length+7)//8
+    bits = np.unpackbits(rows, axis=1)[:, :(k+1)*collision_length]
+    bits = bits.reshape(len(rows), k+1, collision_length)
+    padded = np.zeros((len(rows), k+1, 8*width), dtype=np.uint8)
+    padded[:, :, 8*width-collision_length:] = bits
+    return np.packbits(padded.reshape(len(rows), -1), axis=1)
+
+def initial_rows(digest, n, k):
+    '''The hashes X_i = H(I||V||x_i) of the first list of gbp_basic, expanded,
+    as a uint8 array with one row per index.'''
+    collision_length = n//(k+1)
+    indices_per_hash_output = 512//n
+    count = 2**(collision_length+1)
+    hash_bytes = indices_per_hash_output*n//8
+    outputs = []
+    for g in range((count + indices_per_hash_output - 1)//indices_per_hash_output):
+        curr_digest = digest.copy()
+        hash_xi(curr_digest, g)
+        outputs.append(curr_digest.digest()[:hash_bytes])
+    rows = np.frombuffer(b''.join(outputs), dtype=np.uint8).reshape(-1, n//8)[:count]
+    return expand_rows(rows, n, k)
+
+def sort_rows(X):
+    # A stable sort on the whole row, as X.sort(key=itemgetter(0)).
+    return np.lexsort(X.T[::-1])
+
+# (l, m) for 0 <= l < m < j, in order, by j.
+_pair_templates = {}
+
+def pair_template(j):
+    template = _pair_templates.get(j)
+    if template is None:
+        template = _pair_templates[j] = np.triu_indices(j, 1)
+    return template
+
+def collision_pairs(keys):
+    '''The pairs (a, b) of rows of the sorted array X that gbp_basic combines
+    when X[:, lo:hi] is keys, in the order gbp_basic finds them: sets of
+    colliding rows from the last to the first, and within a set of j rows,
+    each (X[-1-l], X[-1-m]) with 0 <= l < m < j.'''
+    N = len(keys)
+    if N < 2:
+        return (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+    same = (keys[1:] == keys[:-1]).all(axis=1)
+    starts = np.flatnonzero(np.concatenate(([True], ~same)))
+    ends = np.append(starts[1:], N)
+    sizes = ends - starts
+    keep = sizes > 1
+    ends = ends[keep][::-1]
+    sizes = sizes[keep][::-1]
+    counts = sizes*(sizes-1)//2
+    offsets = np.cumsum(counts) - counts
+    a = np.empty(counts.sum(), dtype=np.intp)
+    b = np.empty(counts.sum(), dtype=np.intp)
+    for size in np.unique(sizes):
+        (l, m) = pair_template(size)
+        sel = sizes == size
+        last = ends[sel][:, None] - 1
+        positions = offsets[sel][:, None] + np.arange(len(l))
+        a[positions] = last - l
+        b[positions] = last - m
+    return (a, b)
+
+def combine_rows(X, indices, a, b):
+    '''The rows X[a] ^ X[b] whose index sets are disjoint, with their index
+    sets concatenated in order of their first index.'''
+    cat = np.concatenate((indices[a], indices[b]), axis=1)
+    ordered = np.sort(cat, axis=1)
+    distinct = ~(ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+    a = a[distinct]
+    b = b[distinct]
+    cat = cat[distinct]
+    swap = indices[a, 0] > indices[b, 0]
+    width = indices.shape[1]
+    cat[swap] = np.concatenate((cat[swap, width:], cat[swap, :width]), axis=1)
+    return (X[a] ^ X[b], cat)
+
+def gbp_vectorized(digest, n, k):
+    '''gbp_basic on NumPy arrays: the rows of each list are held in one
+    array, sorted with a stable sort, and combined in bulk. Returns the same
+    solutions as gbp_basic, in the same order.'''
+    require_numpy()
+    validate_params(n, k)
+    collision_length = n//(k+1)
+    if n % 8 != 0:
+        return gbp_basic(digest, n, k)
+
+    X = initial_rows(digest, n, k)
+    indices = np.arange(len(X), dtype=np.uint32)[:, None]
+    for i in range(1, k):
+        order = sort_rows(X)
+        X = X[order]
+        indices = indices[order]
+        (a, b) = collision_pairs(X[:, (i-1)*collision_length//8:i*collision_length//8])
+        (X, indices) = combine_rows(X, indices, a, b)
+
+    # Find a collision on the last 2n/(k+1) bits
+    order = sort_rows(X)
+    X = X[order]
+    indices = indices[order]
+    (a, b) = collision_pairs(X[:, (k-1)*collision_length//8:(k+1)*collision_length//8])
+    zero = ~(X[a] ^ X[b]).any(axis=1)
+    (_, solns) = combine_rows(X, indices, a[zero], b[zero])
+    return [get_minimal_from_indices(soln.tolist(), collision_length+1) for soln in solns]
+
+def gbp_solve(digest, n, k):
+    '''The solutions of gbp_basic, found with gbp_vectorized if NumPy is
+    available.'''
+    if np is None:
+        return gbp_basic(digest, n, k)
+    return gbp_vectorized(digest, n, k)
+
+# Results of solution_error and gbp_validate_batch, in the order in which
+# solution_error checks for them.
+SOLUTION_VALID = 0
+SOLUTION_INVALID_LENGTH = 1
+SOLUTION_INVALID_COLLISION = 2
+SOLUTION_UNORDERED_INDICES = 3
+SOLUTION_DUPLICATE_INDICES = 4
+SOLUTION_NONZERO_RESULT = 5
+
+# What gbp_validate prints for each of them.
+SOLUTION_ERROR_MESSAGES = {
+    SOLUTION_INVALID_LENGTH: 'Invalid solution length',
+    SOLUTION_INVALID_COLLISION: 'Invalid solution: invalid collision length between StepRows',
+    SOLUTION_UNORDERED_INDICES: 'Invalid solution: Index tree incorrectly ordered',
+    SOLUTION_DUPLICATE_INDICES: 'Invalid solution: duplicate indices',
+    SOLUTION_NONZERO_RESULT: 'Invalid solution: incorrect number of zeroes',
+}
+
 def gbp_validate(digest, minimal, n, k):
+    error = solution_error(digest, minimal, n, k)
+    if error != SOLUTION_VALID:
+        print(SOLUTION_ERROR_MESSAGES[error])
+        return False
+    return True
+
+def solution_error(digest, minimal, n, k):
+    '''Why the solution minimal is invalid, as one of the SOLUTION_*
+    codes.'''
     validate_params(n, k)
     collision_length = n//(k+1)
     hash_length = (k+1)*((collision_length+7)//8)
@@ -236,9 +487,7 @@ def gbp_validate(digest, minimal, n, k):
     solution_width = (1 << k)*(collision_length+1)//8
 
     if len(minimal) != solution_width:
-        print('Invalid solution length: %d (expected %d)' % \
-            (len(minimal), solution_width))
-        return False
+        return SOLUTION_INVALID_LENGTH
 
     X = []
     for i in get_indices_from_minimal(minimal, collision_length+1):
@@ -257,26 +506,95 @@ def gbp_validate(digest, minimal, n, k):
         Xc = []
         for i in range(0, len(X), 2):
             if not has_collision(X[i][0], X[i+1][0], r, collision_length):
-                print('Invalid solution: invalid collision length between StepRows')
-                return False
+                return SOLUTION_INVALID_COLLISION
             if X[i+1][1][0] < X[i][1][0]:
-                print('Invalid solution: Index tree incorrectly ordered')
-                return False
+                return SOLUTION_UNORDERED_INDICES
             if not distinct_indices(X[i][1], X[i+1][1]):
-                print('Invalid solution: duplicate indices')
-                return False
+                return SOLUTION_DUPLICATE_INDICES
             Xc.append((xor(X[i][0], X[i+1][0]), X[i][1] + X[i+1][1]))
         X = Xc
 
-    if len(X) != 1:
-        print('Invalid solution: incorrect length after end of rounds: %d' % len(X))
-        return False
-
     if count_zeroes(X[0][0]) != 8*hash_length:
-        print('Invalid solution: incorrect number of zeroes: %d' % count_zeroes(X[0][0]))
-        return False
-
-    return True
+        return SOLUTION_NONZERO_RESULT
+    return SOLUTION_VALID
+
+def indices_from_minimal_rows(minimals, bit_len):
+    '''get_indices_from_minimal applied to each row of a uint8 array of
+    solutions of the same length, as a uint32 array.'''
+    bits = np.unpackbits(minimals, axis=1)
+    bits = bits[:, :bits.shape[1] - bits.shape[1] % bit_len]
+    bits = bits.reshape(len(minimals), -1, bit_len).astype(np.uint32)
+    weights = np.uint32(1) << np.arange(bit_len - 1, -1, -1, dtype=np.uint32)
+    return (bits * weights).sum(axis=2, dtype=np.uint32)
+
+def gbp_validate_batch(digests, minimals, n, k):
+    '''The SOLUTION_* code of each solution in minimals, for the digest at
+    the same position in digests (as in gbp_validate).
+
+    With NumPy, the indices of all the solutions are unpacked at once, and
+    each round of the XOR tree is checked for all of them together.'''
+    validate_params(n, k)
+    if np is None:
+        return [solution_error(digest, minimal, n, k)
+                for (digest, minimal) in zip(digests, minimals)]
+    collision_length = n//(k+1)
+    indices_per_hash_output = 512//n
+    solution_width = (1 << k)*(collision_length+1)//8
+    hash_bytes = n//8
+
+    errors = np.zeros(len(minimals), dtype=np.uint8)
+    ok = [i for (i, minimal) in enumerate(minimals) if len(minimal) == solution_width]
+    errors[:] = SOLUTION_INVALID_LENGTH
+    errors[ok] = SOLUTION_VALID
+    if not ok or n % 8 != 0:
+        for i in ok:
+            errors[i] = solution_error(digests[i], minimals[i], n, k)
+        return errors.tolist()
+
+    rows = np.frombuffer(b''.join(bytes(minimals[i]) for i in ok), dtype=np.uint8)
+    indices = indices_from_minimal_rows(rows.reshape(len(ok), solution_width), collision_length+1)
+
+    # X_i = H(I||V||x_i), for each index of each solution.
+    hashes = bytearray()
+    for (row, i) in enumerate(ok):
+        outputs = {}
+        for index in indices[row].tolist():
+            (g, r) = divmod(index, indices_per_hash_output)
+            output = outputs.get(g)
+            if output is None:
+                curr_digest = digests[i].copy()
+                hash_xi(curr_digest, g)
+                output = outputs[g] = curr_digest.digest()
+            hashes += output[r*hash_bytes:(r+1)*hash_bytes]
+    X = expand_rows(np.frombuffer(bytes(hashes), dtype=np.uint8).reshape(-1, hash_bytes), n, k)
+    X = X.reshape(len(ok), 1 << k, -1)
+
+    result = np.zeros(len(ok), dtype=np.uint8)
+    solutions = np.arange(len(ok))
+    for r in range(1, k+1):
+        left = X[:, 0::2]
+        right = X[:, 1::2]
+        lo = (r-1)*collision_length//8
+        hi = r*collision_length//8
+        collision = (left[:, :, lo:hi] == right[:, :, lo:hi]).all(axis=2)
+        groups = indices.reshape(len(ok), -1, 1 << r)
+        half = 1 << (r-1)
+        ordered = groups[:, :, half] >= groups[:, :, 0]
+        merged = np.sort(groups, axis=2)
+        distinct = ~(merged[:, :, 1:] == merged[:, :, :-1]).any(axis=2)
+        # The first pair to fail, and the first check it fails.
+        failed = ~(collision & ordered & distinct)
+        first = failed.argmax(axis=1)
+        pending = (result == SOLUTION_VALID) & failed.any(axis=1)
+        code = np.where(~collision[solutions, first], SOLUTION_INVALID_COLLISION,
+                        np.where(~ordered[solutions, first], SOLUTION_UNORDERED_INDICES,
+                                 SOLUTION_DUPLICATE_INDICES))
+        result[pending] = code[pending]
+        X = left ^ right
+    nonzero = X.reshape(len(ok), -1).any(axis=1)
+    result[(result == SOLUTION_VALID) & nonzero] = SOLUTION_NONZERO_RESULT
+    errors[ok] = result
+    return errors.tolist()
 
 def zcash_person(n, k):
     return b'ZcashPoW' + struct.pack('<II', n, k)
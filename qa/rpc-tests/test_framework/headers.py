@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 The Zcash developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://www.opensource.org/licenses/mit-license.php .
+
+#
+# headers.py
+#
+# Batch processing of block headers, for tests that send or receive
+# headers messages of up to 2000 headers.
+#
+# A HeaderBatch keeps the headers as one buffer and the extent of each
+# header within it. The hashes are computed in one pass over the buffer
+# (optionally split across a process pool), and the fields needed to check
+# that the headers form a chain -- hashPrevBlock and nBits -- are read
+# straight from the buffer, so no CBlockHeader objects are built unless
+# headers() is called.
+#
+# The Equihash solutions of the whole batch are checked together by
+# equihash.gbp_validate_batch, which reports why each invalid one fails.
+#
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+
+from .equihash import SOLUTION_VALID, gbp_validate_batch, zcash_person
+from .mininode import (
+    _HEADER_FIELDS,
+    _UINT32,
+    BytesCursor,
+    CBlockHeader,
+    block_work_from_compact,
+    deser_compact_size,
+    msg_headers,
+    ser_compact_size,
+    uint256_from_compact,
+)
+
+# Offsets of fields within a serialized header.
+_HASH_PREV_BLOCK = 4
+_NBITS = 4 + 32 * 3 + 4
+_NSOLUTION = _HEADER_FIELDS.size
+
+
+def hash_headers(buf, extents):
+    """The block hash of each header at (start, end) in extents, as an
+    integer."""
+    sha256 = hashlib.sha256
+    return [int.from_bytes(sha256(sha256(buf[start:end]).digest()).digest(), "little")
+            for (start, end) in extents]
+
+
+def _hash_chunk(data, extents):
+    return hash_headers(memoryview(data), extents)
+
+
+class HeaderBatch(object):
+    """A sequence of serialized block headers."""
+    def __init__(self, buf, extents):
+        self.buf = memoryview(buf)
+        self.extents = extents
+        self._hashes = None
+
+    @classmethod
+    def from_payload(cls, data):
+        """Index the headers in the payload of a headers message."""
+        f = BytesCursor(data)
+        extents = []
+        for i in range(deser_compact_size(f)):
+            start = f.tell()
+            f.skip(_HEADER_FIELDS.size)
+            f.skip(deser_compact_size(f))
+            extents.append((start, f.tell()))
+            if deser_compact_size(f) != 0:
+                raise ValueError("header %d is followed by transactions" % i)
+        return cls(f.buf, extents)
+
+    @classmethod
+    def from_headers(cls, headers):
+        w = bytearray()
+        extents = []
+        for header in headers:
+            start = len(w)
+            CBlockHeader.serialize_into(header, w)
+            extents.append((start, len(w)))
+        return cls(bytes(w), extents)
+
+    def __len__(self):
+        return len(self.extents)
+
+    def raw(self, i):
+        (start, end) = self.extents[i]
+        return self.buf[start:end]
+
+    def hashes(self, workers=0, chunk_size=500):
+        """The block hash of each header, as an integer.
+
+        With workers > 0, the headers are hashed in chunks of chunk_size in
+        a pool of that many processes. Hashing a full headers message takes
+        a few milliseconds, so this only pays off for much larger batches.
+        """
+        if self._hashes is None:
+            if workers > 0 and len(self.extents) > chunk_size:
+                self._hashes = self._hash_in_pool(workers, chunk_size)
+            else:
+                self._hashes = hash_headers(self.buf, self.extents)
+        return self._hashes
+
+    def _hash_in_pool(self, workers, chunk_size):
+        jobs = []
+        for i in range(0, len(self.extents), chunk_size):
+            extents = self.extents[i:i + chunk_size]
+            base = extents[0][0]
+            data = self.buf[base:extents[-1][1]].tobytes()
+            jobs.append((data, [(start - base, end - base) for (start, end) in extents]))
+        hashes = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk in executor.map(_hash_chunk, *zip(*jobs)):
+                hashes.extend(chunk)
+        return hashes
+
+    def prev_hashes(self):
+        buf = self.buf
+        return [int.from_bytes(buf[start + _HASH_PREV_BLOCK:start + _HASH_PREV_BLOCK + 32], "little")
+                for (start, _) in self.extents]
+
+    def bits(self):
+        buf = self.buf
+        return [_UINT32.unpack_from(buf, start + _NBITS)[0] for (start, _) in self.extents]
+
+    def first_unlinked(self, prev_hash=None):
+        """The index of the first header whose hashPrevBlock is not the hash
+        of the header before it, or None if the headers form a chain. The
+        first header is checked against prev_hash, if it is given."""
+        hashes = self.hashes()
+        prev_hashes = self.prev_hashes()
+        if prev_hash is not None and prev_hashes and prev_hashes[0] != prev_hash:
+            return 0
+        for i in range(1, len(prev_hashes)):
+            if prev_hashes[i] != hashes[i - 1]:
+                return i
+        return None
+
+    def first_above_target(self):
+        """The index of the first header whose hash is above the target set
+        by its nBits, or None. The Equihash solutions are not checked."""
+        targets = {}
+        for (i, (block_hash, nBits)) in enumerate(zip(self.hashes(), self.bits())):
+            target = targets.get(nBits)
+            if target is None:
+                target = targets[nBits] = uint256_from_compact(nBits)
+            if block_hash > target:
+                return i
+        return None
+
+    def solution_errors(self, n=48, k=5):
+        """The equihash.SOLUTION_* code of the Equihash solution of each
+        header: SOLUTION_VALID (zero) or the reason it is invalid."""
+        person = zcash_person(n, k)
+        digest_size = (512//n)*n//8
+        digests = []
+        solutions = []
+        for (start, end) in self.extents:
+            # H(I||V||...
+            digest = hashlib.blake2b(digest_size=digest_size, person=person)
+            digest.update(self.buf[start:start + _NSOLUTION])
+            digests.append(digest)
+            f = BytesCursor(self.buf[start + _NSOLUTION:end])
+            solutions.append(f.read(deser_compact_size(f)))
+        return gbp_validate_batch(digests, solutions, n, k)
+
+    def first_invalid_solution(self, n=48, k=5):
+        """The index of the first header with an invalid Equihash solution,
+        or None."""
+        for (i, error) in enumerate(self.solution_errors(n, k)):
+            if error != SOLUTION_VALID:
+                return i
+        return None
+
+    def chain_work(self, start_work=0):
+        """The cumulative chain work after each header, starting from
+        start_work."""
+        works = {}
+        total = start_work
+        result = []
+        for nBits in self.bits():
+            work = works.get(nBits)
+            if work is None:
+                work = works[nBits] = block_work_from_compact(nBits)
+            total += work
+            result.append(total)
+        return result
+
+    def headers(self):
+        """The headers as CBlockHeaders, with their hashes set."""
+        result = []
+        for (i, block_hash) in enumerate(self.hashes()):
+            header = CBlockHeader()
+            header.deserialize(BytesCursor(self.raw(i)))
+            header.sha256 = block_hash
+            header.hash = "%064x" % block_hash
+            result.append(header)
+        return result
+
+    def payload(self):
+        """The payload of a headers message carrying these headers."""
+        w = bytearray(ser_compact_size(len(self.extents)))
+        for (start, end) in self.extents:
+            w += self.buf[start:end]
+            w += b"\x00"
+        return bytes(w)
+
+    def to_message(self):
+        message = msg_headers()
+        message.headers = self.headers()
+        return message
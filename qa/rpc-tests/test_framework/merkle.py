@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 The Zcash developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://www.opensource.org/licenses/mit-license.php .
+
+#
+# merkle.py
+#
+# Merkle trees over the transactions of a block that are updated in place.
+#
+# Every level of the tree is kept, so changing, appending or removing the
+# last leaf only rehashes the nodes on the path from that leaf to the root.
+# Inserting or removing a leaf anywhere else shifts the leaves after it,
+# and rehashes the nodes above them.
+#
+# txid_merkle_tree() makes the tree committed to by hashMerkleRoot: SHA256d,
+# with the last node of an odd-sized level paired with itself.
+# auth_data_merkle_tree() makes the ZIP 244 auth data tree: BLAKE2b-256, with
+# the leaves padded with zeros to a power of two.
+#
+
+from hashlib import blake2b, sha256
+
+
+class MerkleTree(object):
+    """A binary hash tree over a list of 32-byte leaves.
+
+    combine(left, right) is the hash of two sibling nodes, and
+    missing_sibling(height, left) is the node paired with the last node
+    of an odd-sized level at that height.
+    """
+    def __init__(self, combine, missing_sibling, leaves=()):
+        self.combine = combine
+        self.missing_sibling = missing_sibling
+        self.levels = [list(leaves)]
+        self._rehash(0, len(self.levels[0]))
+
+    def copy(self):
+        tree = MerkleTree.__new__(MerkleTree)
+        tree.combine = self.combine
+        tree.missing_sibling = self.missing_sibling
+        tree.levels = [list(level) for level in self.levels]
+        return tree
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    @property
+    def leaves(self):
+        return self.levels[0]
+
+    def root(self):
+        """The root of the tree. Raises IndexError if it has no leaves."""
+        return self.levels[-1][0]
+
+    def append(self, leaf):
+        self.levels[0].append(leaf)
+        n = len(self.levels[0])
+        self._rehash(n - 1, n)
+
+    def replace(self, i, leaf):
+        leaves = self.levels[0]
+        if i < 0:
+            i += len(leaves)
+        if leaves[i] != leaf:
+            leaves[i] = leaf
+            self._rehash(i, i + 1)
+
+    def insert(self, i, leaf):
+        leaves = self.levels[0]
+        leaves.insert(i, leaf)
+        self._rehash(min(max(i, 0), len(leaves) - 1), len(leaves))
+
+    def remove(self, i=-1):
+        """Remove the leaf at index i (by default, the last one)."""
+        leaves = self.levels[0]
+        if i < 0:
+            i += len(leaves)
+        del leaves[i]
+        self._rehash(i, max(i + 1, len(leaves)))
+
+    def update(self, leaves):
+        """Make leaves the leaves of the tree, rehashing only the nodes above
+        the ones that changed."""
+        current = self.levels[0]
+        common = min(len(current), len(leaves))
+        if current[:common] == leaves[:common]:
+            changed = []
+        else:
+            changed = [i for i in range(common) if current[i] != leaves[i]]
+        resized = len(current) != len(leaves)
+        current[:] = leaves
+        if len(changed) * len(self.levels) >= len(leaves):
+            # Cheaper to rebuild the tree.
+            self._rehash(0, len(leaves))
+            return
+        if resized:
+            self._rehash(common, max(common + 1, len(leaves)))
+        for i in changed:
+            self._rehash(i, i + 1)
+
+    def _rehash(self, lo, hi):
+        # Recompute the ancestors of the leaves lo to hi - 1, and resize the
+        # levels above the leaves to match their number.
+        combine = self.combine
+        missing_sibling = self.missing_sibling
+        levels = self.levels
+        height = 0
+        while len(levels[height]) > 1:
+            level = levels[height]
+            if height + 1 == len(levels):
+                levels.append([])
+            parents = levels[height + 1]
+            size = (len(level) + 1) // 2
+            del parents[size:]
+            lo //= 2
+            hi = min((hi + 1) // 2, size)
+            for j in range(lo, hi):
+                left = level[2 * j]
+                if 2 * j + 1 < len(level):
+                    right = level[2 * j + 1]
+                else:
+                    right = missing_sibling(height, left)
+                node = combine(left, right)
+                if j < len(parents):
+                    parents[j] = node
+                else:
+                    parents.append(node)
+            height += 1
+        del levels[height + 1:]
+
+
+def _sha256d(left, right):
+    return sha256(sha256(left + right).digest()).digest()
+
+
+def _duplicate(height, left):
+    return left
+
+
+def txid_merkle_tree(leaves=()):
+    """The tree of transaction ids committed to by hashMerkleRoot."""
+    return MerkleTree(_sha256d, _duplicate, leaves)
+
+
+# The roots of the auth data subtrees whose leaves are all zero, by height.
+_EMPTY_AUTH_SUBTREES = [b"\x00" * 32]
+
+
+def _blake2b_auth(left, right):
+    digest = blake2b(digest_size=32, person=b'ZcashAuthDatHash')
+    digest.update(left)
+    digest.update(right)
+    return digest.digest()
+
+
+def _empty_auth_subtree(height, left):
+    while len(_EMPTY_AUTH_SUBTREES) <= height:
+        empty = _EMPTY_AUTH_SUBTREES[-1]
+        _EMPTY_AUTH_SUBTREES.append(_blake2b_auth(empty, empty))
+    return _EMPTY_AUTH_SUBTREES[height]
+
+
+def auth_data_merkle_tree(leaves=()):
+    """The ZIP 244 tree of transaction auth digests committed to by
+    hashAuthDataRoot (via hashBlockCommitments)."""
+    return MerkleTree(_blake2b_auth, _empty_auth_subtree, leaves)
@@ -30,21 +30,52 @@ import time
 import sys
 import random
 from binascii import hexlify
-from io import BytesIO
 from codecs import encode
 import hashlib
 from threading import RLock
 from threading import Thread
 import logging
 import copy
+import copyreg
+import os
+import weakref
+from collections import deque
+from collections.abc import MutableSequence
+from concurrent.futures import ProcessPoolExecutor
 from hashlib import blake2b
 
+from .codec import (
+    BytesCursor,
+    INT32,
+    INT64,
+    IPV4,
+    STRING,
+    UINT16_BE,
+    UINT256,
+    UINT32,
+    UINT64,
+    UINT8,
+    If,
+    UNCHANGED,
+    FixedBytes,
+    LazyBytes,
+    Vector,
+    compact_size_len,
+    deser_compact_size,
+    deser_struct,
+    read_exact,
+    schema_codec,
+    ser_compact_size,
+    vector_codec,
+)
 from .equihash import (
-    gbp_basic,
+    gbp_solve,
     gbp_validate,
     hash_nonce,
     zcash_person,
 )
+from .merkle import auth_data_merkle_tree, txid_merkle_tree
+from .solution_cache import default_solution_cache
 from .util import bytes_to_hex_str
 
 
@@ -84,6 +115,62 @@ mininode_socket_map = dict()
 mininode_lock = RLock()
 
 # Serialization/deserialization tools
+
+class LazySlice(object):
+    """Descriptor for a byte-string field that deserialize() may fill with a
+    memoryview slice of its source buffer.
+
+    The value is stored in the attribute '_' + name, and the slice is
+    converted with `materialize` the first time the field is read. Serializers
+    use the stored value directly, so a decoded object that is re-serialized
+    without being inspected never copies these fields.
+    """
+    def __init__(self, materialize=bytes):
+        self.materialize = materialize
+
+    def __set_name__(self, owner, name):
+        self.attr = '_' + name
+        owner._lazy_fields = getattr(owner, "_lazy_fields", frozenset()) | {name}
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.attr)
+        if type(value) is memoryview:
+            value = self.materialize(value)
+            setattr(obj, self.attr, value)
+        return value
+
+    def __set__(self, obj, value):
+        setattr(obj, self.attr, value)
+
+# Copying or pickling an object that still holds an unread slice copies the
+# slice instead of failing.
+copyreg.pickle(memoryview, lambda view: (bytes, (view.tobytes(),)))
+
+# Precompiled codecs for the fixed-width fields.
+_UINT8 = struct.Struct("<B")
+_UINT16 = struct.Struct("<H")
+_UINT16_BE = struct.Struct(">H")
+_INT32 = struct.Struct("<i")
+_UINT32 = struct.Struct("<I")
+_INT64 = struct.Struct("<q")
+_UINT64 = struct.Struct("<Q")
+_UINT256 = struct.Struct("32s")
+_UINT256_MASK = (1 << 256) - 1
+# nVersion, hashPrevBlock, hashMerkleRoot, hashFinalSaplingRoot, nTime, nBits,
+# nNonce
+_HEADER_FIELDS = struct.Struct("<i32s32s32sII32s")
+# joinSplitSig
+_SIGNATURE = struct.Struct("64s")
+# nConsensusBranchId, nLockTime, nExpiryHeight of a v5 transaction
+_TX_V5_FIELDS = struct.Struct("<III")
+# nLockTime, nExpiryHeight of a v3 transaction, and valueBalance of a v4 one
+_TX_V3_FIELDS = struct.Struct("<II")
+_TX_V4_FIELDS = struct.Struct("<IIq")
+# The flags and valueBalance of an Orchard bundle
+_ORCHARD_FIELDS = struct.Struct("<Bq")
+
 def sha256(s):
     return hashlib.new('sha256', s).digest()
 
@@ -97,55 +184,24 @@ def fundingstream(idx, start_height, end_height, addrs):
     return '-fundingstream=%d:%d:%d:%s' % (idx, start_height, end_height, ",".join(addrs))
 
 def ser_compactsize(n):
-    if n < 253:
-        return struct.pack("B", n)
-    elif n < 0x10000:
-        return struct.pack("<BH", 253, n)
-    elif n < 0x100000000:
-        return struct.pack("<BI", 254, n)
-    return struct.pack("<BQ", 255, n)
+    return ser_compact_size(n)
 
 def deser_string(f):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
-    return f.read(nit)
+    return bytes(read_exact(f, deser_compact_size(f)))
 
 def ser_string(s):
-    if len(s) < 253:
-        return struct.pack("B", len(s)) + s
-    elif len(s) < 0x10000:
-        return struct.pack("<BH", 253, len(s)) + s
-    elif len(s) < 0x100000000:
-        return struct.pack("<BI", 254, len(s)) + s
-    return struct.pack("<BQ", 255, len(s)) + s
+    return ser_compact_size(len(s)) + s
 
 def deser_uint256(f):
-    r = 0
-    for i in range(8):
-        t = struct.unpack("<I", f.read(4))[0]
-        r += t << (i * 32)
-    return r
+    return int.from_bytes(deser_struct(f, _UINT256)[0], "little")
 
 
 def ser_uint256(u):
-    rs = b""
-    for i in range(8):
-        rs += struct.pack("<I", u & 0xFFFFFFFF)
-        u >>= 32
-    return rs
+    return (u & _UINT256_MASK).to_bytes(32, "little")
 
 
 def uint256_from_str(s):
-    r = 0
-    t = struct.unpack("<IIIIIIII", s[:32])
-    for i in range(8):
-        r += t[i] << (i * 32)
-    return r
+    return int.from_bytes(s[:32], "little")
 
 
 def uint256_from_compact(c):
@@ -160,187 +216,567 @@ def block_work_from_compact(c):
 
 
 def deser_vector(f, c):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
+    # Classes with a schema have a generated loop, but not their subclasses.
+    deserialize_vector = c.__dict__.get("deserialize_vector")
+    if deserialize_vector is not None:
+        return deserialize_vector(f)
     r = []
-    for i in range(nit):
+    for i in range(deser_compact_size(f)):
         t = c()
         t.deserialize(f)
         r.append(t)
     return r
 
 
-def ser_vector(elems):
-    r = b""
-    r += ser_compact_size(len(elems))
-    for elem in elems:
-        r += elem.serialize()
-    return r
-
-
-def ser_compact_size(l):
-    if l < 253:
-        return struct.pack("B", l)
-    elif l < 0x10000:
-        return struct.pack("<BH", 253, l)
-    elif l < 0x100000000:
-        return struct.pack("<BI", 254, l)
-    else:
-        return struct.pack("<BQ", 255, l)
-
-
-def deser_uint256_vector(f):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
+def deser_joinsplit_vector(f, c, use_groth16):
     r = []
-    for i in range(nit):
-        t = deser_uint256(f)
+    for i in range(deser_compact_size(f)):
+        t = c()
+        t.deserialize(f, use_groth16)
         r.append(t)
     return r
 
 
-def ser_uint256_vector(l):
-    r = b""
-    if len(l) < 253:
-        r = struct.pack("B", len(l))
-    elif len(l) < 0x10000:
-        r = struct.pack("<BH", 253, len(l))
-    elif len(l) < 0x100000000:
-        r = struct.pack("<BI", 254, len(l))
-    else:
-        r = struct.pack("<BQ", 255, len(l))
-    for i in l:
-        r += ser_uint256(i)
-    return r
+def ser_vector(elems):
+    w = bytearray()
+    ser_vector_into(w, elems)
+    return bytes(w)
 
 
-def deser_string_vector(f):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
-    r = []
-    for i in range(nit):
-        t = deser_string(f)
-        r.append(t)
-    return r
+def ser_vector_into(w, elems):
+    w += ser_compact_size(len(elems))
+    for elem in elems:
+        elem.serialize_into(w)
 
 
-def ser_string_vector(l):
-    r = b""
-    if len(l) < 253:
-        r = struct.pack("B", len(l))
-    elif len(l) < 0x10000:
-        r = struct.pack("<BH", 253, len(l))
-    elif len(l) < 0x100000000:
-        r = struct.pack("<BI", 254, len(l))
-    else:
-        r = struct.pack("<BQ", 255, len(l))
-    for sv in l:
-        r += ser_string(sv)
-    return r
+def string_size(s):
+    """The length of ser_string(s)."""
+    return compact_size_len(len(s)) + len(s)
 
 
-def deser_int_vector(f):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
-    r = []
-    for i in range(nit):
-        t = struct.unpack("<i", f.read(4))[0]
-        r.append(t)
-    return r
+def vector_size(elems):
+    """The length of ser_vector(elems)."""
+    size = compact_size_len(len(elems))
+    for elem in elems:
+        size += elem.serialized_size()
+    return size
 
 
-def ser_int_vector(l):
-    r = b""
-    if len(l) < 253:
-        r = struct.pack("B", len(l))
-    elif len(l) < 0x10000:
-        r = struct.pack("<BH", 253, len(l))
-    elif len(l) < 0x100000000:
-        r = struct.pack("<BI", 254, len(l))
-    else:
-        r = struct.pack("<BQ", 255, len(l))
-    for i in l:
-        r += struct.pack("<i", i)
-    return r
+(deser_uint256_vector, ser_uint256_vector) = vector_codec(UINT256)
+(deser_string_vector, ser_string_vector) = vector_codec(STRING)
+(deser_int_vector, ser_int_vector) = vector_codec(INT32)
 
 def deser_char_vector(f):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
-    r = []
-    for i in range(nit):
-        t = struct.unpack("<B", f.read(1))[0]
-        r.append(t)
-    return r
+    return bytes(read_exact(f, deser_compact_size(f)))
 
 
 def ser_char_vector(l):
-    r = b""
-    if len(l) < 253:
-        r = struct.pack("B", len(l))
-    elif len(l) < 0x10000:
-        r = struct.pack("<BH", 253, len(l))
-    elif len(l) < 0x100000000:
-        r = struct.pack("<BI", 254, len(l))
-    else:
-        r = struct.pack("<BQ", 255, len(l))
-    for i in l:
-        r += struct.pack("B", i)
-    return r
+    return ser_compact_size(len(l)) + bytes(l)
+
 
 # Objects that map to bitcoind objects, which can be serialized/deserialized
 
-class CAddress(object):
+class Serializable(object):
+    """Base class for objects with a wire encoding.
+
+    Subclasses implement serialize_into(w), which appends the encoding to the
+    bytearray w. Nested objects and vectors are written into the same buffer,
+    so serializing a large block is linear in its size.
+
+    serialized_size() returns the length of the encoding, like
+    GetSerializeSize in zcashd. Types whose size follows from their field
+    lengths override it, so that it encodes nothing.
+    """
+    __slots__ = ()
+
+    def serialize(self):
+        w = bytearray()
+        self.serialize_into(w)
+        return bytes(w)
+
+    def serialized_size(self):
+        return len(self.serialize())
+
+
+# The owners of every tracked part, by id() of the part (see attach_owner).
+_part_owners = {}
+
+
+def owner_ref(owner):
+    """How owner is recorded in _part_owners: by a weak reference if it has
+    one, and otherwise by its id(). The parts that have no weak references
+    are slotted TrackedObjects and TrackedLists, which have no state of
+    their own to invalidate; invalidating one of them is passed up to its
+    own owners, which are looked up by the same id().
+    """
+    if type(owner).__weakrefoffset__:
+        return weakref.ref(owner)
+    return id(owner)
+
+
+def attach_owner(owner, value):
+    """Record owner as a holder of value, so that mutating value
+    invalidates owner, and start tracking value (see TrackedObject.track).
+    Plain lists are replaced by a TrackedList.
+
+    The owners are kept in _part_owners rather than in the part, so that
+    parts carry no tracking state of their own. A part with one owner maps
+    to its owner_ref; a part with several owners maps to a dict from the
+    id() of each owner to its owner_ref. Owners are not kept alive: weak
+    references to owners that no longer exist are dropped as they are
+    found, and a part's entry is removed when the part itself is.
+    """
+    if type(value) is list:
+        return TrackedList(value, owner)
+    if isinstance(value, (TrackedObject, TrackedList)):
+        key = id(value)
+        current = _part_owners.get(key)
+        if current is None:
+            _part_owners[key] = (weakref.ref(owner) if type(owner).__weakrefoffset__
+                                 else id(owner))
+        elif type(current) is dict:
+            add_owner(current, owner)
+        else:
+            first = owner_key(current)
+            if first is None:
+                _part_owners[key] = owner_ref(owner)
+            elif first != id(owner):
+                _part_owners[key] = {first: current, id(owner): owner_ref(owner)}
+        if not isinstance(value, (Tracking, TrackedList)):
+            value.track()
+    return value
+
+
+def owner_key(ref):
+    """The id() of the owner recorded as ref, or None if it no longer
+    exists."""
+    if type(ref) is int:
+        return ref
+    owner = ref()
+    return None if owner is None else id(owner)
+
+
+def add_owner(owners, owner):
+    ref = owners.get(id(owner))
+    if ref is not None and owner_key(ref) == id(owner):
+        return
+    size = len(owners)
+    if size >= 8 and size & (size - 1) == 0:
+        # Drop the owners that no longer exist whenever the dict doubles in
+        # size, so that this stays constant time on average.
+        for (key, ref) in list(owners.items()):
+            if owner_key(ref) is None:
+                del owners[key]
+    owners[id(owner)] = owner_ref(owner)
+
+
+def detach_owner(value, owner):
+    key = id(value)
+    current = _part_owners.get(key)
+    if current is None:
+        return
+    if type(current) is dict:
+        if current.pop(id(owner), None) is not None and not current:
+            del _part_owners[key]
+    elif owner_key(current) == id(owner):
+        del _part_owners[key]
+
+
+def invalidate_owners(key):
+    """Invalidate the owners of the part whose id() is key."""
+    owners = _part_owners.get(key)
+    if owners is None:
+        return
+    if type(owners) is dict:
+        for (owner_key, ref) in list(owners.items()):
+            # Skip the owners that an earlier one detached (see SharedPart).
+            if owners.get(owner_key) is not ref:
+                continue
+            if type(ref) is int:
+                invalidate_owners(ref)
+            else:
+                o = ref()
+                if o is None:
+                    del owners[owner_key]
+                else:
+                    o.invalidate()
+    elif type(owners) is int:
+        invalidate_owners(owners)
+    else:
+        o = owners()
+        if o is not None:
+            o.invalidate()
+
+
+_IMMUTABLE_TYPES = frozenset([type(None), bool, int, float, str, bytes])
+
+_slot_names = {}
+
+def slot_names(cls):
+    names = _slot_names.get(cls)
+    if names is None:
+        names = []
+        for c in cls.__mro__:
+            slots = c.__dict__.get("__slots__", ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            names.extend(name for name in slots if name != "__weakref__")
+        _slot_names[cls] = names
+    return names
+
+
+_part_slots = {}
+
+def part_slots(cls):
+    """The descriptors of the slots of TrackedObject class cls that can hold
+    parts: the public slots that are tracked."""
+    slots = _part_slots.get(cls)
+    if slots is None:
+        slots = _part_slots[cls] = [
+            getattr(cls, name) for name in slot_names(cls)
+            if name[0] != "_" and name not in cls._untracked]
+    return slots
+
+
+class TrackedObject(Serializable):
+    """Base class for the parts of a transaction.
+
+    A part is tracked once something depends on it: once it is attached to
+    a tracked owner, or once it caches something computed from its contents
+    (see track()). Assigning to a public attribute of a tracked part
+    invalidates it, and the invalidation is passed up through its owners
+    (see attach_owner) until it reaches the CTransaction, which drops its
+    cached encoding and digests. Owners are notified before the change is
+    made, which is what lets a clone copy a part it shares just before the
+    part is modified (see SharedPart). Lists held by a tracked part are TrackedLists, so that
+    in-place mutation is seen as well. Attributes whose names start with an
+    underscore, or that are listed in _untracked, are not tracked.
+
+    Parts that are not tracked, which includes everything deserialize()
+    builds, do not intercept assignment at all, so building and decoding
+    them costs no more than for plain objects. Tracking a part switches it
+    to its class's tracking_class, a subclass that adds the Tracking
+    __setattr__; copies of a tracked part are tracked as well.
+
+    An object attached to several owners (for example a CTxOut appended to
+    two transactions) invalidates all of them. Replacing an attribute
+    detaches the object from the value it held.
+    """
+    __slots__ = ()
+    _untracked = frozenset()
+    # The attributes that are LazySlices, whose previous values are not
+    # looked at when they are replaced (that would copy the slice).
+    _lazy_fields = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super(TrackedObject, cls).__init_subclass__(**kwargs)
+        if issubclass(cls, Tracking):
+            return
+        cls.untracked_class = cls
+        # Named so that pickle finds it.
+        cls.tracking_class = type(cls.__name__, (cls, Tracking), {
+            "__slots__": (),
+            "__module__": cls.__module__,
+            "__qualname__": cls.__qualname__ + ".tracking_class",
+            "__doc__": cls.__doc__,
+        })
+
+    def track(self):
+        """Start tracking this object, and the parts it holds."""
+        if not isinstance(self, Tracking):
+            object.__setattr__(self, "__class__", self.tracking_class)
+            self.attach_parts()
+
+    def attach_parts(self):
+        # Read the stored values directly, so that nothing is decoded or
+        # copied (see OpaquePayload and CTransaction.peek).
+        for slot in part_slots(type(self)):
+            try:
+                value = slot.__get__(self)
+            except AttributeError:
+                continue
+            if type(value) is list:
+                slot.__set__(self, TrackedList(value, self))
+            elif isinstance(value, (TrackedObject, TrackedList)):
+                attach_owner(self, value)
+        fields = getattr(self, "__dict__", None)
+        if fields:
+            untracked = self._untracked
+            for (name, value) in list(fields.items()):
+                if name[0] == "_" or name in untracked:
+                    continue
+                if type(value) is list:
+                    fields[name] = TrackedList(value, self)
+                elif isinstance(value, (TrackedObject, TrackedList)):
+                    attach_owner(self, value)
+
+    def replaced_value(self, name):
+        """The value of attribute name, which is about to be replaced."""
+        return getattr(self, name, None)
+
+    def invalidate(self):
+        invalidate_owners(id(self))
+
+    def __getstate__(self):
+        # Copies start without an owner; whoever they are attached to
+        # becomes their owner.
+        state = dict(getattr(self, "__dict__", ()))
+        for name in slot_names(type(self)):
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for (name, value) in state.items():
+            object.__setattr__(self, name, value)
+        if isinstance(self, Tracking):
+            self.attach_parts()
+
+    def __deepcopy__(self, memo):
+        # Equivalent to the default, without the overhead of __reduce_ex__
+        # for the common case of immutable field values.
+        cls = type(self)
+        clone = cls.__new__(cls)
+        memo[id(self)] = clone
+        for (name, value) in self.__getstate__().items():
+            if type(value) not in _IMMUTABLE_TYPES:
+                value = copy.deepcopy(value, memo)
+            object.__setattr__(clone, name, value)
+        if isinstance(clone, Tracking):
+            clone.attach_parts()
+        return clone
+
+
+class Tracking(object):
+    """Mixin of the tracking_class of a TrackedObject class, which tracked
+    objects are switched to (see TrackedObject)."""
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        if name[0] == "_" or name in self._untracked:
+            super(Tracking, self).__setattr__(name, value)
+            return
+        self.invalidate()
+        if type(value) is list or isinstance(value, (TrackedObject, TrackedList)):
+            value = attach_owner(self, value)
+        old = None if name in self._lazy_fields else self.replaced_value(name)
+        super(Tracking, self).__setattr__(name, value)
+        if old is not value and isinstance(old, (TrackedObject, TrackedList)):
+            detach_owner(old, self)
+
+    def __del__(self):
+        _part_owners.pop(id(self), None)
+        if not type(self).__weakrefoffset__:
+            # The parts record this object by its id(), which a new object
+            # may reuse (see owner_ref).
+            for slot in part_slots(type(self)):
+                try:
+                    value = slot.__get__(self)
+                except AttributeError:
+                    continue
+                if isinstance(value, (TrackedObject, TrackedList)):
+                    detach_owner(value, self)
+
+
+class TrackedList(list):
+    """A list held by a TrackedObject. Mutating the list invalidates its
+    owner, elements added to it are attached to it, and elements removed
+    from it are detached from it."""
+    __slots__ = ("__weakref__",)
+
+    def __init__(self, items=(), owner=None):
+        if owner is not None:
+            attach_owner(owner, self)
+        if items:
+            list.__init__(self, [attach_owner(self, item) for item in items])
+
+    def __del__(self):
+        _part_owners.pop(id(self), None)
+
+    def __reduce_ex__(self, protocol):
+        # Copies start without an owner.
+        return (TrackedList, (list(self),))
+
+    def invalidate(self):
+        invalidate_owners(id(self))
+
+    def release(self, items):
+        """Detach the items that were removed from the list and that it does
+        not hold any more."""
+        for item in items:
+            if isinstance(item, (TrackedObject, TrackedList)) and item not in self:
+                detach_owner(item, self)
+
+    def __setitem__(self, i, value):
+        self.invalidate()
+        if isinstance(i, slice):
+            value = [attach_owner(self, item) for item in value]
+            removed = list.__getitem__(self, i)
+        else:
+            value = attach_owner(self, value)
+            removed = (list.__getitem__(self, i),)
+        list.__setitem__(self, i, value)
+        self.release(removed)
+
+    def __delitem__(self, i):
+        self.invalidate()
+        removed = list.__getitem__(self, i)
+        list.__delitem__(self, i)
+        self.release(removed if isinstance(i, slice) else (removed,))
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def __imul__(self, n):
+        self.invalidate()
+        removed = list(self) if n <= 0 else ()
+        list.__imul__(self, n)
+        self.release(removed)
+        return self
+
+    def append(self, item):
+        self.invalidate()
+        list.append(self, attach_owner(self, item))
+
+    def extend(self, items):
+        self.invalidate()
+        list.extend(self, [attach_owner(self, item) for item in items])
+
+    def insert(self, i, item):
+        self.invalidate()
+        list.insert(self, i, attach_owner(self, item))
+
+    def pop(self, i=-1):
+        self.invalidate()
+        item = list.pop(self, i)
+        self.release((item,))
+        return item
+
+    def remove(self, item):
+        self.invalidate()
+        i = self.index(item)
+        removed = list.__getitem__(self, i)
+        list.__delitem__(self, i)
+        self.release((removed,))
+
+    def clear(self):
+        self.invalidate()
+        removed = list(self)
+        list.clear(self)
+        self.release(removed)
+
+    def sort(self, *args, **kwargs):
+        self.invalidate()
+        list.sort(self, *args, **kwargs)
+
+    def reverse(self):
+        self.invalidate()
+        list.reverse(self)
+
+
+class DigestCache(object):
+    """Mixin for a TrackedObject that memoizes digests of its contents
+    (see zip244.memoized_digest).
+
+    The digests are kept in _digests, which invalidate() drops after the
+    owners have been notified, so a clone that copies the object just
+    before it is modified keeps them.
+    """
+    __slots__ = ()
+    _digests = None
+
+    def cached_digest(self, name, compute):
+        """The digest called name, computed as compute(self) if it is not
+        cached."""
+        digests = self._digests
+        if digests is not None:
+            digest = digests.get(name)
+            if digest is not None:
+                return digest
+        digest = compute(self)
+        # Computing the digest may have decoded the object, which drops the
+        # cache; look it up again.
+        self.track()
+        digests = self._digests
+        if digests is None:
+            digests = self._digests = {}
+        digests[name] = digest
+        return digest
+
+    def invalidate(self):
+        super(DigestCache, self).invalidate()
+        self._digests = None
+
+
+class SharedPart(object):
+    """A nested part of a transaction that a clone still shares with the
+    transaction it was cloned from.
+
+    The SharedPart is attached as an owner of the part, so it is notified
+    before the part is modified through any transaction or reference. The
+    first SharedPart notified makes one copy of the part, and moves every
+    clone that shares the part over to the copy, which nothing modifies; a
+    write to a template with many live clones therefore copies the part
+    once. The clone copies the part for itself when the part is accessed
+    through it. Only a weak reference to the clone is kept, so a clone that
+    is discarded without touching the part costs nothing.
+    """
+    __slots__ = ("clone", "name", "value", "__weakref__")
+
+    def __init__(self, clone, name, value):
+        self.clone = weakref.ref(clone, self.release)
+        self.name = name
+        self.value = value
+        attach_owner(self, value)
+
+    def invalidate(self):
+        value = self.value
+        owners = _part_owners.get(id(value))
+        if type(owners) is dict:
+            parts = [ref() for ref in owners.values() if type(ref) is not int]
+            parts = [part for part in parts if type(part) is SharedPart]
+        else:
+            parts = [self]
+        snapshot = copy.deepcopy(value)
+        for part in parts:
+            detach_owner(value, part)
+            part.value = snapshot
+            attach_owner(part, snapshot)
+
+    def release(self, ref=None):
+        detach_owner(self.value, self)
+
+
+@schema_codec
+class CAddress(Serializable):
+    __slots__ = ("nServices", "pchReserved", "ip", "port")
+    schema = (
+        ("nServices", UINT64),
+        ("pchReserved", FixedBytes(12)),
+        ("ip", IPV4),
+        ("port", UINT16_BE),
+    )
+
     def __init__(self):
         self.nServices = 1
         self.pchReserved = b"\x00" * 10 + b"\xff" * 2
         self.ip = "0.0.0.0"
         self.port = 0
 
-    def deserialize(self, f):
-        self.nServices = struct.unpack("<Q", f.read(8))[0]
-        self.pchReserved = f.read(12)
-        self.ip = socket.inet_ntoa(f.read(4))
-        self.port = struct.unpack(">H", f.read(2))[0]
-
-    def serialize(self):
-        r = b""
-        r += struct.pack("<Q", self.nServices)
-        r += self.pchReserved
-        r += socket.inet_aton(self.ip)
-        r += struct.pack(">H", self.port)
-        return r
-
     def __repr__(self):
         return "CAddress(nServices=%i ip=%s port=%i)" % (self.nServices,
                                                          self.ip, self.port)
 
 
-class CInv(object):
+@schema_codec
+class CInv(Serializable):
+    __slots__ = ("type", "hash", "hash_aux")
+    schema = (
+        ("type", INT32),
+        ("hash", UINT256),
+        If("self.type == 5", [("hash_aux", UINT256)], absent=UNCHANGED),
+    )
     typemap = {
         0: b"Error",
         1: b"TX",
@@ -356,21 +792,10 @@ class CInv(object):
             self.hash_aux = LEGACY_TX_AUTH_DIGEST
 
     def deserialize(self, f):
-        self.type = struct.unpack("<i", f.read(4))[0]
-        self.hash = deser_uint256(f)
-        if self.type == 5:
-            self.hash_aux = deser_uint256(f)
-        elif self.type == 1:
+        self.deserialize_fields(f)
+        if self.type == 1:
             self.hash_aux = LEGACY_TX_AUTH_DIGEST
 
-    def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.type)
-        r += ser_uint256(self.hash)
-        if self.type == 5:
-            r += ser_uint256(self.hash_aux)
-        return r
-
     def __eq__(self, other):
         return (
             (type(self) == type(other)) and
@@ -382,43 +807,54 @@ class CInv(object):
             % (self.typemap.get(self.type, self.type), self.hash, self.hash_aux)
 
 
-class CBlockLocator(object):
+@schema_codec
+class CBlockLocator(Serializable):
+    schema = (
+        ("nVersion", INT32),
+        ("vHave", Vector(UINT256)),
+    )
+
     def __init__(self):
         self.nVersion = SPROUT_PROTO_VERSION
         self.vHave = []
 
-    def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
-        self.vHave = deser_uint256_vector(f)
-
-    def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_uint256_vector(self.vHave)
-        return r
-
     def __repr__(self):
         return "CBlockLocator(nVersion=%i vHave=%r)" \
             % (self.nVersion, repr(self.vHave))
 
 
-class RedPallasSignature(object):
+@schema_codec
+class RedPallasSignature(TrackedObject):
+    __slots__ = ("data",)
+    schema = (
+        ("data", FixedBytes(64)),
+    )
+
     def __init__(self):
         self.data = None
 
-    def deserialize(self, f):
-        self.data = f.read(64)
-
-    def serialize(self):
-        r = b""
-        r += self.data
-        return r
-
     def __repr__(self):
         return "RedPallasSignature(%s)" % bytes_to_hex_str(self.data)
 
 
-class OrchardAction(object):
+@schema_codec
+class OrchardAction(TrackedObject):
+    __slots__ = (
+        "cv", "nullifier", "rk", "cmx", "ephemeralKey", "_encCiphertext",
+        "outCiphertext", "spendAuthSig",
+    )
+    encCiphertext = LazySlice()
+    schema = (
+        ("cv", UINT256),
+        ("nullifier", UINT256),
+        ("rk", UINT256),
+        ("cmx", UINT256),
+        ("ephemeralKey", UINT256),
+        ("encCiphertext", LazyBytes(580)),
+        ("outCiphertext", FixedBytes(80)),
+        # spendAuthSig is serialized separately, by the bundle.
+    )
+
     def __init__(self):
         self.cv = None
         self.nullifier = None
@@ -428,26 +864,6 @@ class OrchardAction(object):
         self.encCiphertext = None
         self.outCiphertext = None
 
-    def deserialize(self, f):
-        self.cv = deser_uint256(f)
-        self.nullifier = deser_uint256(f)
-        self.rk = deser_uint256(f)
-        self.cmx = deser_uint256(f)
-        self.ephemeralKey = deser_uint256(f)
-        self.encCiphertext = f.read(580)
-        self.outCiphertext = f.read(80)
-
-    def serialize(self):
-        r = b""
-        r += ser_uint256(self.cv)
-        r += ser_uint256(self.nullifier)
-        r += ser_uint256(self.rk)
-        r += ser_uint256(self.cmx)
-        r += ser_uint256(self.ephemeralKey)
-        r += self.encCiphertext
-        r += self.outCiphertext
-        return r
-
     def __repr__(self):
         return "OrchardAction(cv=%064x, nullifier=%064x, rk=%064x, cmu=%064x, ephemeralKey=%064x, encCiphertext=%064x, outCiphertext=%064x)" \
             % (
@@ -464,45 +880,52 @@ class OrchardAction(object):
 ORCHARD_FLAGS_ENABLE_SPENDS = 0b00000001
 ORCHARD_FLAGS_ENABLE_OUTPUTS = 0b00000010
 
-class OrchardBundle(object):
+class OrchardBundle(DigestCache, TrackedObject):
+    proofs = LazySlice()
+
     def __init__(self):
         self.actions = []
         self.enableSpends = False
         self.enableOutputs = False
         self.valueBalance = 0
         self.anchor = None
-        self.proofs = []
+        self.proofs = b""
         self.spendAuthSigs = []
         self.bindingSig = None
 
     def deserialize(self, f):
         self.actions = deser_vector(f, OrchardAction)
         if len(self.actions) > 0:
-            flags = struct.unpack("B", f.read(1))[0]
+            (flags, self.valueBalance) = deser_struct(f, _ORCHARD_FIELDS)
             self.enableSpends = (flags & ORCHARD_FLAGS_ENABLE_SPENDS) != 0
             self.enableOutputs = (flags & ORCHARD_FLAGS_ENABLE_OUTPUTS) != 0
-            self.valueBalance = struct.unpack("<q", f.read(8))[0]
             self.anchor = deser_uint256(f)
-            self.proofs = deser_char_vector(f)
+            self.proofs = read_exact(f, deser_compact_size(f))
             for i in range(len(self.actions)):
                 self.actions[i].spendAuthSig = RedPallasSignature()
                 self.actions[i].spendAuthSig.deserialize(f)
             self.bindingSig = RedPallasSignature()
             self.bindingSig.deserialize(f)
 
-    def serialize(self):
-        r = b""
-        r += ser_vector(self.actions)
+    def serialize_into(self, w):
+        ser_vector_into(w, self.actions)
         if len(self.actions) > 0:
-            r += struct.pack("B", self.flags())
-            r += struct.pack("<q", self.valueBalance)
-            r += ser_uint256(self.anchor)
-            r += ser_compact_size(len(self.proofs))
-            r += bytes(self.proofs)
+            w += _UINT8.pack(self.flags())
+            w += _INT64.pack(self.valueBalance)
+            w += ser_uint256(self.anchor)
+            w += ser_compact_size(len(self._proofs))
+            w += bytes(self._proofs)
             for i in range(len(self.actions)):
-                r += self.actions[i].spendAuthSig.serialize()
-            r += self.bindingSig.serialize()
-        return r
+                self.actions[i].spendAuthSig.serialize_into(w)
+            self.bindingSig.serialize_into(w)
+
+    def serialized_size(self):
+        nActions = len(self.actions)
+        size = compact_size_len(nActions) + nActions * 820
+        if nActions > 0:
+            # flags, valueBalance, anchor, proofs, spendAuthSigs, bindingSig
+            size += 1 + 8 + 32 + string_size(self._proofs) + nActions * 64 + 64
+        return size
 
     def flags(self):
         return 0 ^ (
@@ -524,39 +947,45 @@ class OrchardBundle(object):
             )
 
 
-class Groth16Proof(object):
+@schema_codec
+class Groth16Proof(TrackedObject):
+    __slots__ = ("_data",)
+    data = LazySlice()
+    schema = (
+        ("data", LazyBytes(192)),
+    )
+
     def __init__(self):
         self.data = None
 
-    def deserialize(self, f):
-        self.data = f.read(192)
-
-    def serialize(self):
-        r = b""
-        r += self.data
-        return r
-
     def __repr__(self):
         return "Groth16Proof(%s)" % bytes_to_hex_str(self.data)
 
 
-class RedJubjubSignature(object):
+@schema_codec
+class RedJubjubSignature(TrackedObject):
+    __slots__ = ("data",)
+    schema = (
+        ("data", FixedBytes(64)),
+    )
+
     def __init__(self):
         self.data = None
 
-    def deserialize(self, f):
-        self.data = f.read(64)
-
-    def serialize(self):
-        r = b""
-        r += self.data
-        return r
-
     def __repr__(self):
         return "RedJubjubSignature(%s)" % bytes_to_hex_str(self.data)
 
 
-class SpendDescriptionV5(object):
+@schema_codec
+class SpendDescriptionV5(TrackedObject):
+    __slots__ = ("cv", "nullifier", "rk", "zkproof", "spendAuthSig")
+    schema = (
+        ("cv", UINT256),
+        ("nullifier", UINT256),
+        ("rk", UINT256),
+        # zkproof and spendAuthSig are serialized separately, by the bundle.
+    )
+
     def __init__(self):
         self.cv = None
         self.nullifier = None
@@ -564,24 +993,23 @@ class SpendDescriptionV5(object):
         self.zkproof = None
         self.spendAuthSig = None
 
-    def deserialize(self, f):
-        self.cv = deser_uint256(f)
-        self.nullifier = deser_uint256(f)
-        self.rk = deser_uint256(f)
-
-    def serialize(self):
-        r = b""
-        r += ser_uint256(self.cv)
-        r += ser_uint256(self.nullifier)
-        r += ser_uint256(self.rk)
-        return r
-
     def __repr__(self):
         return "SpendDescriptionV5(cv=%064x, nullifier=%064x, rk=%064x, zkproof=%r, spendAuthSig=%r)" \
             % (self.cv, self.nullifier, self.rk, self.zkproof, self.spendAuthSig)
 
 
-class SpendDescription(object):
+@schema_codec
+class SpendDescription(TrackedObject):
+    __slots__ = ("cv", "anchor", "nullifier", "rk", "zkproof", "spendAuthSig")
+    schema = (
+        ("cv", UINT256),
+        ("anchor", UINT256),
+        ("nullifier", UINT256),
+        ("rk", UINT256),
+        ("zkproof", Groth16Proof),
+        ("spendAuthSig", RedJubjubSignature),
+    )
+
     def __init__(self):
         self.cv = None
         self.anchor = None
@@ -590,32 +1018,27 @@ class SpendDescription(object):
         self.zkproof = None
         self.spendAuthSig = None
 
-    def deserialize(self, f):
-        self.cv = deser_uint256(f)
-        self.anchor = deser_uint256(f)
-        self.nullifier = deser_uint256(f)
-        self.rk = deser_uint256(f)
-        self.zkproof = Groth16Proof()
-        self.zkproof.deserialize(f)
-        self.spendAuthSig = RedJubjubSignature()
-        self.spendAuthSig.deserialize(f)
-
-    def serialize(self):
-        r = b""
-        r += ser_uint256(self.cv)
-        r += ser_uint256(self.anchor)
-        r += ser_uint256(self.nullifier)
-        r += ser_uint256(self.rk)
-        r += self.zkproof.serialize()
-        r += self.spendAuthSig.serialize()
-        return r
-
     def __repr__(self):
         return "SpendDescription(cv=%064x, anchor=%064x, nullifier=%064x, rk=%064x, zkproof=%r, spendAuthSig=%r)" \
             % (self.cv, self.anchor, self.nullifier, self.rk, self.zkproof, self.spendAuthSig)
 
 
-class OutputDescriptionV5(object):
+@schema_codec
+class OutputDescriptionV5(TrackedObject):
+    __slots__ = (
+        "cv", "cmu", "ephemeralKey", "_encCiphertext", "outCiphertext",
+        "zkproof",
+    )
+    encCiphertext = LazySlice()
+    schema = (
+        ("cv", UINT256),
+        ("cmu", UINT256),
+        ("ephemeralKey", UINT256),
+        ("encCiphertext", LazyBytes(580)),
+        ("outCiphertext", FixedBytes(80)),
+        # zkproof is serialized separately, by the bundle.
+    )
+
     def __init__(self):
         self.cv = None
         self.cmu = None
@@ -624,22 +1047,6 @@ class OutputDescriptionV5(object):
         self.outCiphertext = None
         self.zkproof = None
 
-    def deserialize(self, f):
-        self.cv = deser_uint256(f)
-        self.cmu = deser_uint256(f)
-        self.ephemeralKey = deser_uint256(f)
-        self.encCiphertext = f.read(580)
-        self.outCiphertext = f.read(80)
-
-    def serialize(self):
-        r = b""
-        r += ser_uint256(self.cv)
-        r += ser_uint256(self.cmu)
-        r += ser_uint256(self.ephemeralKey)
-        r += self.encCiphertext
-        r += self.outCiphertext
-        return r
-
     def __repr__(self):
         return "OutputDescription(cv=%064x, cmu=%064x, ephemeralKey=%064x, encCiphertext=%s, outCiphertext=%s, zkproof=%r)" \
             % (
@@ -652,7 +1059,22 @@ class OutputDescriptionV5(object):
             )
 
 
-class OutputDescription(object):
+@schema_codec
+class OutputDescription(TrackedObject):
+    __slots__ = (
+        "cv", "cmu", "ephemeralKey", "_encCiphertext", "outCiphertext",
+        "zkproof",
+    )
+    encCiphertext = LazySlice()
+    schema = (
+        ("cv", UINT256),
+        ("cmu", UINT256),
+        ("ephemeralKey", UINT256),
+        ("encCiphertext", LazyBytes(580)),
+        ("outCiphertext", FixedBytes(80)),
+        ("zkproof", Groth16Proof),
+    )
+
     def __init__(self):
         self.cv = None
         self.cmu = None
@@ -661,25 +1083,6 @@ class OutputDescription(object):
         self.outCiphertext = None
         self.zkproof = None
 
-    def deserialize(self, f):
-        self.cv = deser_uint256(f)
-        self.cmu = deser_uint256(f)
-        self.ephemeralKey = deser_uint256(f)
-        self.encCiphertext = f.read(580)
-        self.outCiphertext = f.read(80)
-        self.zkproof = Groth16Proof()
-        self.zkproof.deserialize(f)
-
-    def serialize(self):
-        r = b""
-        r += ser_uint256(self.cv)
-        r += ser_uint256(self.cmu)
-        r += ser_uint256(self.ephemeralKey)
-        r += self.encCiphertext
-        r += self.outCiphertext
-        r += self.zkproof.serialize()
-        return r
-
     def __repr__(self):
         return "OutputDescription(cv=%064x, cmu=%064x, ephemeralKey=%064x, encCiphertext=%s, outCiphertext=%s, zkproof=%r)" \
             % (
@@ -692,7 +1095,7 @@ class OutputDescription(object):
             )
 
 
-class SaplingBundle(object):
+class SaplingBundle(DigestCache, TrackedObject):
     def __init__(self):
         self.spends = []
         self.outputs = []
@@ -705,7 +1108,7 @@ class SaplingBundle(object):
         self.outputs = deser_vector(f, OutputDescriptionV5)
         has_sapling = (len(self.spends) + len(self.outputs)) > 0
         if has_sapling:
-            self.valueBalance = struct.unpack("<q", f.read(8))[0]
+            self.valueBalance = deser_struct(f, _INT64)[0]
         if len(self.spends) > 0:
             self.anchor = deser_uint256(f)
         for i in range(len(self.spends)):
@@ -721,24 +1124,35 @@ class SaplingBundle(object):
             self.bindingSig = RedJubjubSignature()
             self.bindingSig.deserialize(f)
 
-    def serialize(self):
-        r = b""
-        r += ser_vector(self.spends)
-        r += ser_vector(self.outputs)
+    def serialize_into(self, w):
+        ser_vector_into(w, self.spends)
+        ser_vector_into(w, self.outputs)
         has_sapling = (len(self.spends) + len(self.outputs)) > 0
         if has_sapling:
-            r += struct.pack("<q", self.valueBalance)
+            w += _INT64.pack(self.valueBalance)
         if len(self.spends) > 0:
-            r += ser_uint256(self.anchor)
+            w += ser_uint256(self.anchor)
         for spend in self.spends:
-            r += spend.zkproof.serialize()
+            spend.zkproof.serialize_into(w)
         for spend in self.spends:
-            r += spend.spendAuthSig.serialize()
+            spend.spendAuthSig.serialize_into(w)
         for output in self.outputs:
-            r += output.zkproof.serialize()
+            output.zkproof.serialize_into(w)
         if has_sapling:
-            r += self.bindingSig.serialize()
-        return r
+            self.bindingSig.serialize_into(w)
+
+    def serialized_size(self):
+        nSpends = len(self.spends)
+        nOutputs = len(self.outputs)
+        size = (compact_size_len(nSpends) + nSpends * 96 +
+                compact_size_len(nOutputs) + nOutputs * 756)
+        if nSpends + nOutputs > 0:
+            # valueBalance, bindingSig
+            size += 8 + 64
+        if nSpends > 0:
+            # anchor, zkproofs, spendAuthSigs
+            size += 32 + nSpends * (192 + 64)
+        return size + nOutputs * 192
 
     def __repr__(self):
         return "SaplingBundle(spends=%r, outputs=%r, valueBalance=%i, bindingSig=%064x)" \
@@ -753,7 +1167,7 @@ class SaplingBundle(object):
 G1_PREFIX_MASK = 0x02
 G2_PREFIX_MASK = 0x0a
 
-class ZCProof(object):
+class ZCProof(TrackedObject):
     def __init__(self):
         self.g_A = None
         self.g_A_prime = None
@@ -765,17 +1179,17 @@ class ZCProof(object):
         self.g_H = None
 
     def deserialize(self, f):
-        def deser_g1(self, f):
-            leadingByte = struct.unpack("<B", f.read(1))[0]
+        def deser_g1(f):
+            leadingByte = deser_struct(f, _UINT8)[0]
             return {
                 'y_lsb': leadingByte & 1,
-                'x': f.read(32),
+                'x': bytes(read_exact(f, 32)),
             }
-        def deser_g2(self, f):
-            leadingByte = struct.unpack("<B", f.read(1))[0]
+        def deser_g2(f):
+            leadingByte = deser_struct(f, _UINT8)[0]
             return {
                 'y_gt': leadingByte & 1,
-                'x': f.read(64),
+                'x': bytes(read_exact(f, 64)),
             }
         self.g_A = deser_g1(f)
         self.g_A_prime = deser_g1(f)
@@ -786,21 +1200,23 @@ class ZCProof(object):
         self.g_K = deser_g1(f)
         self.g_H = deser_g1(f)
 
-    def serialize(self):
-        def ser_g1(self, p):
-            return chr(G1_PREFIX_MASK | p['y_lsb']) + p['x']
-        def ser_g2(self, p):
-            return chr(G2_PREFIX_MASK | p['y_gt']) + p['x']
-        r = b""
-        r += ser_g1(self.g_A)
-        r += ser_g1(self.g_A_prime)
-        r += ser_g2(self.g_B)
-        r += ser_g1(self.g_B_prime)
-        r += ser_g1(self.g_C)
-        r += ser_g1(self.g_C_prime)
-        r += ser_g1(self.g_K)
-        r += ser_g1(self.g_H)
-        return r
+    def serialize_into(self, w):
+        def ser_g1(p):
+            return bytes([G1_PREFIX_MASK | p['y_lsb']]) + p['x']
+        def ser_g2(p):
+            return bytes([G2_PREFIX_MASK | p['y_gt']]) + p['x']
+        w += ser_g1(self.g_A)
+        w += ser_g1(self.g_A_prime)
+        w += ser_g2(self.g_B)
+        w += ser_g1(self.g_B_prime)
+        w += ser_g1(self.g_C)
+        w += ser_g1(self.g_C_prime)
+        w += ser_g1(self.g_K)
+        w += ser_g1(self.g_H)
+
+    def serialized_size(self):
+        # Seven compressed G1 points and one compressed G2 point.
+        return 7 * 33 + 65
 
     def __repr__(self):
         return "ZCProof(g_A=%r g_A_prime=%r g_B=%r g_B_prime=%r g_C=%r g_C_prime=%r g_K=%r g_H=%r)" \
@@ -834,7 +1250,7 @@ ZC_NOTECIPHERTEXT_SIZE = (
   NOTEENCRYPTION_AUTH_BYTES
 )
 
-class JSDescription(object):
+class JSDescription(TrackedObject):
     def __init__(self):
         self.vpub_old = 0
         self.vpub_new = 0
@@ -848,8 +1264,8 @@ class JSDescription(object):
         self.ciphertexts = [None] * ZC_NUM_JS_OUTPUTS
 
     def deserialize(self, f, use_groth16=True):
-        self.vpub_old = struct.unpack("<q", f.read(8))[0]
-        self.vpub_new = struct.unpack("<q", f.read(8))[0]
+        self.vpub_old = deser_struct(f, _INT64)[0]
+        self.vpub_new = deser_struct(f, _INT64)[0]
         self.anchor = deser_uint256(f)
 
         self.nullifiers = []
@@ -875,51 +1291,62 @@ class JSDescription(object):
 
         self.ciphertexts = []
         for i in range(ZC_NUM_JS_OUTPUTS):
-            self.ciphertexts.append(f.read(ZC_NOTECIPHERTEXT_SIZE))
+            self.ciphertexts.append(bytes(read_exact(f, ZC_NOTECIPHERTEXT_SIZE)))
 
-    def serialize(self):
-        r = b""
-        r += struct.pack("<q", self.vpub_old)
-        r += struct.pack("<q", self.vpub_new)
-        r += ser_uint256(self.anchor)
+    def serialize_into(self, w):
+        w += _INT64.pack(self.vpub_old)
+        w += _INT64.pack(self.vpub_new)
+        w += ser_uint256(self.anchor)
         for i in range(ZC_NUM_JS_INPUTS):
-            r += ser_uint256(self.nullifiers[i])
+            w += ser_uint256(self.nullifiers[i])
         for i in range(ZC_NUM_JS_OUTPUTS):
-            r += ser_uint256(self.commitments[i])
-        r += ser_uint256(self.onetimePubKey)
-        r += ser_uint256(self.randomSeed)
+            w += ser_uint256(self.commitments[i])
+        w += ser_uint256(self.onetimePubKey)
+        w += ser_uint256(self.randomSeed)
         for i in range(ZC_NUM_JS_INPUTS):
-            r += ser_uint256(self.macs[i])
-        r += self.proof.serialize()
+            w += ser_uint256(self.macs[i])
+        self.proof.serialize_into(w)
         for i in range(ZC_NUM_JS_OUTPUTS):
-            r += self.ciphertexts[i]
-        return r
+            w += self.ciphertexts[i]
+
+    def serialized_size(self):
+        # vpub_old, vpub_new, anchor, nullifiers, commitments,
+        # onetimePubKey, randomSeed, macs
+        return (8 + 8 + 32 + 32 * ZC_NUM_JS_INPUTS + 32 * ZC_NUM_JS_OUTPUTS +
+                32 + 32 + 32 * ZC_NUM_JS_INPUTS +
+                self.proof.serialized_size() +
+                ZC_NUM_JS_OUTPUTS * ZC_NOTECIPHERTEXT_SIZE)
 
     def __repr__(self):
         return "JSDescription(vpub_old=%i vpub_new=%i anchor=%064x onetimePubKey=%064x randomSeed=%064x proof=%r)" \
             % (self.vpub_old, self.vpub_new, self.anchor,
                self.onetimePubKey, self.randomSeed, self.proof)
 
-class COutPoint(object):
+@schema_codec
+class COutPoint(TrackedObject):
+    __slots__ = ("hash", "n")
+    schema = (
+        ("hash", UINT256),
+        ("n", UINT32),
+    )
+
     def __init__(self, hash=0, n=0):
         self.hash = hash
         self.n = n
 
-    def deserialize(self, f):
-        self.hash = deser_uint256(f)
-        self.n = struct.unpack("<I", f.read(4))[0]
-
-    def serialize(self):
-        r = b""
-        r += ser_uint256(self.hash)
-        r += struct.pack("<I", self.n)
-        return r
-
     def __repr__(self):
         return "COutPoint(hash=%064x n=%i)" % (self.hash, self.n)
 
 
-class CTxIn(object):
+@schema_codec
+class CTxIn(TrackedObject):
+    __slots__ = ("prevout", "scriptSig", "nSequence")
+    schema = (
+        ("prevout", COutPoint),
+        ("scriptSig", STRING),
+        ("nSequence", UINT32),
+    )
+
     def __init__(self, outpoint=None, scriptSig=b"", nSequence=0):
         if outpoint is None:
             self.prevout = COutPoint()
@@ -928,47 +1355,69 @@ class CTxIn(object):
         self.scriptSig = scriptSig
         self.nSequence = nSequence
 
-    def deserialize(self, f):
-        self.prevout = COutPoint()
-        self.prevout.deserialize(f)
-        self.scriptSig = deser_string(f)
-        self.nSequence = struct.unpack("<I", f.read(4))[0]
-
-    def serialize(self):
-        r = b""
-        r += self.prevout.serialize()
-        r += ser_string(self.scriptSig)
-        r += struct.pack("<I", self.nSequence)
-        return r
-
     def __repr__(self):
         return "CTxIn(prevout=%s scriptSig=%s nSequence=%i)" \
             % (repr(self.prevout), hexlify(self.scriptSig),
                self.nSequence)
 
 
-class CTxOut(object):
+@schema_codec
+class CTxOut(TrackedObject):
+    __slots__ = ("nValue", "scriptPubKey")
+    schema = (
+        ("nValue", INT64),
+        ("scriptPubKey", STRING),
+    )
+
     def __init__(self, nValue=0, scriptPubKey=b""):
         self.nValue = nValue
         self.scriptPubKey = scriptPubKey
 
-    def deserialize(self, f):
-        self.nValue = struct.unpack("<q", f.read(8))[0]
-        self.scriptPubKey = deser_string(f)
-
-    def serialize(self):
-        r = b""
-        r += struct.pack("<q", self.nValue)
-        r += ser_string(self.scriptPubKey)
-        return r
-
     def __repr__(self):
         return "CTxOut(nValue=%i.%08i scriptPubKey=%s)" \
             % (self.nValue // 100000000, self.nValue % 100000000,
                hexlify(self.scriptPubKey))
 
 
-class CTransaction(object):
+class CTransaction(DigestCache, TrackedObject):
+    """A transaction.
+
+    The encoding, txid and auth digest are cached, as are the ZIP 244
+    digests of its header and transparent parts (see DigestCache), and the
+    cache is dropped whenever the transaction or anything attached to it is
+    mutated (see TrackedObject). Once a transaction has been hashed, reading
+    sha256, hash, auth_digest or auth_digest_hex after a mutation recomputes
+    them, so an explicit rehash() is no longer required.
+
+    CTransaction(tx) and clone() return a copy that shares the nested parts
+    listed in shared_fields with tx. Each part is only copied when it is
+    accessed through the copy, or when it is about to be modified through
+    tx; until then, reading it for serialization or hashing goes through
+    peek() and copies nothing.
+    """
+    _untracked = frozenset(["sha256", "hash", "auth_digest", "auth_digest_hex"])
+    shared_fields = (
+        "vin", "vout", "saplingBundle", "orchardBundle", "shieldedSpends",
+        "shieldedOutputs", "vJoinSplit", "bindingSig",
+    )
+    # The classes used for the bundles of a v5 transaction.
+    sapling_bundle_class = SaplingBundle
+    orchard_bundle_class = OrchardBundle
+    # The classes used for the shielded components of earlier versions.
+    spend_description_class = SpendDescription
+    output_description_class = OutputDescription
+    joinsplit_class = JSDescription
+
+    # Cached encoding, size and digests.
+    _serialized = None
+    _size = None
+    _txid = None
+    _auth_digest = None
+    _sha256 = None
+    _hash = None
+    _auth_digest_hex = None
+    _stale = False
+
     def __init__(self, tx=None):
         if tx is None:
             self.fOverwintered = True
@@ -979,8 +1428,8 @@ class CTransaction(object):
             self.nLockTime = 0
             self.nExpiryHeight = 0
             self.valueBalance = 0
-            self.saplingBundle = SaplingBundle()
-            self.orchardBundle = OrchardBundle()
+            self.saplingBundle = self.sapling_bundle_class()
+            self.orchardBundle = self.orchard_bundle_class()
             self.shieldedSpends = []
             self.shieldedOutputs = []
             self.vJoinSplit = []
@@ -990,30 +1439,89 @@ class CTransaction(object):
             self.sha256 = None
             self.hash = None
         else:
+            # The parts are shared through the owners they are attached to.
+            tx.track()
             self.fOverwintered = tx.fOverwintered
             self.nVersion = tx.nVersion
             self.nVersionGroupId = tx.nVersionGroupId
-            self.vin = copy.deepcopy(tx.vin)
-            self.vout = copy.deepcopy(tx.vout)
+            if hasattr(tx, "nConsensusBranchId"):
+                self.nConsensusBranchId = tx.nConsensusBranchId
             self.nLockTime = tx.nLockTime
             self.nExpiryHeight = tx.nExpiryHeight
             self.valueBalance = tx.valueBalance
-            self.saplingBundle = copy.deepcopy(tx.saplingBundle)
-            self.orchardBundle = copy.deepcopy(tx.orchardBundle)
-            self.shieldedSpends = copy.deepcopy(tx.shieldedSpends)
-            self.shieldedOutputs = copy.deepcopy(tx.shieldedOutputs)
-            self.vJoinSplit = copy.deepcopy(tx.vJoinSplit)
             self.joinSplitPubKey = tx.joinSplitPubKey
             self.joinSplitSig = tx.joinSplitSig
-            self.bindingSig = tx.bindingSig
+            self._shared = {}
+            self.track()
+            for name in self.shared_fields:
+                self.share(name, tx.peek(name))
+            # The copy has the same encoding and digests as tx.
+            self._serialized = tx._serialized
+            self._size = tx._size
+            self._txid = tx._txid
+            self._auth_digest = tx._auth_digest
             self.sha256 = None
             self.hash = None
 
+    def clone(self):
+        return type(self)(self)
+
+    def share(self, name, value):
+        if isinstance(value, (TrackedObject, TrackedList)):
+            self._shared[name] = SharedPart(self, name, value)
+        else:
+            setattr(self, name, value)
+
+    def unshare(self, name):
+        part = self._shared.pop(name)
+        part.release()
+        value = attach_owner(self, copy.deepcopy(part.value))
+        self.__dict__[name] = value
+        return value
+
+    def peek(self, name):
+        """Read a nested part without copying it if it is shared with the
+        transaction this one was cloned from. The result must not be
+        modified."""
+        shared = self.__dict__.get("_shared")
+        if shared and name in shared and name not in self.__dict__:
+            return shared[name].value
+        return getattr(self, name)
+
+    def __getattr__(self, name):
+        # Only reached for attributes that are not set, which includes the
+        # nested parts a clone has not copied yet.
+        shared = self.__dict__.get("_shared")
+        if shared and name in shared:
+            return self.unshare(name)
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
+    def replaced_value(self, name):
+        # Read from __dict__, as getattr() would copy a part that is shared.
+        shared = self.__dict__.get("_shared")
+        if shared and name in shared:
+            # Replaced before the clone copied it.
+            shared.pop(name).release()
+        return self.__dict__.get(name)
+
+    def __getstate__(self):
+        state = super(CTransaction, self).__getstate__()
+        shared = state.pop("_shared", None)
+        if shared:
+            for (name, part) in shared.items():
+                state.setdefault(name, part.value)
+        return state
+
     def deserialize(self, f):
-        header = struct.unpack("<I", f.read(4))[0]
+        self.deserialize_fields(f)
+        self.sha256 = None
+        self.hash = None
+
+    def deserialize_fields(self, f):
+        header = deser_struct(f, _UINT32)[0]
         self.fOverwintered = bool(header >> 31)
         self.nVersion = header & 0x7FFFFFFF
-        self.nVersionGroupId = (struct.unpack("<I", f.read(4))[0]
+        self.nVersionGroupId = (deser_struct(f, _UINT32)[0]
                                 if self.fOverwintered else 0)
 
         isOverwinterV3 = (self.fOverwintered and
@@ -1028,49 +1536,75 @@ class CTransaction(object):
 
         if isNu5V5:
             # Common transaction fields
-            self.nConsensusBranchId = struct.unpack("<I", f.read(4))[0]
-            self.nLockTime = struct.unpack("<I", f.read(4))[0]
-            self.nExpiryHeight = struct.unpack("<I", f.read(4))[0]
+            (self.nConsensusBranchId, self.nLockTime,
+             self.nExpiryHeight) = deser_struct(f, _TX_V5_FIELDS)
 
             # Transparent transaction fields
             self.vin = deser_vector(f, CTxIn)
             self.vout = deser_vector(f, CTxOut)
 
             # Sapling transaction fields
-            self.saplingBundle = SaplingBundle()
+            self.saplingBundle = self.sapling_bundle_class()
             self.saplingBundle.deserialize(f)
 
             # Orchard transaction fields
-            self.orchardBundle = OrchardBundle()
+            self.orchardBundle = self.orchard_bundle_class()
             self.orchardBundle.deserialize(f)
 
             return
 
         self.vin = deser_vector(f, CTxIn)
         self.vout = deser_vector(f, CTxOut)
-        self.nLockTime = struct.unpack("<I", f.read(4))[0]
-        if isOverwinterV3 or isSaplingV4:
-            self.nExpiryHeight = struct.unpack("<I", f.read(4))[0]
+        if isSaplingV4:
+            (self.nLockTime, self.nExpiryHeight,
+             self.valueBalance) = deser_struct(f, _TX_V4_FIELDS)
+        elif isOverwinterV3:
+            (self.nLockTime, self.nExpiryHeight) = deser_struct(f, _TX_V3_FIELDS)
+        else:
+            self.nLockTime = deser_struct(f, _UINT32)[0]
 
         if isSaplingV4:
-            self.valueBalance = struct.unpack("<q", f.read(8))[0]
-            self.shieldedSpends = deser_vector(f, SpendDescription)
-            self.shieldedOutputs = deser_vector(f, OutputDescription)
+            self.shieldedSpends = deser_vector(f, self.spend_description_class)
+            self.shieldedOutputs = deser_vector(f, self.output_description_class)
 
         if self.nVersion >= 2:
-            self.vJoinSplit = deser_vector(f, JSDescription)
+            # Groth16 proofs from Sapling onwards, PHGR13 proofs before.
+            self.vJoinSplit = deser_joinsplit_vector(f, self.joinsplit_class, isSaplingV4)
             if len(self.vJoinSplit) > 0:
                 self.joinSplitPubKey = deser_uint256(f)
-                self.joinSplitSig = f.read(64)
+                self.joinSplitSig = deser_struct(f, _SIGNATURE)[0]
 
         if isSaplingV4 and not (len(self.shieldedSpends) == 0 and len(self.shieldedOutputs) == 0):
             self.bindingSig = RedJubjubSignature()
             self.bindingSig.deserialize(f)
 
-        self.sha256 = None
-        self.hash = None
-
     def serialize(self):
+        data = self._serialized
+        if data is None:
+            w = bytearray()
+            self.serialize_fields_into(w)
+            data = bytes(w)
+            self.track()
+            self._serialized = data
+        return data
+
+    def serialize_into(self, w):
+        if self._serialized is None:
+            self.serialize()
+        w += self._serialized
+
+    def serialize_fields_into(self, w):
+        # Nested parts are read with peek() so that serializing a clone does
+        # not copy them.
+        vin = self.peek("vin")
+        vout = self.peek("vout")
+        saplingBundle = self.peek("saplingBundle")
+        orchardBundle = self.peek("orchardBundle")
+        shieldedSpends = self.peek("shieldedSpends")
+        shieldedOutputs = self.peek("shieldedOutputs")
+        vJoinSplit = self.peek("vJoinSplit")
+        bindingSig = self.peek("bindingSig")
+
         header = (int(self.fOverwintered)<<31) | self.nVersion
         isOverwinterV3 = (self.fOverwintered and
                           self.nVersionGroupId == OVERWINTER_VERSION_GROUP_ID and
@@ -1083,65 +1617,178 @@ class CTransaction(object):
                        self.nVersion == 5)
 
         if isNu5V5:
-            r = b""
-
             # Common transaction fields
-            r += struct.pack("<I", header)
-            r += struct.pack("<I", self.nVersionGroupId)
-            r += struct.pack("<I", self.nConsensusBranchId)
-            r += struct.pack("<I", self.nLockTime)
-            r += struct.pack("<I", self.nExpiryHeight)
+            w += _UINT32.pack(header)
+            w += _UINT32.pack(self.nVersionGroupId)
+            w += _UINT32.pack(self.nConsensusBranchId)
+            w += _UINT32.pack(self.nLockTime)
+            w += _UINT32.pack(self.nExpiryHeight)
 
             # Transparent transaction fields
-            r += ser_vector(self.vin)
-            r += ser_vector(self.vout)
+            ser_vector_into(w, vin)
+            ser_vector_into(w, vout)
 
             # Sapling transaction fields
-            r += self.saplingBundle.serialize()
+            saplingBundle.serialize_into(w)
 
             # Orchard transaction fields
-            r += self.orchardBundle.serialize()
+            orchardBundle.serialize_into(w)
 
-            return r
+            return
 
-        r = b""
-        r += struct.pack("<I", header)
+        w += _UINT32.pack(header)
         if self.fOverwintered:
-            r += struct.pack("<I", self.nVersionGroupId)
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
-        r += struct.pack("<I", self.nLockTime)
+            w += _UINT32.pack(self.nVersionGroupId)
+        ser_vector_into(w, vin)
+        ser_vector_into(w, vout)
+        w += _UINT32.pack(self.nLockTime)
         if isOverwinterV3 or isSaplingV4:
-            r += struct.pack("<I", self.nExpiryHeight)
+            w += _UINT32.pack(self.nExpiryHeight)
         if isSaplingV4:
-            r += struct.pack("<q", self.valueBalance)
-            r += ser_vector(self.shieldedSpends)
-            r += ser_vector(self.shieldedOutputs)
+            w += _INT64.pack(self.valueBalance)
+            ser_vector_into(w, shieldedSpends)
+            ser_vector_into(w, shieldedOutputs)
         if self.nVersion >= 2:
-            r += ser_vector(self.vJoinSplit)
-            if len(self.vJoinSplit) > 0:
-                r += ser_uint256(self.joinSplitPubKey)
-                r += self.joinSplitSig
-        if isSaplingV4 and not (len(self.shieldedSpends) == 0 and len(self.shieldedOutputs) == 0):
-            r += self.bindingSig.serialize()
-        return r
+            ser_vector_into(w, vJoinSplit)
+            if len(vJoinSplit) > 0:
+                w += ser_uint256(self.joinSplitPubKey)
+                w += self.joinSplitSig
+        if isSaplingV4 and not (len(shieldedSpends) == 0 and len(shieldedOutputs) == 0):
+            bindingSig.serialize_into(w)
+
+    def serialized_size(self):
+        if self._serialized is not None:
+            return len(self._serialized)
+        if self._size is None:
+            size = self.calc_serialized_size()
+            self.track()
+            self._size = size
+        return self._size
+
+    def calc_serialized_size(self):
+        vin = self.peek("vin")
+        vout = self.peek("vout")
+        isOverwinterV3 = (self.fOverwintered and
+                          self.nVersionGroupId == OVERWINTER_VERSION_GROUP_ID and
+                          self.nVersion == 3)
+        isSaplingV4 = (self.fOverwintered and
+                       self.nVersionGroupId == SAPLING_VERSION_GROUP_ID and
+                       self.nVersion == 4)
+        isNu5V5 = (self.fOverwintered and
+                       self.nVersionGroupId == ZIP225_VERSION_GROUP_ID and
+                       self.nVersion == 5)
+
+        if isNu5V5:
+            # header, nVersionGroupId, nConsensusBranchId, nLockTime,
+            # nExpiryHeight
+            return (4 * 5 + vector_size(vin) + vector_size(vout) +
+                    self.peek("saplingBundle").serialized_size() +
+                    self.peek("orchardBundle").serialized_size())
+
+        # header, nLockTime
+        size = 4 + vector_size(vin) + vector_size(vout) + 4
+        if self.fOverwintered:
+            size += 4
+        if isOverwinterV3 or isSaplingV4:
+            size += 4
+        if isSaplingV4:
+            shieldedSpends = self.peek("shieldedSpends")
+            shieldedOutputs = self.peek("shieldedOutputs")
+            size += 8 + vector_size(shieldedSpends) + vector_size(shieldedOutputs)
+            if not (len(shieldedSpends) == 0 and len(shieldedOutputs) == 0):
+                size += 64
+        if self.nVersion >= 2:
+            vJoinSplit = self.peek("vJoinSplit")
+            size += vector_size(vJoinSplit)
+            if len(vJoinSplit) > 0:
+                size += 32 + 64
+        return size
+
+    def invalidate(self):
+        if (self._serialized is not None or self._txid is not None or
+                self._size is not None):
+            self._serialized = None
+            self._size = None
+            self._txid = None
+            self._auth_digest = None
+        if self._sha256 is not None:
+            self._stale = True
+        invalidate_owners(id(self))
+        self._digests = None
+
+    @property
+    def sha256(self):
+        if self._stale:
+            self.calc_sha256()
+        return self._sha256
+
+    @sha256.setter
+    def sha256(self, value):
+        self._sha256 = value
+        self._stale = False
+
+    @property
+    def hash(self):
+        if self._stale:
+            self.calc_sha256()
+        return self._hash
+
+    @hash.setter
+    def hash(self, value):
+        self._hash = value
+
+    @property
+    def auth_digest(self):
+        if self._stale:
+            self.calc_sha256()
+        return self._auth_digest
+
+    @auth_digest.setter
+    def auth_digest(self, value):
+        self._auth_digest = value
+
+    @property
+    def auth_digest_hex(self):
+        if self._stale:
+            self.calc_sha256()
+        return self._auth_digest_hex
+
+    @auth_digest_hex.setter
+    def auth_digest_hex(self, value):
+        self._auth_digest_hex = value
 
     def rehash(self):
+        # Recompute everything, in case a field that is not tracked (such as
+        # a dict inside a JoinSplit proof) was changed in place.
+        self.invalidate()
+        for name in ("saplingBundle", "orchardBundle"):
+            bundle = self.peek(name)
+            if isinstance(bundle, DigestCache):
+                bundle._digests = None
         self.sha256 = None
         self.calc_sha256()
 
     def calc_sha256(self):
-        if self.nVersion >= 5:
-            from . import zip244
-            txid = zip244.txid_digest(self)
-            self.auth_digest = zip244.auth_digest(self)
-        else:
-            txid = hash256(self.serialize())
-            self.auth_digest = b'\xFF'*32
-        if self.sha256 is None:
-            self.sha256 = uint256_from_str(txid)
-        self.hash = encode(txid[::-1], 'hex_codec').decode('ascii')
-        self.auth_digest_hex = encode(self.auth_digest[::-1], 'hex_codec').decode('ascii')
+        if self._txid is None:
+            if self.nVersion >= 5:
+                from . import zip244
+                self.set_digests(zip244.txid_digest(self), zip244.auth_digest(self))
+            else:
+                self.set_digests(hash256(self.serialize()), b'\xFF'*32)
+        if self._sha256 is None or self._stale:
+            self._sha256 = uint256_from_str(self._txid)
+            self._stale = False
+        if self._hash is None:
+            self._hash = encode(self._txid[::-1], 'hex_codec').decode('ascii')
+            self._auth_digest_hex = encode(self._auth_digest[::-1], 'hex_codec').decode('ascii')
+
+    def set_digests(self, txid, auth_digest):
+        """Cache a txid and auth digest computed elsewhere (for example by
+        pipeline.hash_transactions), as calc_sha256() would."""
+        self.track()
+        self._txid = txid
+        self._auth_digest = auth_digest
+        self._hash = None
 
     def is_valid(self):
         self.calc_sha256()
@@ -1168,7 +1815,13 @@ class CTransaction(object):
         return r
 
 
-class CBlockHeader(object):
+class CBlockHeader(Serializable):
+    __slots__ = (
+        "nVersion", "hashPrevBlock", "hashMerkleRoot", "hashFinalSaplingRoot",
+        "nTime", "nBits", "nNonce", "_nSolution", "sha256", "hash",
+    )
+    nSolution = LazySlice()
+
     def __init__(self, header=None):
         if header is None:
             self.set_null()
@@ -1180,7 +1833,7 @@ class CBlockHeader(object):
             self.nTime = header.nTime
             self.nBits = header.nBits
             self.nNonce = header.nNonce
-            self.nSolution = header.nSolution
+            self.nSolution = header._nSolution
             self.sha256 = header.sha256
             self.hash = header.hash
             self.calc_sha256()
@@ -1193,47 +1846,52 @@ class CBlockHeader(object):
         self.nTime = 0
         self.nBits = 0
         self.nNonce = 0
-        self.nSolution = []
+        self.nSolution = b""
         self.sha256 = None
         self.hash = None
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
-        self.hashPrevBlock = deser_uint256(f)
-        self.hashMerkleRoot = deser_uint256(f)
-        self.hashFinalSaplingRoot = deser_uint256(f)
-        self.nTime = struct.unpack("<I", f.read(4))[0]
-        self.nBits = struct.unpack("<I", f.read(4))[0]
-        self.nNonce = deser_uint256(f)
-        self.nSolution = deser_char_vector(f)
+        (self.nVersion, hashPrevBlock, hashMerkleRoot, hashFinalSaplingRoot,
+         self.nTime, self.nBits, nNonce) = deser_struct(f, _HEADER_FIELDS)
+        self.hashPrevBlock = int.from_bytes(hashPrevBlock, "little")
+        self.hashMerkleRoot = int.from_bytes(hashMerkleRoot, "little")
+        self.hashFinalSaplingRoot = int.from_bytes(hashFinalSaplingRoot, "little")
+        self.nNonce = int.from_bytes(nNonce, "little")
+        self.nSolution = read_exact(f, deser_compact_size(f))
         self.sha256 = None
         self.hash = None
 
-    def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_uint256(self.hashPrevBlock)
-        r += ser_uint256(self.hashMerkleRoot)
-        r += ser_uint256(self.hashFinalSaplingRoot)
-        r += struct.pack("<I", self.nTime)
-        r += struct.pack("<I", self.nBits)
-        r += ser_uint256(self.nNonce)
-        r += ser_char_vector(self.nSolution)
-        return r
+    def serialize_into(self, w):
+        w += _HEADER_FIELDS.pack(
+            self.nVersion,
+            ser_uint256(self.hashPrevBlock),
+            ser_uint256(self.hashMerkleRoot),
+            ser_uint256(self.hashFinalSaplingRoot),
+            self.nTime,
+            self.nBits,
+            ser_uint256(self.nNonce))
+        w += ser_char_vector(self._nSolution)
+
+    def serialize_header(self):
+        w = bytearray()
+        CBlockHeader.serialize_into(self, w)
+        return bytes(w)
+
+    def serialized_size(self):
+        return CBlockHeader.header_size(self)
+
+    def header_size(self):
+        return _HEADER_FIELDS.size + string_size(self._nSolution)
 
     def calc_sha256(self):
         if self.sha256 is None:
-            r = b""
-            r += struct.pack("<i", self.nVersion)
-            r += ser_uint256(self.hashPrevBlock)
-            r += ser_uint256(self.hashMerkleRoot)
-            r += ser_uint256(self.hashFinalSaplingRoot)
-            r += struct.pack("<I", self.nTime)
-            r += struct.pack("<I", self.nBits)
-            r += ser_uint256(self.nNonce)
-            r += ser_char_vector(self.nSolution)
-            self.sha256 = uint256_from_str(hash256(r))
-            self.hash = encode(hash256(r)[::-1], 'hex_codec').decode('ascii')
+            self.set_hash(hash256(self.serialize_header()))
+
+    def set_hash(self, digest):
+        """Set sha256 and hash from the double-SHA256 digest of the
+        serialized header."""
+        self.sha256 = uint256_from_str(digest)
+        self.hash = digest[::-1].hex()
 
     def rehash(self):
         self.sha256 = None
@@ -1247,60 +1905,84 @@ class CBlockHeader(object):
 
 
 class CBlock(CBlockHeader):
+    """A block.
+
+    merkle_tree and auth_data_tree hold the trees over the transactions
+    from the last call to calc_merkle_root() and calc_auth_data_root(). The
+    next call only rehashes the paths above the transactions that have been
+    added, removed or replaced since, so building a block one transaction
+    at a time and recomputing its roots after each one is not quadratic.
+    """
+    transaction_class = CTransaction
+
     def __init__(self, header=None):
         super(CBlock, self).__init__(header)
         self.vtx = []
+        self.merkle_tree = txid_merkle_tree()
+        self.auth_data_tree = auth_data_merkle_tree()
 
     def deserialize(self, f):
         super(CBlock, self).deserialize(f)
-        self.vtx = deser_vector(f, CTransaction)
-
-    def serialize(self):
-        r = b""
-        r += super(CBlock, self).serialize()
-        r += ser_vector(self.vtx)
-        return r
-
-    def calc_merkle_root(self):
-        hashes = []
-        for tx in self.vtx:
-            tx.calc_sha256()
-            hashes.append(ser_uint256(tx.sha256))
-        while len(hashes) > 1:
-            newhashes = []
-            for i in range(0, len(hashes), 2):
-                i2 = min(i+1, len(hashes)-1)
-                newhashes.append(hash256(hashes[i] + hashes[i2]))
-            hashes = newhashes
-        return uint256_from_str(hashes[0])
-
-    def calc_auth_data_root(self):
-        hashes = []
-        nleaves = 0
-        for tx in self.vtx:
-            tx.calc_sha256()
-            hashes.append(tx.auth_digest)
-            nleaves += 1
-        # Continue adding leaves (of zeros) until reaching a power of 2
-        while nleaves & (nleaves-1) > 0:
-            hashes.append(b'\x00'*32)
-            nleaves += 1
-        while len(hashes) > 1:
-            newhashes = []
-            for i in range(0, len(hashes), 2):
-                digest = blake2b(digest_size=32, person=b'ZcashAuthDatHash')
-                digest.update(hashes[i])
-                digest.update(hashes[i+1])
-                newhashes.append(digest.digest())
-            hashes = newhashes
-        return uint256_from_str(hashes[0])
+        self.vtx = deser_vector(f, self.transaction_class)
+
+    def serialize_into(self, w):
+        super(CBlock, self).serialize_into(w)
+        ser_vector_into(w, self.vtx)
+
+    def serialized_size(self):
+        return self.header_size() + vector_size(self.vtx)
+
+    def clone(self):
+        """A copy of this block whose transactions are clones of this
+        block's, so transactions left unchanged in the copy are never
+        copied (see CTransaction)."""
+        block = type(self)(self)
+        block.vtx = [tx.clone() for tx in self.vtx]
+        block.merkle_tree = self.merkle_tree.copy()
+        block.auth_data_tree = self.auth_data_tree.copy()
+        return block
+
+    def tx_digests(self):
+        """The txid and auth digest of each transaction, as bytes.
+
+        The digests cached by the transactions are read directly, and only
+        transactions that have not been hashed since they last changed are
+        hashed.
+        """
+        vtx = self.vtx
+        txids = [tx._txid for tx in vtx]
+        if None in txids or None in [tx._sha256 for tx in vtx]:
+            for tx in vtx:
+                tx.calc_sha256()
+            txids = [tx._txid for tx in vtx]
+        return (txids, [tx._auth_digest for tx in vtx])
+
+    def hash_transactions(self, workers=0, executor=None):
+        """With workers > 1, or a ProcessPoolExecutor, hash the transactions
+        that have not been hashed yet in worker processes (see
+        pipeline.hash_transactions); otherwise, do nothing, and leave them
+        to be hashed in this process when their digests are read."""
+        if executor is not None or workers > 1:
+            from .pipeline import hash_transactions
+            hash_transactions(self.vtx, workers or None, executor)
+
+    def calc_merkle_root(self, workers=0, executor=None):
+        self.hash_transactions(workers, executor)
+        self.merkle_tree.update(self.tx_digests()[0])
+        return uint256_from_str(self.merkle_tree.root())
+
+    def calc_auth_data_root(self, workers=0, executor=None):
+        self.hash_transactions(workers, executor)
+        # The tree pads the leaves with zeros to a power of 2.
+        self.auth_data_tree.update(self.tx_digests()[1])
+        return uint256_from_str(self.auth_data_tree.root())
 
     def is_valid(self, n=48, k=5):
         # H(I||...
         digest = blake2b(digest_size=(512//n)*n//8, person=zcash_person(n, k))
-        digest.update(super(CBlock, self).serialize()[:108])
+        digest.update(self.serialize_header()[:108])
         hash_nonce(digest, self.nNonce)
-        if not gbp_validate(self.nSolution, digest, n, k):
+        if not gbp_validate(digest, self.nSolution, n, k):
             return False
         self.calc_sha256()
         target = uint256_from_compact(self.nBits)
@@ -1313,26 +1995,106 @@ class CBlock(CBlockHeader):
             return False
         return True
 
-    def solve(self, n=48, k=5):
+    def solve(self, n=48, k=5, workers=0, executor=None, chunk_size=4, cache=None):
+        """Find the first nonce, counting from zero, with an Equihash
+        solution for which the block hash meets nBits.
+
+        With workers > 1, or a ProcessPoolExecutor, ranges of chunk_size
+        nonces are solved in worker processes, and the ranges still queued
+        are cancelled once a solution is found. A nonce is only accepted
+        once every smaller nonce has been tried, so the result is the same
+        as with the serial search. Without an executor, a pool is created
+        for the call, and shut down once the ranges it is still running
+        are done.
+
+        The result is looked up in, and stored to, cache (a SolutionCache);
+        by default, the one named by $ZCASH_SOLUTION_CACHE, if it is set.
+        Pass cache=False to always mine.
+        """
+        if cache is None:
+            cache = default_solution_cache()
+        elif cache is False:
+            cache = None
+        if cache is not None:
+            prefix = self.serialize_header()[:108]
+            found = cache.get(prefix, n, k)
+            if found is not None:
+                if self._accept_solution(found, n, k):
+                    return
+                cache.discard(prefix, n, k)
+        if executor is not None or workers > 1:
+            self._solve_in_pool(n, k, workers, executor, chunk_size)
+        else:
+            self._solve_serially(n, k)
+        if cache is not None:
+            cache.put(prefix, n, k, self.nNonce, self.nSolution)
+
+    def _accept_solution(self, found, n, k):
+        # Use a cached (nonce, solution) if it is valid for this header.
+        (nNonce, nSolution) = (self.nNonce, self.nSolution)
+        (self.nNonce, self.nSolution) = found
+        digest = blake2b(digest_size=(512//n)*n//8, person=zcash_person(n, k))
+        digest.update(self.serialize_header()[:108])
+        hash_nonce(digest, self.nNonce)
+        self.rehash()
+        if (gbp_validate(digest, self.nSolution, n, k) and
+                self.sha256 <= uint256_from_compact(self.nBits)):
+            return True
+        (self.nNonce, self.nSolution) = (nNonce, nSolution)
+        self.rehash()
+        return False
+
+    def _solve_serially(self, n, k):
         target = uint256_from_compact(self.nBits)
         # H(I||...
         digest = blake2b(digest_size=(512//n)*n//8, person=zcash_person(n, k))
-        digest.update(super(CBlock, self).serialize()[:108])
+        digest.update(self.serialize_header()[:108])
         self.nNonce = 0
         while True:
             # H(I||V||...
             curr_digest = digest.copy()
             hash_nonce(curr_digest, self.nNonce)
             # (x_1, x_2, ...) = A(I, V, n, k)
-            solns = gbp_basic(curr_digest, n, k)
+            solns = gbp_solve(curr_digest, n, k)
             for soln in solns:
                 assert(gbp_validate(curr_digest, soln, n, k))
-                self.nSolution = soln
+                self.nSolution = bytes(soln)
                 self.rehash()
                 if self.sha256 <= target:
                     return
             self.nNonce += 1
 
+    def _solve_in_pool(self, n, k, workers, executor, chunk_size):
+        target = uint256_from_compact(self.nBits)
+        prefix = self.serialize_header()[:108]
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=workers)
+        # Keep every worker busy while waiting for the lowest range.
+        max_pending = 2 * (workers or os.cpu_count() or 1)
+        pending = deque()
+        start = 0
+        try:
+            while True:
+                while len(pending) < max_pending:
+                    pending.append(executor.submit(
+                        solve_nonces, prefix, target, n, k, start, start + chunk_size))
+                    start += chunk_size
+                found = pending.popleft().result()
+                if found is not None:
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+            if own_executor:
+                # The queued ranges are cancelled, but the ones already
+                # running are waited for, so that the workers have exited
+                # when solve() returns. Callers solving many blocks should
+                # pass an executor instead.
+                executor.shutdown(wait=True, cancel_futures=True)
+        (self.nNonce, self.nSolution) = found
+        self.rehash()
+
     def __repr__(self):
         return "CBlock(nVersion=%i hashPrevBlock=%064x hashMerkleRoot=%064x hashFinalSaplingRoot=%064x nTime=%s nBits=%08x nNonce=%064x nSolution=%r vtx=%r)" \
             % (self.nVersion, self.hashPrevBlock, self.hashMerkleRoot,
@@ -1340,7 +2102,256 @@ class CBlock(CBlockHeader):
                self.nNonce, self.nSolution, self.vtx)
 
 
-class CUnsignedAlert(object):
+def solve_nonces(prefix, target, n, k, start, stop):
+    """The first (nonce, solution) with start <= nonce < stop for which the
+    hash of the header whose first 108 bytes are prefix is at most target,
+    as in CBlock.solve, or None."""
+    digest = blake2b(digest_size=(512//n)*n//8, person=zcash_person(n, k))
+    digest.update(prefix)
+    for nonce in range(start, stop):
+        curr_digest = digest.copy()
+        hash_nonce(curr_digest, nonce)
+        header = prefix + ser_uint256(nonce)
+        for soln in gbp_solve(curr_digest, n, k):
+            assert(gbp_validate(curr_digest, soln, n, k))
+            soln = bytes(soln)
+            if uint256_from_str(hash256(header + ser_char_vector(soln))) <= target:
+                return (nonce, soln)
+    return None
+
+
+def skip_sapling_bundle(f):
+    """Advance the BytesCursor f past a v5 Sapling bundle."""
+    nSpends = deser_compact_size(f)
+    f.skip(nSpends * 96)
+    nOutputs = deser_compact_size(f)
+    f.skip(nOutputs * 756)
+    if nSpends + nOutputs > 0:
+        f.skip(8)
+    if nSpends > 0:
+        f.skip(32)
+    # zkproofs and spendAuthSigs, then the binding signature
+    f.skip(nSpends * (192 + 64) + nOutputs * 192)
+    if nSpends + nOutputs > 0:
+        f.skip(64)
+
+
+def skip_orchard_bundle(f):
+    """Advance the BytesCursor f past a v5 Orchard bundle."""
+    nActions = deser_compact_size(f)
+    f.skip(nActions * 820)
+    if nActions > 0:
+        # flags, valueBalance, anchor
+        f.skip(1 + 8 + 32)
+        f.skip(deser_compact_size(f))
+        f.skip(nActions * 64 + 64)
+
+
+def skip_transaction(f):
+    """Advance the BytesCursor f past one transaction without decoding it."""
+    header = deser_struct(f, _UINT32)[0]
+    fOverwintered = bool(header >> 31)
+    nVersion = header & 0x7FFFFFFF
+    nVersionGroupId = (deser_struct(f, _UINT32)[0]
+                       if fOverwintered else 0)
+
+    isOverwinterV3 = (fOverwintered and
+                      nVersionGroupId == OVERWINTER_VERSION_GROUP_ID and
+                      nVersion == 3)
+    isSaplingV4 = (fOverwintered and
+                   nVersionGroupId == SAPLING_VERSION_GROUP_ID and
+                   nVersion == 4)
+    isNu5V5 = (fOverwintered and
+               nVersionGroupId == ZIP225_VERSION_GROUP_ID and
+               nVersion == 5)
+
+    if isNu5V5:
+        # nConsensusBranchId, nLockTime, nExpiryHeight
+        f.skip(12)
+
+    for i in range(deser_compact_size(f)):
+        # prevout, scriptSig, nSequence
+        f.skip(36)
+        f.skip(deser_compact_size(f))
+        f.skip(4)
+    for i in range(deser_compact_size(f)):
+        # nValue, scriptPubKey
+        f.skip(8)
+        f.skip(deser_compact_size(f))
+
+    if isNu5V5:
+        skip_sapling_bundle(f)
+        skip_orchard_bundle(f)
+        return
+
+    f.skip(4)
+    if isOverwinterV3 or isSaplingV4:
+        f.skip(4)
+
+    nSpends = 0
+    nOutputs = 0
+    if isSaplingV4:
+        f.skip(8)
+        nSpends = deser_compact_size(f)
+        f.skip(nSpends * 384)
+        nOutputs = deser_compact_size(f)
+        f.skip(nOutputs * 948)
+
+    if nVersion >= 2:
+        nJoinSplits = deser_compact_size(f)
+        # Groth16 proofs from Sapling onwards, PHGR13 proofs before.
+        proof_size = 192 if isSaplingV4 else 296
+        f.skip(nJoinSplits * (304 + proof_size + ZC_NUM_JS_OUTPUTS * ZC_NOTECIPHERTEXT_SIZE))
+        if nJoinSplits > 0:
+            f.skip(32 + 64)
+
+    if isSaplingV4 and nSpends + nOutputs > 0:
+        f.skip(64)
+
+
+class LazyTxList(MutableSequence):
+    """The vtx of a deserialized LazyBlock.
+
+    Each transaction is held as a slice of the block's encoding and is only
+    decoded, as a transaction_class, when it is first accessed.
+    """
+    def __init__(self, slices, transaction_class=CTransaction):
+        self.slices = slices
+        self.txs = [None] * len(slices)
+        self.transaction_class = transaction_class
+
+    def __len__(self):
+        return len(self.txs)
+
+    def _get(self, i):
+        tx = self.txs[i]
+        if tx is None:
+            tx = self.transaction_class()
+            tx.deserialize(BytesCursor(self.slices[i]))
+            self.txs[i] = tx
+            self.slices[i] = None
+        return tx
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._get(j) for j in range(*i.indices(len(self.txs)))]
+        return self._get(i)
+
+    def __setitem__(self, i, value):
+        if isinstance(i, slice):
+            value = list(value)
+            self.txs[i] = value
+            self.slices[i] = [None] * len(value)
+        else:
+            self.txs[i] = value
+            self.slices[i] = None
+
+    def __delitem__(self, i):
+        del self.txs[i]
+        del self.slices[i]
+
+    def insert(self, i, value):
+        self.txs.insert(i, value)
+        self.slices.insert(i, None)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def is_untouched(self):
+        return all(tx is None for tx in self.txs)
+
+    def serialized_size(self):
+        size = compact_size_len(len(self.txs))
+        for (tx, raw) in zip(self.txs, self.slices):
+            size += len(raw) if tx is None else tx.serialized_size()
+        return size
+
+    def serialize_into(self, w):
+        w += ser_compact_size(len(self.txs))
+        for (tx, raw) in zip(self.txs, self.slices):
+            if tx is None:
+                w += raw
+            else:
+                tx.serialize_into(w)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class LazyBlock(CBlock):
+    """A CBlock that only decodes its header in deserialize().
+
+    The byte extent of every transaction is indexed, and vtx[i] is decoded
+    the first time it is accessed. Re-serializing a block whose header and
+    transactions have not been touched returns the original encoding.
+    """
+    def __init__(self, header=None):
+        super(LazyBlock, self).__init__(header)
+        self.raw = None
+        self.raw_header_size = 0
+
+    def deserialize(self, f):
+        if not isinstance(f, BytesCursor):
+            start = f.tell()
+            cursor = BytesCursor(f.read())
+            self.deserialize(cursor)
+            f.seek(start + cursor.tell())
+            return
+
+        start = f.tell()
+        CBlockHeader.deserialize(self, f)
+        self.raw_header_size = f.tell() - start
+        slices = []
+        for i in range(deser_compact_size(f)):
+            tx_start = f.tell()
+            skip_transaction(f)
+            slices.append(f.buf[tx_start:f.tell()])
+        self.vtx = LazyTxList(slices, self.transaction_class)
+        self.raw = f.buf[start:f.tell()]
+
+    def serialize(self):
+        raw = self.raw
+        if (raw is not None and
+                isinstance(self.vtx, LazyTxList) and self.vtx.is_untouched() and
+                self.serialize_header() == raw[:self.raw_header_size]):
+            if type(raw) is not memoryview:
+                return raw
+            if type(raw.obj) is bytes and len(raw.obj) == len(raw):
+                return raw.obj
+            return raw.tobytes()
+        return super(LazyBlock, self).serialize()
+
+    def serialize_into(self, w):
+        CBlockHeader.serialize_into(self, w)
+        if isinstance(self.vtx, LazyTxList):
+            self.vtx.serialize_into(w)
+        else:
+            ser_vector_into(w, self.vtx)
+
+    def serialized_size(self):
+        if isinstance(self.vtx, LazyTxList):
+            return self.header_size() + self.vtx.serialized_size()
+        return super(LazyBlock, self).serialized_size()
+
+
+@schema_codec
+class CUnsignedAlert(Serializable):
+    schema = (
+        ("nVersion", INT32),
+        ("nRelayUntil", INT64),
+        ("nExpiration", INT64),
+        ("nID", INT32),
+        ("nCancel", INT32),
+        ("setCancel", Vector(INT32)),
+        ("nMinVer", INT32),
+        ("nMaxVer", INT32),
+        ("setSubVer", Vector(STRING)),
+        ("nPriority", INT32),
+        ("strComment", STRING),
+        ("strStatusBar", STRING),
+        ("strReserved", STRING),
+    )
+
     def __init__(self):
         self.nVersion = 1
         self.nRelayUntil = 0
@@ -1356,38 +2367,6 @@ class CUnsignedAlert(object):
         self.strStatusBar = b""
         self.strReserved = b""
 
-    def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
-        self.nRelayUntil = struct.unpack("<q", f.read(8))[0]
-        self.nExpiration = struct.unpack("<q", f.read(8))[0]
-        self.nID = struct.unpack("<i", f.read(4))[0]
-        self.nCancel = struct.unpack("<i", f.read(4))[0]
-        self.setCancel = deser_int_vector(f)
-        self.nMinVer = struct.unpack("<i", f.read(4))[0]
-        self.nMaxVer = struct.unpack("<i", f.read(4))[0]
-        self.setSubVer = deser_string_vector(f)
-        self.nPriority = struct.unpack("<i", f.read(4))[0]
-        self.strComment = deser_string(f)
-        self.strStatusBar = deser_string(f)
-        self.strReserved = deser_string(f)
-
-    def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += struct.pack("<q", self.nRelayUntil)
-        r += struct.pack("<q", self.nExpiration)
-        r += struct.pack("<i", self.nID)
-        r += struct.pack("<i", self.nCancel)
-        r += ser_int_vector(self.setCancel)
-        r += struct.pack("<i", self.nMinVer)
-        r += struct.pack("<i", self.nMaxVer)
-        r += ser_string_vector(self.setSubVer)
-        r += struct.pack("<i", self.nPriority)
-        r += ser_string(self.strComment)
-        r += ser_string(self.strStatusBar)
-        r += ser_string(self.strReserved)
-        return r
-
     def __repr__(self):
         return "CUnsignedAlert(nVersion %d, nRelayUntil %d, nExpiration %d, nID %d, nCancel %d, nMinVer %d, nMaxVer %d, nPriority %d, strComment %s, strStatusBar %s, strReserved %s)" \
             % (self.nVersion, self.nRelayUntil, self.nExpiration, self.nID,
@@ -1395,29 +2374,38 @@ class CUnsignedAlert(object):
                self.strComment, self.strStatusBar, self.strReserved)
 
 
-class CAlert(object):
+@schema_codec
+class CAlert(Serializable):
+    schema = (
+        ("vchMsg", STRING),
+        ("vchSig", STRING),
+    )
+
     def __init__(self):
         self.vchMsg = b""
         self.vchSig = b""
 
-    def deserialize(self, f):
-        self.vchMsg = deser_string(f)
-        self.vchSig = deser_string(f)
-
-    def serialize(self):
-        r = b""
-        r += ser_string(self.vchMsg)
-        r += ser_string(self.vchSig)
-        return r
-
     def __repr__(self):
         return "CAlert(vchMsg.sz %d, vchSig.sz %d)" \
             % (len(self.vchMsg), len(self.vchSig))
 
 
 # Objects that correspond to messages on the wire
-class msg_version(object):
+@schema_codec
+class msg_version(Serializable):
     command = b"version"
+    schema = (
+        ("nVersion", INT32),
+        ("nServices", UINT64),
+        ("nTime", INT64),
+        ("addrTo", CAddress),
+        If("self.nVersion >= 106", [
+            ("addrFrom", CAddress),
+            ("nNonce", UINT64),
+            ("strSubVer", STRING),
+            If("self.nVersion >= 209", [("nStartingHeight", INT32)]),
+        ]),
+    )
 
     def __init__(self, protocol_version=SPROUT_PROTO_VERSION):
         self.nVersion = protocol_version
@@ -1430,39 +2418,9 @@ class msg_version(object):
         self.nStartingHeight = -1
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
+        self.deserialize_fields(f)
         if self.nVersion == 10300:
             self.nVersion = 300
-        self.nServices = struct.unpack("<Q", f.read(8))[0]
-        self.nTime = struct.unpack("<q", f.read(8))[0]
-        self.addrTo = CAddress()
-        self.addrTo.deserialize(f)
-        if self.nVersion >= 106:
-            self.addrFrom = CAddress()
-            self.addrFrom.deserialize(f)
-            self.nNonce = struct.unpack("<Q", f.read(8))[0]
-            self.strSubVer = deser_string(f)
-            if self.nVersion >= 209:
-                self.nStartingHeight = struct.unpack("<i", f.read(4))[0]
-            else:
-                self.nStartingHeight = None
-        else:
-            self.addrFrom = None
-            self.nNonce = None
-            self.strSubVer = None
-            self.nStartingHeight = None
-
-    def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += struct.pack("<Q", self.nServices)
-        r += struct.pack("<q", self.nTime)
-        r += self.addrTo.serialize()
-        r += self.addrFrom.serialize()
-        r += struct.pack("<Q", self.nNonce)
-        r += ser_string(self.strSubVer)
-        r += struct.pack("<i", self.nStartingHeight)
-        return r
 
     def __repr__(self):
         return 'msg_version(nVersion=%i nServices=%i nTime=%s addrTo=%s addrFrom=%s nNonce=0x%016X strSubVer=%s nStartingHeight=%i)' \
@@ -1471,59 +2429,52 @@ class msg_version(object):
                self.strSubVer, self.nStartingHeight)
 
 
-class msg_verack(object):
+@schema_codec
+class msg_verack(Serializable):
     command = b"verack"
+    schema = ()
 
     def __init__(self):
         pass
 
-    def deserialize(self, f):
-        pass
-
-    def serialize(self):
-        return b""
-
     def __repr__(self):
         return "msg_verack()"
 
 
-class msg_addr(object):
+@schema_codec
+class msg_addr(Serializable):
     command = b"addr"
+    schema = (
+        ("addrs", Vector(CAddress)),
+    )
 
     def __init__(self):
         self.addrs = []
 
-    def deserialize(self, f):
-        self.addrs = deser_vector(f, CAddress)
-
-    def serialize(self):
-        return ser_vector(self.addrs)
-
     def __repr__(self):
         return "msg_addr(addrs=%r)" % (self.addrs,)
 
 
-class msg_alert(object):
+@schema_codec
+class msg_alert(Serializable):
     command = b"alert"
+    schema = (
+        ("alert", CAlert),
+    )
 
     def __init__(self):
         self.alert = CAlert()
 
-    def deserialize(self, f):
-        self.alert = CAlert()
-        self.alert.deserialize(f)
-
-    def serialize(self):
-        r = b""
-        r += self.alert.serialize()
-        return r
-
     def __repr__(self):
         return "msg_alert(alert=%s)" % (repr(self.alert), )
 
 
-class msg_inv(object):
+@schema_codec
+class msg_inv(Serializable):
     command = b"inv"
+    schema = (
+        ("inv", Vector(CInv)),
+    )
 
     def __init__(self, inv=None):
         if inv is None:
@@ -1531,72 +2482,56 @@ class msg_inv(object):
         else:
             self.inv = inv
 
-    def deserialize(self, f):
-        self.inv = deser_vector(f, CInv)
-
-    def serialize(self):
-        return ser_vector(self.inv)
-
     def __repr__(self):
         return "msg_inv(inv=%s)" % (repr(self.inv))
 
 
-class msg_getdata(object):
+@schema_codec
+class msg_getdata(Serializable):
     command = b"getdata"
+    schema = (
+        ("inv", Vector(CInv)),
+    )
 
     def __init__(self, inv=None):
         self.inv = inv if inv != None else []
 
-    def deserialize(self, f):
-        self.inv = deser_vector(f, CInv)
-
-    def serialize(self):
-        return ser_vector(self.inv)
-
     def __repr__(self):
         return "msg_getdata(inv=%s)" % (repr(self.inv))
 
 
-class msg_notfound(object):
+@schema_codec
+class msg_notfound(Serializable):
     command = b"notfound"
+    schema = (
+        ("inv", Vector(CInv)),
+    )
 
     def __init__(self):
         self.inv = []
 
-    def deserialize(self, f):
-        self.inv = deser_vector(f, CInv)
-
-    def serialize(self):
-        return ser_vector(self.inv)
-
     def __repr__(self):
         return "msg_notfound(inv=%r)" % (self.inv,)
 
 
-class msg_getblocks(object):
+@schema_codec
+class msg_getblocks(Serializable):
     command = b"getblocks"
+    schema = (
+        ("locator", CBlockLocator),
+        ("hashstop", UINT256),
+    )
 
     def __init__(self):
         self.locator = CBlockLocator()
         self.hashstop = 0
 
-    def deserialize(self, f):
-        self.locator = CBlockLocator()
-        self.locator.deserialize(f)
-        self.hashstop = deser_uint256(f)
-
-    def serialize(self):
-        r = b""
-        r += self.locator.serialize()
-        r += ser_uint256(self.hashstop)
-        return r
-
     def __repr__(self):
         return "msg_getblocks(locator=%s hashstop=%064x)" \
             % (repr(self.locator), self.hashstop)
 
 
-class msg_tx(object):
+class msg_tx(Serializable):
     command = b"tx"
 
     def __init__(self, tx=CTransaction()):
@@ -1605,112 +2540,98 @@ class msg_tx(object):
     def deserialize(self, f):
         self.tx.deserialize(f)
 
-    def serialize(self):
-        return self.tx.serialize()
+    def serialize_into(self, w):
+        self.tx.serialize_into(w)
+
+    def serialized_size(self):
+        return self.tx.serialized_size()
 
     def __repr__(self):
         return "msg_tx(tx=%s)" % (repr(self.tx))
 
 
-class msg_block(object):
+class msg_block(Serializable):
     command = b"block"
 
     def __init__(self, block=None):
         if block is None:
-            self.block = CBlock()
+            self.block = LazyBlock()
         else:
             self.block = block
 
     def deserialize(self, f):
         self.block.deserialize(f)
 
-    def serialize(self):
-        return self.block.serialize()
+    def serialize_into(self, w):
+        self.block.serialize_into(w)
+
+    def serialized_size(self):
+        return self.block.serialized_size()
 
     def __repr__(self):
         return "msg_block(block=%s)" % (repr(self.block))
 
 
-class msg_getaddr(object):
+@schema_codec
+class msg_getaddr(Serializable):
     command = b"getaddr"
+    schema = ()
 
     def __init__(self):
         pass
 
-    def deserialize(self, f):
-        pass
-
-    def serialize(self):
-        return b""
-
     def __repr__(self):
         return "msg_getaddr()"
 
 
-class msg_ping_prebip31(object):
+@schema_codec
+class msg_ping_prebip31(Serializable):
     command = b"ping"
+    schema = ()
 
     def __init__(self):
         pass
 
-    def deserialize(self, f):
-        pass
-
-    def serialize(self):
-        return b""
-
     def __repr__(self):
         return "msg_ping() (pre-bip31)"
 
 
-class msg_ping(object):
+@schema_codec
+class msg_ping(Serializable):
     command = b"ping"
+    schema = (
+        ("nonce", UINT64),
+    )
 
     def __init__(self, nonce=0):
         self.nonce = nonce
 
-    def deserialize(self, f):
-        self.nonce = struct.unpack("<Q", f.read(8))[0]
-
-    def serialize(self):
-        r = b""
-        r += struct.pack("<Q", self.nonce)
-        return r
-
     def __repr__(self):
         return "msg_ping(nonce=%08x)" % self.nonce
 
 
-class msg_pong(object):
+@schema_codec
+class msg_pong(Serializable):
     command = b"pong"
+    schema = (
+        ("nonce", UINT64),
+    )
 
     def __init__(self, nonce=0):
         self.nonce = nonce
 
-    def deserialize(self, f):
-        self.nonce = struct.unpack("<Q", f.read(8))[0]
-
-    def serialize(self):
-        r = b""
-        r += struct.pack("<Q", self.nonce)
-        return r
-
     def __repr__(self):
         return "msg_pong(nonce=%08x)" % self.nonce
 
 
-class msg_mempool(object):
+@schema_codec
+class msg_mempool(Serializable):
     command = b"mempool"
+    schema = ()
 
     def __init__(self):
         pass
 
-    def deserialize(self, f):
-        pass
-
-    def serialize(self):
-        return b""
-
     def __repr__(self):
         return "msg_mempool()"
 
@@ -1719,24 +2640,18 @@ class msg_mempool(object):
 # number of entries
 # vector of hashes
 # hash_stop (hash of last desired block header, 0 to get as many as possible)
-class msg_getheaders(object):
+@schema_codec
+class msg_getheaders(Serializable):
     command = b"getheaders"
+    schema = (
+        ("locator", CBlockLocator),
+        ("hashstop", UINT256),
+    )
 
     def __init__(self):
         self.locator = CBlockLocator()
         self.hashstop = 0
 
-    def deserialize(self, f):
-        self.locator = CBlockLocator()
-        self.locator.deserialize(f)
-        self.hashstop = deser_uint256(f)
-
-    def serialize(self):
-        r = b""
-        r += self.locator.serialize()
-        r += ser_uint256(self.hashstop)
-        return r
-
     def __repr__(self):
         return "msg_getheaders(locator=%s, stop=%064x)" \
             % (repr(self.locator), self.hashstop)
@@ -1744,7 +2659,7 @@ class msg_getheaders(object):
 
 # headers message has
 # <count> <vector of block headers>
-class msg_headers(object):
+class msg_headers(Serializable):
     command = b"headers"
 
     def __init__(self):
@@ -1752,21 +2667,49 @@ class msg_headers(object):
 
     def deserialize(self, f):
         # comment in bitcoind indicates these should be deserialized as blocks
-        blocks = deser_vector(f, CBlock)
-        for x in blocks:
-            self.headers.append(CBlockHeader(x))
-
-    def serialize(self):
-        blocks = [CBlock(x) for x in self.headers]
-        return ser_vector(blocks)
+        self.headers = []
+        for i in range(deser_compact_size(f)):
+            header = CBlockHeader()
+            start = f.tell()
+            header.deserialize(f)
+            if isinstance(f, BytesCursor):
+                # Hash the header as received instead of re-encoding it.
+                header.set_hash(hash256(f.buf[start:f.tell()]))
+            else:
+                header.calc_sha256()
+            # The transaction vector, which is empty.
+            deser_vector(f, CTransaction)
+            self.headers.append(header)
+
+    def serialize_into(self, w):
+        # Each header is followed by an empty transaction vector.
+        w += ser_compact_size(len(self.headers))
+        for header in self.headers:
+            CBlockHeader.serialize_into(header, w)
+            w += b"\x00"
+
+    def serialized_size(self):
+        size = compact_size_len(len(self.headers))
+        for header in self.headers:
+            size += header.header_size() + 1
+        return size
 
     def __repr__(self):
         return "msg_headers(headers=%s)" % repr(self.headers)
 
 
-class msg_reject(object):
+@schema_codec
+class msg_reject(Serializable):
     command = b"reject"
     REJECT_MALFORMED = 1
+    schema = (
+        ("message", STRING),
+        ("code", UINT8),
+        ("reason", STRING),
+        If("self.code != self.REJECT_MALFORMED and "
+           "(self.message == b\"block\" or self.message == b\"tx\")",
+           [("data", UINT256)], absent=UNCHANGED),
+    )
 
     def __init__(self):
         self.message = b""
@@ -1774,23 +2717,6 @@ class msg_reject(object):
         self.reason = b""
         self.data = 0
 
-    def deserialize(self, f):
-        self.message = deser_string(f)
-        self.code = struct.unpack("<B", f.read(1))[0]
-        self.reason = deser_string(f)
-        if (self.code != self.REJECT_MALFORMED and
-                (self.message == b"block" or self.message == b"tx")):
-            self.data = deser_uint256(f)
-
-    def serialize(self):
-        r = ser_string(self.message)
-        r += struct.pack("<B", self.code)
-        r += ser_string(self.reason)
-        if (self.code != self.REJECT_MALFORMED and
-                (self.message == b"block" or self.message == b"tx")):
-            r += ser_uint256(self.data)
-        return r
-
     def __eq__(self, other):
         return (
             (type(self) == type(other)) and (
@@ -1804,34 +2730,28 @@ class msg_reject(object):
             % (self.message, self.code, self.reason, self.data)
 
 
-class msg_filteradd(object):
+@schema_codec
+class msg_filteradd(Serializable):
     command = b"filteradd"
+    schema = (
+        ("data", STRING),
+    )
 
     def __init__(self):
         self.data = b""
 
-    def deserialize(self, f):
-        self.data = deser_string(f)
-
-    def serialize(self):
-        return ser_string(self.data)
-
     def __repr__(self):
         return "msg_filteradd(data=%r)" % (self.data,)
 
 
-class msg_filterclear(object):
+@schema_codec
+class msg_filterclear(Serializable):
     command = b"filterclear"
+    schema = ()
 
     def __init__(self):
         pass
 
-    def deserialize(self, f):
-        pass
-
-    def serialize(self):
-        return b""
-
     def __repr__(self):
         return "msg_filterclear()"
 
@@ -2027,28 +2947,28 @@ class NodeConn(asyncore.dispatcher):
                     if len(self.recvbuf) < 4 + 12 + 4:
                         return
                     command = self.recvbuf[4:4+12].split(b"\x00", 1)[0]
-                    msglen = struct.unpack("<i", self.recvbuf[4+12:4+12+4])[0]
+                    msglen = _INT32.unpack(self.recvbuf[4+12:4+12+4])[0]
                     checksum = None
                     if len(self.recvbuf) < 4 + 12 + 4 + msglen:
                         return
-                    msg = self.recvbuf[4+12+4:4+12+4+msglen]
+                    msg = memoryview(self.recvbuf)[4+12+4:4+12+4+msglen]
                     self.recvbuf = self.recvbuf[4+12+4+msglen:]
                 else:
                     if len(self.recvbuf) < 4 + 12 + 4 + 4:
                         return
                     command = self.recvbuf[4:4+12].split(b"\x00", 1)[0]
-                    msglen = struct.unpack("<i", self.recvbuf[4+12:4+12+4])[0]
+                    msglen = _INT32.unpack(self.recvbuf[4+12:4+12+4])[0]
                     checksum = self.recvbuf[4+12+4:4+12+4+4]
                     if len(self.recvbuf) < 4 + 12 + 4 + 4 + msglen:
                         return
-                    msg = self.recvbuf[4+12+4+4:4+12+4+4+msglen]
+                    msg = memoryview(self.recvbuf)[4+12+4+4:4+12+4+4+msglen]
                     th = sha256(msg)
                     h = sha256(th)
                     if checksum != h[:4]:
                         raise ValueError("got bad checksum %r" % (self.recvbuf,))
                     self.recvbuf = self.recvbuf[4+12+4+4+msglen:]
                 if command in self.messagemap:
-                    f = BytesIO(msg)
+                    f = BytesCursor(msg)
                     t = self.messagemap[command]()
                     t.deserialize(f)
                     self.got_message(t)
@@ -2069,7 +2989,7 @@ class NodeConn(asyncore.dispatcher):
         tmsg = self.MAGIC_BYTES[self.network]
         tmsg += command
         tmsg += b"\x00" * (12 - len(command))
-        tmsg += struct.pack("<I", len(data))
+        tmsg += _UINT32.pack(len(data))
         if self.ver_send >= 209:
             th = sha256(data)
             h = sha256(th)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 The Zcash developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://www.opensource.org/licenses/mit-license.php .
+
+#
+# opaque.py
+#
+# Shielded components that deserialize() keeps as opaque slices of the
+# source buffer.
+#
+# Decoding a JoinSplit, a Sapling description or a v5 bundle field by field
+# costs a Python call per field, even though most analyses never look inside
+# the proofs, ciphertexts and signatures that make up nearly all of their
+# bytes. The classes here only find the extent of each component when they
+# are decoded; the fields are decoded from that slice the first time one of
+# them is read or assigned, and until then the slice is what is serialized,
+# so re-encoding is byte-exact.
+#
+# OpaqueTransaction, OpaqueBlock and OpaqueLazyBlock use these classes for
+# every shielded component.
+#
+
+from .mininode import (
+    ZC_NOTECIPHERTEXT_SIZE,
+    ZC_NUM_JS_OUTPUTS,
+    BytesCursor,
+    CBlock,
+    CTransaction,
+    JSDescription,
+    LazyBlock,
+    OrchardBundle,
+    OutputDescription,
+    SaplingBundle,
+    SpendDescription,
+    skip_orchard_bundle,
+    skip_sapling_bundle,
+)
+
+# The encoded sizes of a JoinSplit with each kind of proof.
+JOINSPLIT_SIZE_GROTH16 = 304 + 192 + ZC_NUM_JS_OUTPUTS * ZC_NOTECIPHERTEXT_SIZE
+JOINSPLIT_SIZE_PHGR13 = 304 + 296 + ZC_NUM_JS_OUTPUTS * ZC_NOTECIPHERTEXT_SIZE
+
+# The value of _raw for an object whose fields have not been set yet.
+_UNSET = object()
+
+
+class OpaquePayload(object):
+    """Mixin for a TrackedObject class whose deserialize() only records the
+    object's encoding, in _raw.
+
+    Subclasses implement read_payload(f), which returns the encoding, and
+    may override decode_payload(f) to decode it. Reading or assigning any
+    public field first decodes the fields, without invalidating the owner.
+    Objects are created without running __init__ of the payload class;
+    an object that is used without being deserialized is initialized on
+    first use instead.
+    """
+    __slots__ = ()
+
+    def __new__(cls, *args, **kwargs):
+        self = super(OpaquePayload, cls).__new__(cls)
+        object.__setattr__(self, "_raw", _UNSET)
+        return self
+
+    def __init__(self):
+        pass
+
+    def deserialize(self, f, *args):
+        if not isinstance(f, BytesCursor):
+            # Without a buffer to slice, decode as usual.
+            self.materialize()
+            self.decode_payload(f, *args)
+            return
+        object.__setattr__(self, "_raw", self.read_payload(f, *args))
+
+    def decode_payload(self, f, *args):
+        super(OpaquePayload, self).deserialize(f, *args)
+
+    def is_opaque(self):
+        return self._raw is not None and self._raw is not _UNSET
+
+    def materialize(self):
+        """Decode the fields, if that has not been done yet."""
+        raw = self._raw
+        if raw is None:
+            return
+        # Fill the fields in as an untracked object, so that the owners are
+        # not invalidated, and attach them afterwards if this one is tracked.
+        cls = type(self)
+        object.__setattr__(self, "__class__", self.untracked_class)
+        object.__setattr__(self, "_raw", None)
+        try:
+            super(OpaquePayload, self).__init__()
+            if raw is not _UNSET:
+                self.decode_payload(BytesCursor(raw))
+        finally:
+            object.__setattr__(self, "__class__", cls)
+        if cls is not self.untracked_class:
+            self.attach_parts()
+
+    def __getattr__(self, name):
+        # Only reached for fields that are not set.
+        if name[0] == "_" or self._raw is None:
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+        self.materialize()
+        return getattr(self, name)
+
+    def __setattr__(self, name, value):
+        if name[0] != "_" and self._raw is not None:
+            self.materialize()
+        super(OpaquePayload, self).__setattr__(name, value)
+
+    def __getstate__(self):
+        if self._raw is _UNSET:
+            return {}
+        if self._raw is not None:
+            return {"_raw": self._raw}
+        return super(OpaquePayload, self).__getstate__()
+
+    def serialize_into(self, w):
+        if self.is_opaque():
+            w += self._raw
+        else:
+            self.materialize()
+            super(OpaquePayload, self).serialize_into(w)
+
+    def serialized_size(self):
+        if self.is_opaque():
+            return len(self._raw)
+        self.materialize()
+        return super(OpaquePayload, self).serialized_size()
+
+    def __repr__(self):
+        self.materialize()
+        return super(OpaquePayload, self).__repr__()
+
+
+class OpaqueSpendDescription(OpaquePayload, SpendDescription):
+    __slots__ = ("_raw",)
+
+    def read_payload(self, f):
+        return f.read(32 * 4 + 192 + 64)
+
+
+class OpaqueOutputDescription(OpaquePayload, OutputDescription):
+    __slots__ = ("_raw",)
+
+    def read_payload(self, f):
+        return f.read(32 * 3 + 580 + 80 + 192)
+
+
+class OpaqueJSDescription(OpaquePayload, JSDescription):
+    __slots__ = ("_raw", "_use_groth16")
+
+    def read_payload(self, f, use_groth16=True):
+        self._use_groth16 = use_groth16
+        return f.read(JOINSPLIT_SIZE_GROTH16 if use_groth16 else JOINSPLIT_SIZE_PHGR13)
+
+    def decode_payload(self, f, use_groth16=None):
+        if use_groth16 is None:
+            use_groth16 = self._use_groth16
+        JSDescription.deserialize(self, f, use_groth16)
+
+    def __getstate__(self):
+        state = super(OpaqueJSDescription, self).__getstate__()
+        if "_raw" in state:
+            # The kind of proof is needed to decode the payload.
+            state["_use_groth16"] = self._use_groth16
+        return state
+
+
+class OpaqueSaplingBundle(OpaquePayload, SaplingBundle):
+    def read_payload(self, f):
+        start = f.tell()
+        skip_sapling_bundle(f)
+        return f.buf[start:f.tell()]
+
+
+class OpaqueOrchardBundle(OpaquePayload, OrchardBundle):
+    def read_payload(self, f):
+        start = f.tell()
+        skip_orchard_bundle(f)
+        return f.buf[start:f.tell()]
+
+
+class OpaqueTransaction(CTransaction):
+    """A CTransaction whose shielded components are decoded on demand."""
+    sapling_bundle_class = OpaqueSaplingBundle
+    orchard_bundle_class = OpaqueOrchardBundle
+    spend_description_class = OpaqueSpendDescription
+    output_description_class = OpaqueOutputDescription
+    joinsplit_class = OpaqueJSDescription
+
+
+class OpaqueBlock(CBlock):
+    """A CBlock whose transactions are OpaqueTransactions."""
+    transaction_class = OpaqueTransaction
+
+
+class OpaqueLazyBlock(LazyBlock):
+    """A LazyBlock whose transactions are decoded as OpaqueTransactions."""
+    transaction_class = OpaqueTransaction
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 The Zcash developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://www.opensource.org/licenses/mit-license.php .
+
+#
+# pipeline.py
+#
+# A process-pool stage for decoding and hashing a stream of serialized
+# blocks, for analyses that cover more blocks than one core can hash in
+# reasonable time.
+#
+# Blocks are sent to the workers in batches, and only a bounded number of
+# batches is in flight at once, so a source that yields an arbitrarily long
+# chain (see raw_blocks_from_files and raw_blocks_from_rpc) is consumed at
+# the rate the workers process it. Workers return only the digests, which
+# are much smaller than the decoded blocks; the block itself can be decoded
+# again cheaply in the parent as a LazyBlock over the raw bytes.
+#
+# hash_transactions applies the same idea to the transactions of a single
+# large block: their encodings are placed in one shared memory segment that
+# every worker maps, and each worker is sent only the extents of its share.
+#
+
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import os
+
+from .blockfiles import REGTEST_MAGIC, BlockFile, block_file_paths
+from .mininode import BytesCursor, CTransaction, LazyBlock
+
+# The digests of one block: its hash, the txid and auth digest of each of its
+# transactions (as in CTransaction.sha256 and CTransaction.auth_digest), the
+# roots computed from them, and the block's serialized size.
+BlockDigests = namedtuple("BlockDigests", [
+    "sha256", "txids", "auth_digests", "merkle_root", "auth_data_root", "size",
+])
+
+
+def hash_block(raw):
+    """Decode the serialized block raw and compute its BlockDigests."""
+    block = LazyBlock()
+    block.deserialize(BytesCursor(raw))
+    block.calc_sha256()
+    for tx in block.vtx:
+        tx.calc_sha256()
+    return BlockDigests(
+        block.sha256,
+        [tx.sha256 for tx in block.vtx],
+        [tx.auth_digest for tx in block.vtx],
+        block.calc_merkle_root(),
+        block.calc_auth_data_root(),
+        len(raw))
+
+
+def _hash_batch(batch):
+    return [hash_block(raw) for raw in batch]
+
+
+def _batches(raw_blocks, batch_size):
+    batch = []
+    for raw in raw_blocks:
+        # Views of a block file cannot be sent to another process.
+        batch.append(bytes(raw))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def hash_blocks(raw_blocks, workers=None, batch_size=16, max_pending=None):
+    """Yield the BlockDigests of each serialized block in raw_blocks, in
+    order.
+
+    The work is spread over a pool of `workers` processes (by default, one
+    per CPU); with workers=0 the blocks are hashed in this process instead.
+    At most max_pending batches of batch_size blocks (by default, two per
+    worker) are read ahead of the block being yielded. Closing the generator
+    early shuts the pool down without waiting for the remaining batches.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 0:
+        for raw in raw_blocks:
+            yield hash_block(raw)
+        return
+    if max_pending is None:
+        max_pending = 2 * workers
+
+    batches = _batches(raw_blocks, batch_size)
+    pending = deque()
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for batch in batches:
+            pending.append(executor.submit(_hash_batch, batch))
+            if len(pending) >= max_pending:
+                for digests in pending.popleft().result():
+                    yield digests
+        while pending:
+            for digests in pending.popleft().result():
+                yield digests
+    finally:
+        for future in pending:
+            future.cancel()
+        # Don't wait for the batches that are already running.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _hash_shared_transactions(name, extents):
+    shm = SharedMemory(name=name)
+    try:
+        digests = []
+        for (start, end) in extents:
+            tx = CTransaction()
+            # Copy the encoding out, so that no view of the segment outlives
+            # this call.
+            tx.deserialize(BytesCursor(bytes(shm.buf[start:end])))
+            tx.calc_sha256()
+            digests.append((tx._txid, tx._auth_digest))
+        return digests
+    finally:
+        shm.close()
+
+
+def hash_transactions(txs, workers=None, executor=None, shards_per_worker=4):
+    """Compute the txid and auth digest of every transaction in txs that
+    has not been hashed yet, in worker processes, and cache them on the
+    transactions (see CTransaction.set_digests).
+
+    The work is split into shards_per_worker shards for each of `workers`
+    workers (by default, one per CPU); as in hash_blocks, with workers=0
+    the transactions are hashed in this process instead. The shards run in
+    executor, a ProcessPoolExecutor, if one is given, and otherwise in a
+    new pool of that many processes. Creating the pool takes far longer
+    than hashing a typical block, so callers hashing several blocks should
+    pass the same executor each time; see the 'parallel' benchmark in
+    qa/zcash/test_framework_benchmarks.py for where this starts to pay off.
+    CBlock.calc_merkle_root and calc_auth_data_root take the same workers
+    and executor arguments.
+    """
+    pending = [tx for tx in txs if tx._txid is None]
+    if not pending:
+        return
+    if workers == 0:
+        for tx in pending:
+            tx.calc_sha256()
+        return
+    w = bytearray()
+    extents = []
+    for tx in pending:
+        start = len(w)
+        tx.serialize_into(w)
+        extents.append((start, len(w)))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    shm = SharedMemory(create=True, size=len(w))
+    try:
+        shm.buf[:len(w)] = w
+        # Shards of roughly equal size in bytes.
+        n_shards = max(1, min(len(pending), workers * shards_per_worker))
+        shard_size = len(w) / n_shards
+        shards = [[]]
+        for extent in extents:
+            if shards[-1] and extent[0] >= shard_size * len(shards):
+                shards.append([])
+            shards[-1].append(extent)
+        futures = [executor.submit(_hash_shared_transactions, shm.name, shard)
+                   for shard in shards]
+        i = 0
+        for future in futures:
+            for (txid, auth_digest) in future.result():
+                pending[i].set_digests(txid, auth_digest)
+                pending[i].calc_sha256()
+                i += 1
+    finally:
+        shm.close()
+        shm.unlink()
+        if own_executor:
+            executor.shutdown()
+
+
+def raw_blocks_from_files(blocks_dir, magic=REGTEST_MAGIC):
+    """Yield each serialized block stored in blocks_dir, in storage order
+    (see blockfiles.iter_blocks)."""
+    for path in block_file_paths(blocks_dir):
+        with BlockFile(path, magic) as block_file:
+            for extent in block_file.extents():
+                yield bytes(block_file.read(extent))
+
+
+def raw_blocks_from_rpc(node, block_hashes):
+    """Yield each block in block_hashes (hex strings) as serialized by
+    node."""
+    for block_hash in block_hashes:
+        yield bytes.fromhex(node.getblock(block_hash, 0))
@@ -830,87 +830,126 @@ SIGHASH_ANYONECANPAY = 0x80
 
 def getHashPrevouts(tx, person=b'ZcashPrevoutHash'):
     digest = blake2b(digest_size=32, person=person)
-    for x in tx.vin:
+    for x in tx.peek('vin'):
         digest.update(x.prevout.serialize())
     return digest.digest()
 
 def getHashSequence(tx, person=b'ZcashSequencHash'):
     digest = blake2b(digest_size=32, person=person)
-    for x in tx.vin:
+    for x in tx.peek('vin'):
         digest.update(struct.pack('<I', x.nSequence))
     return digest.digest()
 
 def getHashOutputs(tx, person=b'ZcashOutputsHash'):
     digest = blake2b(digest_size=32, person=person)
-    for x in tx.vout:
+    for x in tx.peek('vout'):
         digest.update(x.serialize())
     return digest.digest()
 
 def getHashJoinSplits(tx):
     digest = blake2b(digest_size=32, person=b'ZcashJSplitsHash')
-    for jsdesc in tx.vJoinSplit:
+    for jsdesc in tx.peek('vJoinSplit'):
         digest.update(jsdesc.serialize())
-    digest.update(tx.joinSplitPubKey)
+    digest.update(ser_uint256(tx.joinSplitPubKey))
     return digest.digest()
 
 def getHashShieldedSpends(tx):
     digest = blake2b(digest_size=32, person=b'ZcashSSpendsHash')
-    for desc in tx.shieldedSpends:
+    for desc in tx.peek('shieldedSpends'):
         # We don't pass in serialized form of desc as spendAuthSig is not part of the hash
         digest.update(ser_uint256(desc.cv))
         digest.update(ser_uint256(desc.anchor))
         digest.update(ser_uint256(desc.nullifier))
         digest.update(ser_uint256(desc.rk))
-        digest.update(desc.proof)
+        digest.update(desc.zkproof.serialize())
     return digest.digest()
 
 def getHashShieldedOutputs(tx):
     digest = blake2b(digest_size=32, person=b'ZcashSOutputHash')
-    for desc in tx.shieldedOutputs:
+    for desc in tx.peek('shieldedOutputs'):
         digest.update(desc.serialize())
     return digest.digest()
 
+class PrecomputedTransactionData(object):
+    """The digests that all the signature hashes of a transaction share,
+    computed once, as in zcashd.
 
-def SignatureHash(script, txTo, inIdx, hashtype, amount, consensusBranchId):
-    """Consensus-correct SignatureHash"""
-    if inIdx >= len(txTo.vin):
-        raise ValueError("inIdx %d out of range (%d)" % (inIdx, len(txTo.vin)))
+    Passing one to SignatureHash or zip244.signature_digest makes the cost
+    of each further signature hash independent of the size of the
+    transaction. It is a snapshot of the transaction: it must be rebuilt if
+    the inputs, outputs, header fields or shielded parts change, but not
+    when the scriptSigs are filled in, as they are not hashed.
+    """
+    def __init__(self, txTo):
+        if txTo.nVersion >= 5:
+            # ZIP 244
+            from test_framework import zip244
+            self.headerDigest = zip244.header_digest(txTo)
+            self.transparentDigest = zip244.transparent_digest(txTo)
+            self.prevoutsDigest = zip244.prevouts_digest(txTo)
+            self.sequenceDigest = zip244.sequence_digest(txTo)
+            self.outputsDigest = zip244.outputs_digest(txTo)
+            self.saplingDigest = zip244.sapling_digest(txTo.peek('saplingBundle'))
+            self.orchardDigest = zip244.orchard_digest(txTo.peek('orchardBundle'))
+        else:
+            # ZIP 243
+            self.hashPrevouts = getHashPrevouts(txTo)
+            self.hashSequence = getHashSequence(txTo)
+            self.hashOutputs = getHashOutputs(txTo)
+            self.hashJoinSplits = b'\x00'*32
+            self.hashShieldedSpends = b'\x00'*32
+            self.hashShieldedOutputs = b'\x00'*32
+            if len(txTo.peek('vJoinSplit')) > 0:
+                self.hashJoinSplits = getHashJoinSplits(txTo)
+            if len(txTo.peek('shieldedSpends')) > 0:
+                self.hashShieldedSpends = getHashShieldedSpends(txTo)
+            if len(txTo.peek('shieldedOutputs')) > 0:
+                self.hashShieldedOutputs = getHashShieldedOutputs(txTo)
+
+
+def SignatureHash(script, txTo, inIdx, hashtype, amount, consensusBranchId, txdata=None):
+    """Consensus-correct SignatureHash
+
+    v5 transactions are hashed as in ZIP 244, using their own
+    nConsensusBranchId, and an inIdx of None gives the signature hash for
+    the shielded parts. txdata is a PrecomputedTransactionData for txTo;
+    without one, the shared digests are computed for this call only.
+    """
+    if inIdx is not None and inIdx >= len(txTo.peek('vin')):
+        raise ValueError("inIdx %d out of range (%d)" % (inIdx, len(txTo.peek('vin'))))
+
+    if txTo.nVersion >= 5:
+        from test_framework import zip244
+        txin = None
+        if inIdx is not None:
+            txin = zip244.TransparentInput(inIdx, script, amount)
+        return (zip244.signature_digest(txTo, hashtype, txin, txdata), None)
 
     if consensusBranchId != 0:
         # ZIP 243
+        if txdata is None:
+            txdata = PrecomputedTransactionData(txTo)
         hashPrevouts = b'\x00'*32
         hashSequence = b'\x00'*32
         hashOutputs = b'\x00'*32
-        hashJoinSplits = b'\x00'*32
-        hashShieldedSpends = b'\x00'*32
-        hashShieldedOutputs = b'\x00'*32
 
         if not (hashtype & SIGHASH_ANYONECANPAY):
-            hashPrevouts = getHashPrevouts(txTo)
+            hashPrevouts = txdata.hashPrevouts
 
         if (not (hashtype & SIGHASH_ANYONECANPAY)) and \
             (hashtype & 0x1f) != SIGHASH_SINGLE and \
             (hashtype & 0x1f) != SIGHASH_NONE:
-            hashSequence = getHashSequence(txTo)
+            hashSequence = txdata.hashSequence
 
         if (hashtype & 0x1f) != SIGHASH_SINGLE and \
             (hashtype & 0x1f) != SIGHASH_NONE:
-            hashOutputs = getHashOutputs(txTo)
+            hashOutputs = txdata.hashOutputs
         elif (hashtype & 0x1f) == SIGHASH_SINGLE and \
-            0 <= inIdx and inIdx < len(txTo.vout):
+            inIdx is not None and 0 <= inIdx and inIdx < len(txTo.peek('vout')):
             digest = blake2b(digest_size=32, person=b'ZcashOutputsHash')
-            digest.update(txTo.vout[inIdx].serialize())
+            digest.update(txTo.peek('vout')[inIdx].serialize())
             hashOutputs = digest.digest()
 
-        if len(txTo.vJoinSplit) > 0:
-            hashJoinSplits = getHashJoinSplits(txTo)
-
-        if len(txTo.shieldedSpends) > 0:
-            hashShieldedSpends = getHashShieldedSpends(txTo)
-
-        if len(txTo.shieldedOutputs) > 0:
-            hashShieldedOutputs = getHashShieldedOutputs(txTo)
-
         digest = blake2b(
             digest_size=32,
             person=b'ZcashSigHash' + struct.pack('<I', consensusBranchId),
@@ -921,19 +960,19 @@ def SignatureHash(script, txTo, inIdx, hashtype, amount, consensusBranchId):
         digest.update(hashPrevouts)
         digest.update(hashSequence)
         digest.update(hashOutputs)
-        digest.update(hashJoinSplits)
-        digest.update(hashShieldedSpends)
-        digest.update(hashShieldedOutputs)
+        digest.update(txdata.hashJoinSplits)
+        digest.update(txdata.hashShieldedSpends)
+        digest.update(txdata.hashShieldedOutputs)
         digest.update(struct.pack('<I', txTo.nLockTime))
         digest.update(struct.pack('<I', txTo.nExpiryHeight))
-        digest.update(struct.pack('<Q', txTo.valueBalance))
+        digest.update(struct.pack('<q', txTo.valueBalance))
         digest.update(struct.pack('<I', hashtype))
 
         if inIdx is not None:
-            digest.update(txTo.vin[inIdx].prevout.serialize())
+            digest.update(txTo.peek('vin')[inIdx].prevout.serialize())
             digest.update(ser_string(script))
             digest.update(struct.pack('<Q', amount))
-            digest.update(struct.pack('<I', txTo.vin[inIdx].nSequence))
+            digest.update(struct.pack('<I', txTo.peek('vin')[inIdx].nSequence))
 
         return (digest.digest(), None)
     else:
@@ -977,3 +1016,20 @@ def SignatureHash(script, txTo, inIdx, hashtype, amount, consensusBranchId):
         hash = hash256(s)
 
         return (hash, None)
+
+def SignatureHashes(txTo, inputs, hashtypes=(SIGHASH_ALL,), consensusBranchId=0, txdata=None):
+    """The signature hashes of several inputs of txTo at once.
+
+    inputs is a list of (inIdx, script, amount); the result maps each
+    (inIdx, hashtype) to its signature hash. The digests shared by all the
+    inputs are computed once (see PrecomputedTransactionData), except for
+    pre-Overwinter transactions, which have none.
+    """
+    if txdata is None and (txTo.nVersion >= 5 or consensusBranchId != 0):
+        txdata = PrecomputedTransactionData(txTo)
+    sighashes = {}
+    for (inIdx, script, amount) in inputs:
+        for hashtype in hashtypes:
+            (sighashes[(inIdx, hashtype)], _) = SignatureHash(
+                script, txTo, inIdx, hashtype, amount, consensusBranchId, txdata)
+    return sighashes
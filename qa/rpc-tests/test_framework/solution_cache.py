@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 The Zcash developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://www.opensource.org/licenses/mit-license.php .
+
+#
+# solution_cache.py
+#
+# An on-disk cache of the Equihash solutions found by CBlock.solve.
+#
+# Most tests build the same blocks on every run, so the nonce and solution
+# that CBlock.solve finds for a header are stored under a key derived from
+# the first 108 bytes of the header (everything but the nonce and the
+# solution) and the Equihash parameters. Each entry is one file named by its
+# key, written to a temporary file and renamed into place, so parallel test
+# jobs can share a cache directory without locking: readers never see a
+# partial entry, and two jobs that mine the same header write the same
+# entry. When the cache holds more than max_entries entries, the least
+# recently used ones are removed.
+#
+# CBlock.solve uses the cache in the directory named by the
+# ZCASH_SOLUTION_CACHE environment variable, if it is set. Cached solutions
+# are checked before they are used, so a stale or damaged entry only costs
+# the time to mine the block again.
+#
+
+import hashlib
+import os
+import struct
+import tempfile
+
+SOLUTION_CACHE_ENV = "ZCASH_SOLUTION_CACHE"
+
+# Bytes of the nonce at the start of each entry.
+_NONCE_SIZE = 32
+
+
+def solution_key(prefix, n, k):
+    """The key of the entry for a header whose first 108 bytes are prefix."""
+    return hashlib.sha256(bytes(prefix) + struct.pack("<II", n, k)).hexdigest()
+
+
+class SolutionCache(object):
+    """A directory of Equihash solutions, keyed by header prefix and (n, k)."""
+    def __init__(self, directory, max_entries=10000):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, prefix, n, k):
+        """The (nonce, solution) stored for prefix and (n, k), or None."""
+        path = self._path(solution_key(prefix, n, k))
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Mark the entry as recently used.
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        if len(data) <= _NONCE_SIZE:
+            return None
+        return (int.from_bytes(data[:_NONCE_SIZE], "little"), data[_NONCE_SIZE:])
+
+    def put(self, prefix, n, k, nonce, solution):
+        data = nonce.to_bytes(_NONCE_SIZE, "little") + bytes(solution)
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(solution_key(prefix, n, k)))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self.evict()
+
+    def discard(self, prefix, n, k):
+        try:
+            os.unlink(self._path(solution_key(prefix, n, k)))
+        except FileNotFoundError:
+            pass
+
+    def entries(self):
+        """(mtime, name) of each entry."""
+        result = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    result.append((entry.stat().st_mtime, entry.name))
+                except FileNotFoundError:
+                    # Evicted by another process.
+                    pass
+        return result
+
+    def __len__(self):
+        return len(self.entries())
+
+    def evict(self):
+        """Remove the least recently used entries beyond max_entries."""
+        entries = self.entries()
+        excess = len(entries) - self.max_entries
+        if excess <= 0:
+            return
+        entries.sort()
+        for (_, name) in entries[:excess]:
+            try:
+                os.unlink(self._path(name))
+            except FileNotFoundError:
+                pass
+
+
+_default_caches = {}
+
+def default_solution_cache():
+    """The SolutionCache named by $ZCASH_SOLUTION_CACHE, or None."""
+    directory = os.getenv(SOLUTION_CACHE_ENV, "")
+    if not directory:
+        return None
+    cache = _default_caches.get(directory)
+    if cache is None:
+        cache = _default_caches[directory] = SolutionCache(directory)
+    return cache
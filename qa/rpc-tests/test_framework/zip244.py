@@ -10,42 +10,76 @@
 #
 # This file is modified from zcash/zcash-test-vectors.
 #
+# The digests of a bundle, and of the header and transparent parts of a
+# transaction, are memoized on the bundle or transaction until it is next
+# modified (see mininode.DigestCache), so computing the txid, the auth
+# digest and the signature digest of every input hashes each part once.
+#
 
+from collections import namedtuple
+import functools
 import struct
 
 from hashlib import blake2b
 
+from .columnar import ColumnarOrchardBundle, ColumnarSaplingBundle, row_bytes
 from .mininode import ser_string, ser_uint256
 from .script import (
+    SIGHASH_ALL,
     SIGHASH_ANYONECANPAY,
     SIGHASH_NONE,
     SIGHASH_SINGLE,
+    PrecomputedTransactionData,
     getHashOutputs,
     getHashPrevouts,
     getHashSequence,
 )
 
 
+def memoized_digest(f):
+    """Decorator for a digest of a bundle or transaction that caches the
+    result on it."""
+    name = f.__name__
+    @functools.wraps(f)
+    def cached(obj):
+        return obj.cached_digest(name, f)
+    return cached
+
 # Transparent
 
+@memoized_digest
+def prevouts_digest(tx):
+    return getHashPrevouts(tx, b'ZTxIdPrevoutHash')
+
+@memoized_digest
+def sequence_digest(tx):
+    return getHashSequence(tx, b'ZTxIdSequencHash')
+
+@memoized_digest
+def outputs_digest(tx):
+    return getHashOutputs(tx, b'ZTxIdOutputsHash')
+
+@memoized_digest
 def transparent_digest(tx):
     digest = blake2b(digest_size=32, person=b'ZTxIdTranspaHash')
 
-    if len(tx.vin) + len(tx.vout) > 0:
-        digest.update(getHashPrevouts(tx, b'ZTxIdPrevoutHash'))
-        digest.update(getHashSequence(tx, b'ZTxIdSequencHash'))
-        digest.update(getHashOutputs(tx, b'ZTxIdOutputsHash'))
+    if len(tx.peek('vin')) + len(tx.peek('vout')) > 0:
+        digest.update(prevouts_digest(tx))
+        digest.update(sequence_digest(tx))
+        digest.update(outputs_digest(tx))
 
     return digest.digest()
 
+@memoized_digest
 def transparent_scripts_digest(tx):
     digest = blake2b(digest_size=32, person=b'ZTxAuthTransHash')
-    for x in tx.vin:
+    for x in tx.peek('vin'):
         digest.update(ser_string(x.scriptSig))
     return digest.digest()
 
 # Sapling
 
+@memoized_digest
 def sapling_digest(saplingBundle):
     digest = blake2b(digest_size=32, person=b'ZTxIdSaplingHash')
 
@@ -56,10 +90,17 @@ def sapling_digest(saplingBundle):
 
     return digest.digest()
 
+@memoized_digest
 def sapling_auth_digest(saplingBundle):
     digest = blake2b(digest_size=32, person=b'ZTxAuthSapliHash')
 
-    if len(saplingBundle.spends) + len(saplingBundle.outputs) > 0:
+    if isinstance(saplingBundle, ColumnarSaplingBundle):
+        if len(saplingBundle.spends) + len(saplingBundle.outputs) > 0:
+            digest.update(saplingBundle.spendProofs.tobytes())
+            digest.update(saplingBundle.spendAuthSigs.tobytes())
+            digest.update(saplingBundle.outputProofs.tobytes())
+            digest.update(saplingBundle.bindingSig)
+    elif len(saplingBundle.spends) + len(saplingBundle.outputs) > 0:
         for desc in saplingBundle.spends:
             digest.update(desc.zkproof.serialize())
         for desc in saplingBundle.spends:
@@ -72,6 +113,7 @@ def sapling_auth_digest(saplingBundle):
 
 # - Spends
 
+@memoized_digest
 def sapling_spends_digest(saplingBundle):
     digest = blake2b(digest_size=32, person=b'ZTxIdSSpendsHash')
 
@@ -81,14 +123,23 @@ def sapling_spends_digest(saplingBundle):
 
     return digest.digest()
 
+@memoized_digest
 def sapling_spends_compact_digest(saplingBundle):
     digest = blake2b(digest_size=32, person=b'ZTxIdSSpendCHash')
+    if isinstance(saplingBundle, ColumnarSaplingBundle):
+        digest.update(row_bytes(saplingBundle.spends, 'nullifier'))
+        return digest.digest()
     for desc in saplingBundle.spends:
         digest.update(ser_uint256(desc.nullifier))
     return digest.digest()
 
+@memoized_digest
 def sapling_spends_noncompact_digest(saplingBundle):
     digest = blake2b(digest_size=32, person=b'ZTxIdSSpendNHash')
+    if isinstance(saplingBundle, ColumnarSaplingBundle):
+        digest.update(row_bytes(
+            saplingBundle.spends, 'cv', ser_uint256(saplingBundle.anchor), 'rk'))
+        return digest.digest()
     for desc in saplingBundle.spends:
         digest.update(ser_uint256(desc.cv))
         digest.update(ser_uint256(saplingBundle.anchor))
@@ -97,6 +148,7 @@ def sapling_spends_noncompact_digest(saplingBundle):
 
 # - Outputs
 
+@memoized_digest
 def sapling_outputs_digest(saplingBundle):
     digest = blake2b(digest_size=32, person=b'ZTxIdSOutputHash')
 
@@ -107,22 +159,36 @@ def sapling_outputs_digest(saplingBundle):
 
     return digest.digest()
 
+@memoized_digest
 def sapling_outputs_compact_digest(saplingBundle):
     digest = blake2b(digest_size=32, person=b'ZTxIdSOutC__Hash')
+    if isinstance(saplingBundle, ColumnarSaplingBundle):
+        digest.update(row_bytes(
+            saplingBundle.outputs, 'cmu', 'ephemeralKey', ('encCiphertext', 0, 52)))
+        return digest.digest()
     for desc in saplingBundle.outputs:
         digest.update(ser_uint256(desc.cmu))
         digest.update(ser_uint256(desc.ephemeralKey))
         digest.update(desc.encCiphertext[:52])
     return digest.digest()
 
+@memoized_digest
 def sapling_outputs_memos_digest(saplingBundle):
     digest = blake2b(digest_size=32, person=b'ZTxIdSOutM__Hash')
+    if isinstance(saplingBundle, ColumnarSaplingBundle):
+        digest.update(row_bytes(saplingBundle.outputs, ('encCiphertext', 52, 564)))
+        return digest.digest()
     for desc in saplingBundle.outputs:
         digest.update(desc.encCiphertext[52:564])
     return digest.digest()
 
+@memoized_digest
 def sapling_outputs_noncompact_digest(saplingBundle):
     digest = blake2b(digest_size=32, person=b'ZTxIdSOutN__Hash')
+    if isinstance(saplingBundle, ColumnarSaplingBundle):
+        digest.update(row_bytes(
+            saplingBundle.outputs, 'cv', ('encCiphertext', 564, 580), 'outCiphertext'))
+        return digest.digest()
     for desc in saplingBundle.outputs:
         digest.update(ser_uint256(desc.cv))
         digest.update(desc.encCiphertext[564:])
@@ -131,6 +197,7 @@ def sapling_outputs_noncompact_digest(saplingBundle):
 
 # Orchard
 
+@memoized_digest
 def orchard_digest(orchardBundle):
     digest = blake2b(digest_size=32, person=b'ZTxIdOrchardHash')
 
@@ -144,10 +211,16 @@ def orchard_digest(orchardBundle):
 
     return digest.digest()
 
+@memoized_digest
 def orchard_auth_digest(orchardBundle):
     digest = blake2b(digest_size=32, person=b'ZTxAuthOrchaHash')
 
-    if len(orchardBundle.actions) > 0:
+    if isinstance(orchardBundle, ColumnarOrchardBundle):
+        if len(orchardBundle.actions) > 0:
+            digest.update(orchardBundle.proofs)
+            digest.update(orchardBundle.spendAuthSigs.tobytes())
+            digest.update(orchardBundle.bindingSig)
+    elif len(orchardBundle.actions) > 0:
         digest.update(bytes(orchardBundle.proofs))
         for desc in orchardBundle.actions:
             digest.update(desc.spendAuthSig.serialize())
@@ -157,8 +230,13 @@ def orchard_auth_digest(orchardBundle):
 
 # - Actions
 
+@memoized_digest
 def orchard_actions_compact_digest(orchardBundle):
     digest = blake2b(digest_size=32, person=b'ZTxIdOrcActCHash')
+    if isinstance(orchardBundle, ColumnarOrchardBundle):
+        digest.update(row_bytes(
+            orchardBundle.actions, 'nullifier', 'cmx', 'ephemeralKey', ('encCiphertext', 0, 52)))
+        return digest.digest()
     for desc in orchardBundle.actions:
         digest.update(ser_uint256(desc.nullifier))
         digest.update(ser_uint256(desc.cmx))
@@ -166,14 +244,23 @@ def orchard_actions_compact_digest(orchardBundle):
         digest.update(desc.encCiphertext[:52])
     return digest.digest()
 
+@memoized_digest
 def orchard_actions_memos_digest(orchardBundle):
     digest = blake2b(digest_size=32, person=b'ZTxIdOrcActMHash')
+    if isinstance(orchardBundle, ColumnarOrchardBundle):
+        digest.update(row_bytes(orchardBundle.actions, ('encCiphertext', 52, 564)))
+        return digest.digest()
     for desc in orchardBundle.actions:
         digest.update(desc.encCiphertext[52:564])
     return digest.digest()
 
+@memoized_digest
 def orchard_actions_noncompact_digest(orchardBundle):
     digest = blake2b(digest_size=32, person=b'ZTxIdOrcActNHash')
+    if isinstance(orchardBundle, ColumnarOrchardBundle):
+        digest.update(row_bytes(
+            orchardBundle.actions, 'cv', 'rk', ('encCiphertext', 564, 580), 'outCiphertext'))
+        return digest.digest()
     for desc in orchardBundle.actions:
         digest.update(ser_uint256(desc.cv))
         digest.update(ser_uint256(desc.rk))
@@ -183,6 +270,7 @@ def orchard_actions_noncompact_digest(orchardBundle):
 
 # Transaction
 
+@memoized_digest
 def header_digest(tx):
     digest = blake2b(digest_size=32, person=b'ZTxIdHeadersHash')
 
@@ -202,8 +290,8 @@ def txid_digest(tx):
 
     digest.update(header_digest(tx))
     digest.update(transparent_digest(tx))
-    digest.update(sapling_digest(tx.saplingBundle))
-    digest.update(orchard_digest(tx.orchardBundle))
+    digest.update(sapling_digest(tx.peek('saplingBundle')))
+    digest.update(orchard_digest(tx.peek('orchardBundle')))
 
     return digest.digest()
 
@@ -216,48 +304,73 @@ def auth_digest(tx):
     )
 
     digest.update(transparent_scripts_digest(tx))
-    digest.update(sapling_auth_digest(tx.saplingBundle))
-    digest.update(orchard_auth_digest(tx.orchardBundle))
+    digest.update(sapling_auth_digest(tx.peek('saplingBundle')))
+    digest.update(orchard_auth_digest(tx.peek('orchardBundle')))
 
     return digest.digest()
 
 # Signatures
 
-def signature_digest(tx, nHashType, txin):
+# The transparent input being signed, and the script and amount of the
+# output it spends.
+TransparentInput = namedtuple("TransparentInput", ["nIn", "scriptCode", "amount"])
+
+def signature_digest(tx, nHashType, txin, txdata=None):
+    """The signature digest of txin (a TransparentInput), or of the shielded
+    parts if txin is None. txdata is a PrecomputedTransactionData for tx."""
+    if txdata is None:
+        txdata = PrecomputedTransactionData(tx)
+
     digest = blake2b(
         digest_size=32,
         person=b'ZcashTxHash_' + struct.pack('<I', tx.nConsensusBranchId),
     )
 
-    digest.update(header_digest(tx))
-    digest.update(transparent_sig_digest(tx, nHashType, txin))
-    digest.update(sapling_digest(tx.saplingBundle))
-    digest.update(orchard_digest(tx.orchardBundle))
+    digest.update(txdata.headerDigest)
+    digest.update(transparent_sig_digest(tx, nHashType, txin, txdata))
+    digest.update(txdata.saplingDigest)
+    digest.update(txdata.orchardDigest)
 
     return digest.digest()
 
-def transparent_sig_digest(tx, nHashType, txin):
+def signature_digests(tx, txins, hashtypes=(SIGHASH_ALL,), txdata=None):
+    """The signature digest of each TransparentInput (or None) in txins for
+    each hash type in hashtypes, keyed by (nIn, hashtype), with nIn None for
+    the shielded parts."""
+    if txdata is None:
+        txdata = PrecomputedTransactionData(tx)
+    digests = {}
+    for txin in txins:
+        nIn = None if txin is None else txin.nIn
+        for nHashType in hashtypes:
+            digests[(nIn, nHashType)] = signature_digest(tx, nHashType, txin, txdata)
+    return digests
+
+def transparent_sig_digest(tx, nHashType, txin, txdata=None):
+    if txdata is None:
+        txdata = PrecomputedTransactionData(tx)
+
     # Sapling Spend or Orchard Action
     if txin is None:
-        return transparent_digest(tx)
+        return txdata.transparentDigest
 
     digest = blake2b(digest_size=32, person=b'ZTxIdTranspaHash')
 
-    digest.update(prevouts_sig_digest(tx, nHashType))
-    digest.update(sequence_sig_digest(tx, nHashType))
-    digest.update(outputs_sig_digest(tx, nHashType, txin))
+    digest.update(prevouts_sig_digest(tx, nHashType, txdata))
+    digest.update(sequence_sig_digest(tx, nHashType, txdata))
+    digest.update(outputs_sig_digest(tx, nHashType, txin, txdata))
     digest.update(txin_sig_digest(tx, txin))
 
     return digest.digest()
 
-def prevouts_sig_digest(tx, nHashType):
+def prevouts_sig_digest(tx, nHashType, txdata=None):
     # If the SIGHASH_ANYONECANPAY flag is not set:
     if not (nHashType & SIGHASH_ANYONECANPAY):
-        return getHashPrevouts(tx, b'ZTxIdPrevoutHash')
+        return txdata.prevoutsDigest if txdata else prevouts_digest(tx)
     else:
         return blake2b(digest_size=32, person=b'ZTxIdPrevoutHash').digest()
 
-def sequence_sig_digest(tx, nHashType):
+def sequence_sig_digest(tx, nHashType, txdata=None):
     # if the SIGHASH_ANYONECANPAY flag is not set, and the sighash type is neither
     # SIGHASH_SINGLE nor SIGHASH_NONE:
     if (
@@ -265,21 +378,21 @@ def sequence_sig_digest(tx, nHashType):
         (nHashType & 0x1f) != SIGHASH_SINGLE and \
         (nHashType & 0x1f) != SIGHASH_NONE
     ):
-        return getHashSequence(tx, b'ZTxIdSequencHash')
+        return txdata.sequenceDigest if txdata else sequence_digest(tx)
     else:
         return blake2b(digest_size=32, person=b'ZTxIdSequencHash').digest()
 
-def outputs_sig_digest(tx, nHashType, txin):
+def outputs_sig_digest(tx, nHashType, txin, txdata=None):
     # If the sighash type is neither SIGHASH_SINGLE nor SIGHASH_NONE:
     if (nHashType & 0x1f) != SIGHASH_SINGLE and (nHashType & 0x1f) != SIGHASH_NONE:
-        return getHashOutputs(tx, b'ZTxIdOutputsHash')
+        return txdata.outputsDigest if txdata else outputs_digest(tx)
 
     # If the sighash type is SIGHASH_SINGLE and the signature hash is being computed for
     # the transparent input at a particular index, and a transparent output appears in the
     # transaction at that index:
-    elif (nHashType & 0x1f) == SIGHASH_SINGLE and 0 <= txin.nIn and txin.nIn < len(tx.vout):
+    elif (nHashType & 0x1f) == SIGHASH_SINGLE and 0 <= txin.nIn and txin.nIn < len(tx.peek('vout')):
         digest = blake2b(digest_size=32, person=b'ZTxIdOutputsHash')
-        digest.update(bytes(tx.vout[txin.nIn]))
+        digest.update(tx.peek('vout')[txin.nIn].serialize())
         return digest.digest()
 
     else:
@@ -287,8 +400,8 @@ def outputs_sig_digest(tx, nHashType, txin):
 
 def txin_sig_digest(tx, txin):
     digest = blake2b(digest_size=32, person=b'Zcash___TxInHash')
-    digest.update(bytes(tx.vin[txin.nIn].prevout))
+    digest.update(tx.peek('vin')[txin.nIn].prevout.serialize())
     digest.update(ser_string(txin.scriptCode))
     digest.update(struct.pack('<Q', txin.amount))
-    digest.update(struct.pack('<I', tx.vin[txin.nIn].nSequence))
+    digest.update(struct.pack('<I', tx.peek('vin')[txin.nIn].nSequence))
     return digest.digest()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+#
+# Measure the Python Equihash implementation in
+# qa/rpc-tests/test_framework/equihash.py across a grid of (n, k) parameters,
+# and compare the results with those of an earlier run.
+#
+# For each (n, k), the solvers are run on a range of nonces, the solutions
+# they find are checked with gbp_validate and gbp_validate_batch, the hashes
+# of the first list are expanded and compressed again, and blocks are mined
+# with CBlock.solve. Each measurement records the best wall time of --repeat
+# runs, the peak memory allocated by Python objects in one more run (as seen
+# by tracemalloc), and, for the solvers and CBlock.solve, the mean number of
+# solutions per nonce or nonces per block, and a SHA-256 digest of the
+# solutions found.
+#
+# Usage:
+#   qa/zcash/equihash_benchmarks.py [--params 48,5 ...] --output results.json
+#   qa/zcash/equihash_benchmarks.py --baseline results.json
+#   qa/zcash/equihash_benchmarks.py --load new.json --baseline old.json
+#
+# With --baseline, the measurements that got slower or used more memory by
+# more than --tolerance, or whose solutions changed, are reported as
+# regressions, and the exit status is 1 if there are any. Runs with different
+# --nonces or --blocks settings find different solutions, and are not
+# compared.
+#
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+REPOROOT = os.path.dirname(
+    os.path.dirname(
+        os.path.dirname(
+            os.path.abspath(__file__)
+        )
+    )
+)
+sys.path.insert(0, os.path.join(REPOROOT, 'qa', 'rpc-tests'))
+
+from test_framework import equihash
+from test_framework.mininode import CBlock
+
+# Parameters that gbp_basic solves in well under a second per nonce, with
+# enough solutions per nonce to mine a block in seconds. Its collision check
+# compares whole bytes, so n/(k+1) must be a multiple of 8, and a solution
+# must be a whole number of bytes.
+DEFAULT_PARAMS = [(32, 3), (40, 4), (48, 5), (56, 6)]
+
+# The regtest target.
+REGTEST_BITS = 0x200f0f0f
+
+
+def parse_params(value):
+    try:
+        (n, k) = [int(x) for x in value.split(',')]
+        equihash.validate_params(n, k)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError('invalid parameters %r: %s' % (value, e))
+    if (n//(k+1)) % 8 != 0:
+        raise argparse.ArgumentTypeError('invalid parameters %r: n/(k+1) must be a multiple of 8' % value)
+    if ((1 << k)*(n//(k+1)+1)) % 8 != 0:
+        raise argparse.ArgumentTypeError('invalid parameters %r: solutions must be a whole number of bytes' % value)
+    return (n, k)
+
+
+def measure(f, repeat):
+    '''The best wall time of repeat calls of f, and the peak memory traced
+    during one more call. Returns (seconds, peak bytes, result of f).'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    try:
+        result = f()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return (best, peak, result)
+
+
+def nonce_digests(n, k, nonces):
+    digest = hashlib.blake2b(digest_size=(512//n)*n//8, person=equihash.zcash_person(n, k))
+    digest.update(CBlock().serialize_header()[:108])
+    digests = []
+    for nonce in range(nonces):
+        curr_digest = digest.copy()
+        equihash.hash_nonce(curr_digest, nonce)
+        digests.append(curr_digest)
+    return digests
+
+
+def solutions_digest(solutions):
+    '''A digest of the solutions found for each nonce, in order.'''
+    h = hashlib.sha256()
+    for solns in solutions:
+        h.update(len(solns).to_bytes(4, 'little'))
+        for soln in solns:
+            h.update(bytes(soln))
+    return h.hexdigest()
+
+
+def run_params(n, k, args, record):
+    collision_length = n//(k+1)
+    hash_length = (k+1)*((collision_length+7)//8)
+    digests = nonce_digests(n, k, args.nonces)
+    label = '(%d, %d)' % (n, k)
+
+    solvers = ['gbp_basic', 'gbp_compact']
+    if equihash.np is not None:
+        solvers.append('gbp_vectorized')
+    solutions = None
+    for solver in solvers:
+        f = getattr(equihash, solver)
+        (seconds, peak, found) = measure(lambda: [f(digest, n, k) for digest in digests], args.repeat)
+        if solutions is None:
+            solutions = found
+        elif found != solutions:
+            raise AssertionError('%s and %s disagree for %s' % (solver, solvers[0], label))
+        record(solver, n, k, args.nonces, seconds / args.nonces, peak,
+               solutions_per_nonce=sum(len(s) for s in found) / args.nonces,
+               solutions_digest=solutions_digest(found))
+
+    pairs = [(digest, bytes(soln)) for (digest, solns) in zip(digests, solutions) for soln in solns]
+    if pairs:
+        def validate():
+            return [equihash.gbp_validate(digest, soln, n, k) for (digest, soln) in pairs]
+        (seconds, peak, valid) = measure(validate, args.repeat)
+        assert all(valid)
+        record('gbp_validate', n, k, len(pairs), seconds / len(pairs), peak)
+        def validate_batch():
+            return equihash.gbp_validate_batch([d for (d, _) in pairs], [s for (_, s) in pairs], n, k)
+        (seconds, peak, errors) = measure(validate_batch, args.repeat)
+        assert not any(errors)
+        record('gbp_validate_batch', n, k, len(pairs), seconds / len(pairs), peak)
+
+    # The hashes of the first list of gbp_basic, for the first nonce.
+    hashes = []
+    indices_per_hash_output = 512//n
+    for g in range(2**(collision_length+1) // indices_per_hash_output):
+        curr_digest = digests[0].copy()
+        equihash.hash_xi(curr_digest, g)
+        output = curr_digest.digest()
+        for r in range(indices_per_hash_output):
+            hashes.append(bytearray(output[r*n//8:(r+1)*n//8]))
+    def expand():
+        return [equihash.expand_array(h, hash_length, collision_length) for h in hashes]
+    (seconds, peak, expanded) = measure(expand, args.repeat)
+    record('expand_array', n, k, len(hashes), seconds / len(hashes), peak)
+    def compress():
+        return [equihash.compress_array(h, n//8, collision_length) for h in expanded]
+    (seconds, peak, compressed) = measure(compress, args.repeat)
+    assert compressed == hashes
+    record('compress_array', n, k, len(hashes), seconds / len(hashes), peak)
+
+    def mine():
+        nonces = 0
+        headers = hashlib.sha256()
+        for i in range(args.blocks):
+            block = CBlock()
+            block.nTime = i
+            block.nBits = REGTEST_BITS
+            block.solve(n, k, cache=False)
+            nonces += block.nNonce + 1
+            headers.update(block.serialize_header())
+        return (nonces, headers.hexdigest())
+    (seconds, peak, (nonces, digest)) = measure(mine, args.repeat)
+    record('CBlock.solve', n, k, args.blocks, seconds / args.blocks, peak,
+           nonces_per_block=nonces / args.blocks, solutions_digest=digest)
+
+
+def run(args):
+    results = {}
+    def record(name, n, k, count, seconds, peak, **extra):
+        key = '%s (%d, %d)' % (name, n, k)
+        results[key] = dict(name=name, n=n, k=k, count=count, seconds=seconds, peak_bytes=peak, **extra)
+        print('%-36s %12.3f ms %10.1f KiB %s' % (
+            key, seconds * 1000, peak / 1024,
+            ' '.join('%s=%.2f' % item for item in sorted(extra.items()) if isinstance(item[1], float))),
+            file=sys.stderr)
+    for (n, k) in args.params:
+        run_params(n, k, args, record)
+    return {
+        'python': platform.python_version(),
+        'numpy': equihash.np is not None,
+        'nonces': args.nonces,
+        'blocks': args.blocks,
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+
+def compare(baseline, current, tolerance):
+    '''Print how each measurement in current differs from baseline, and
+    return the number of regressions.'''
+    regressions = 0
+    old = baseline['results']
+    new = current['results']
+    for key in sorted(set(old) | set(new)):
+        if key not in new:
+            print('%-36s missing' % key)
+            continue
+        if key not in old:
+            print('%-36s new' % key)
+            continue
+        notes = []
+        for field in ['solutions_per_nonce', 'nonces_per_block']:
+            if old[key].get(field) != new[key].get(field):
+                notes.append('%s changed from %s to %s' % (field, old[key].get(field), new[key].get(field)))
+        if old[key].get('solutions_digest') != new[key].get('solutions_digest'):
+            notes.append('solutions changed')
+        for (field, what) in [('seconds', 'slower'), ('peak_bytes', 'more memory')]:
+            if old[key][field] and new[key][field] > old[key][field] * (1 + tolerance):
+                notes.append(what)
+        if notes:
+            regressions += 1
+        time_ratio = new[key]['seconds'] / old[key]['seconds'] if old[key]['seconds'] else float('inf')
+        peak_ratio = new[key]['peak_bytes'] / old[key]['peak_bytes'] if old[key]['peak_bytes'] else float('inf')
+        print('%-36s time %6.2fx  memory %6.2fx  %s' % (
+            key, time_ratio, peak_ratio, ('REGRESSION: ' + '; '.join(notes)) if notes else 'ok'))
+    if baseline.get('numpy') != current.get('numpy'):
+        print('Note: NumPy was %s for the baseline and %s now; CBlock.solve uses it if it is installed.' % (
+            'installed' if baseline.get('numpy') else 'not installed',
+            'installed' if current.get('numpy') else 'not installed'))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Python Equihash implementation.')
+    parser.add_argument('--params', type=parse_params, nargs='+', default=DEFAULT_PARAMS, metavar='N,K',
+                        help='parameters to measure (default: %s)' % ' '.join('%d,%d' % p for p in DEFAULT_PARAMS))
+    parser.add_argument('--nonces', type=int, default=8, help='nonces to solve for each solver')
+    parser.add_argument('--blocks', type=int, default=2, help='blocks to mine with CBlock.solve')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions per measurement (best is reported)')
+    parser.add_argument('--output', help='write the results to this file as JSON (default: standard output)')
+    parser.add_argument('--load', help='read the results from this file instead of running the benchmarks')
+    parser.add_argument('--baseline', help='compare the results with those in this file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative increase in time or memory reported as a regression (default: 0.2)')
+    args = parser.parse_args()
+
+    if args.load:
+        with open(args.load, encoding='utf8') as f:
+            current = json.load(f)
+    else:
+        current = run(args)
+        if args.output:
+            with open(args.output, 'w', encoding='utf8') as f:
+                json.dump(current, f, indent=2, sort_keys=True)
+        elif not args.baseline:
+            json.dump(current, sys.stdout, indent=2, sort_keys=True)
+            print()
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf8') as f:
+            baseline = json.load(f)
+        for setting in ['nonces', 'blocks']:
+            if baseline.get(setting) != current.get(setting):
+                sys.exit('Cannot compare with %s: --%s was %s for the baseline and is %s now.' % (
+                    args.baseline, setting, baseline.get(setting), current.get(setting)))
+        regressions = compare(baseline, current, args.tolerance)
+        print('%d regression(s)' % regressions)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -168,6 +168,7 @@ STAGES = [
     'sec-hard',
     'no-dot-so',
     'util-test',
+    'framework-test',
     'secp256k1',
     'univalue',
     'rpc',
@@ -180,6 +181,7 @@ STAGE_COMMANDS = {
     'sec-hard': check_security_hardening,
     'no-dot-so': ensure_no_dot_so_in_depends,
     'util-test': util_test,
+    'framework-test': [sys.executable, repofile('qa/zcash/test_framework_tests.py')],
     'secp256k1': ['make', '-C', repofile('src/secp256k1'), 'check'],
     'univalue': ['make', '-C', repofile('src/univalue'), 'check'],
     'rpc': [repofile('qa/pull-tester/rpc-tests.py')],
@@ -0,0 +1,957 @@
+#!/usr/bin/env python3
+#
+# Benchmarks for the Python test framework in qa/rpc-tests/test_framework.
+#
+# Usage:
+#   qa/zcash/test_framework_benchmarks.py <benchmark> [<benchmark> ...]
+#   qa/zcash/test_framework_benchmarks.py --list
+#   qa/zcash/test_framework_benchmarks.py codecs --reference <git revision>
+#
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import copy
+import hashlib
+from io import BytesIO
+import multiprocessing
+import os
+import random
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+REPOROOT = os.path.dirname(
+    os.path.dirname(
+        os.path.dirname(
+            os.path.abspath(__file__)
+        )
+    )
+)
+sys.path.insert(0, os.path.join(REPOROOT, 'qa', 'rpc-tests'))
+
+from test_framework.mininode import (
+    BytesCursor,
+    CAddress,
+    CBlock,
+    CBlockHeader,
+    CBlockLocator,
+    CInv,
+    COutPoint,
+    CTransaction,
+    CTxIn,
+    CTxOut,
+    CUnsignedAlert,
+    DigestCache,
+    Groth16Proof,
+    JSDescription,
+    OrchardAction,
+    OutputDescription,
+    OutputDescriptionV5,
+    RedJubjubSignature,
+    RedPallasSignature,
+    SpendDescription,
+    ZCProof,
+    ZIP225_VERSION_GROUP_ID,
+    deser_vector,
+    msg_addr,
+    msg_alert,
+    msg_getaddr,
+    msg_getblocks,
+    msg_getdata,
+    msg_getheaders,
+    msg_headers,
+    msg_inv,
+    msg_mempool,
+    msg_notfound,
+    msg_ping,
+    msg_pong,
+    msg_reject,
+    msg_filteradd,
+    msg_filterclear,
+    msg_tx,
+    msg_verack,
+    msg_version,
+    ser_compact_size,
+    ser_uint256,
+)
+from test_framework.corpus import Corpus, CorpusWriter
+from test_framework.headers import HeaderBatch
+from test_framework.opaque import OpaqueBlock
+from test_framework.pipeline import hash_blocks, hash_transactions
+from test_framework.script import (
+    SIGHASH_ALL,
+    SIGHASH_SINGLE,
+    CScript,
+    OP_TRUE,
+    SignatureHash,
+    SignatureHashes,
+)
+from test_framework.solution_cache import SolutionCache
+from test_framework import equihash, zip244
+from test_framework.util import SAPLING_BRANCH_ID
+
+MAX_BLOCK_SIZE = 2000000
+
+
+def best_time(f, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def report(name, seconds, extra=''):
+    print('%-48s %10.2f ms %s' % (name, seconds * 1000, extra))
+
+#
+# Fixtures
+#
+
+def random_bytes(rng, n):
+    return bytes(rng.getrandbits(8) for _ in range(n))
+
+def sapling_tx(rng, n_outputs):
+    tx = CTransaction()
+    tx.vin.append(CTxIn(COutPoint(rng.getrandbits(256), 0), random_bytes(rng, 107), 0xffffffff))
+    tx.vout.append(CTxOut(rng.getrandbits(40), random_bytes(rng, 25)))
+    for _ in range(n_outputs):
+        output = OutputDescription()
+        output.cv = rng.getrandbits(256)
+        output.cmu = rng.getrandbits(256)
+        output.ephemeralKey = rng.getrandbits(256)
+        output.encCiphertext = random_bytes(rng, 580)
+        output.outCiphertext = random_bytes(rng, 80)
+        output.zkproof = Groth16Proof()
+        output.zkproof.data = random_bytes(rng, 192)
+        tx.shieldedOutputs.append(output)
+    if n_outputs > 0:
+        tx.bindingSig = RedJubjubSignature()
+        tx.bindingSig.data = random_bytes(rng, 64)
+    return tx
+
+def phgr_proof(rng):
+    proof = ZCProof()
+    for name in ['g_A', 'g_A_prime', 'g_B_prime', 'g_C', 'g_C_prime', 'g_K', 'g_H']:
+        setattr(proof, name, {'y_lsb': rng.getrandbits(1), 'x': random_bytes(rng, 32)})
+    proof.g_B = {'y_gt': rng.getrandbits(1), 'x': random_bytes(rng, 64)}
+    return proof
+
+def joinsplit_tx(rng, n_inputs, n_joinsplits):
+    '''A v2 (pre-Overwinter) transaction with JoinSplits.'''
+    tx = CTransaction()
+    tx.fOverwintered = False
+    tx.nVersion = 2
+    tx.nVersionGroupId = 0
+    for i in range(n_inputs):
+        tx.vin.append(CTxIn(COutPoint(rng.getrandbits(256), i), random_bytes(rng, 107), 0xffffffff))
+    for i in range(n_inputs):
+        tx.vout.append(CTxOut(rng.getrandbits(40), random_bytes(rng, 25)))
+    for _ in range(n_joinsplits):
+        js = JSDescription()
+        js.proof = phgr_proof(rng)
+        js.ciphertexts = [random_bytes(rng, 601), random_bytes(rng, 601)]
+        tx.vJoinSplit.append(js)
+    tx.joinSplitPubKey = rng.getrandbits(256)
+    tx.joinSplitSig = random_bytes(rng, 64)
+    return tx
+
+def orchard_tx_bytes(rng, n_actions):
+    '''A v5 transaction with n_actions random Orchard actions.'''
+    w = bytearray()
+    w += struct.pack("<IIIII", (1 << 31) | 5, ZIP225_VERSION_GROUP_ID, 0xc2d6d0b4, 0, 0)
+    # No transparent inputs or outputs, no Sapling spends or outputs.
+    w += b"\x00" * 4
+    w += ser_compact_size(n_actions)
+    w += rng.randbytes(820 * n_actions)
+    w += struct.pack("<Bq", 3, 0)
+    w += rng.randbytes(32)
+    w += ser_compact_size(2720 + 2272 * n_actions)
+    w += rng.randbytes(2720 + 2272 * n_actions)
+    w += rng.randbytes(64 * n_actions)
+    w += rng.randbytes(64)
+    return bytes(w)
+
+def max_size_block(outputs_per_tx, seed=0):
+    '''A block of Sapling transactions filled up to MAX_BLOCK_SIZE.'''
+    rng = random.Random(seed)
+    block = CBlock()
+    block.nBits = 0x200f0f0f
+    block.nSolution = random_bytes(rng, 1344)
+    template = sapling_tx(rng, outputs_per_tx)
+    tx_size = len(template.serialize())
+    size = len(block.serialize())
+    while size + tx_size <= MAX_BLOCK_SIZE:
+        block.vtx.append(CTransaction(template))
+        size += tx_size
+    return block
+
+#
+# Reference implementations, matching the framework before it serialized
+# into a single buffer.
+#
+
+def legacy_ser_vector(elems, ser=lambda elem: elem.serialize()):
+    r = b""
+    r += ser_compact_size(len(elems))
+    for elem in elems:
+        r += ser(elem)
+    return r
+
+def legacy_serialize_tx(tx):
+    # Only handles the v4 Sapling transactions built by sapling_tx().
+    r = b""
+    r += struct.pack("<I", (int(tx.fOverwintered)<<31) | tx.nVersion)
+    r += struct.pack("<I", tx.nVersionGroupId)
+    r += legacy_ser_vector(tx.vin)
+    r += legacy_ser_vector(tx.vout)
+    r += struct.pack("<I", tx.nLockTime)
+    r += struct.pack("<I", tx.nExpiryHeight)
+    r += struct.pack("<q", tx.valueBalance)
+    r += legacy_ser_vector(tx.shieldedSpends)
+    r += legacy_ser_vector(tx.shieldedOutputs)
+    r += legacy_ser_vector(tx.vJoinSplit)
+    if len(tx.shieldedOutputs) > 0:
+        r += tx.bindingSig.serialize()
+    return r
+
+def legacy_clone(tx):
+    # CTransaction(tx) before it shared nested parts.
+    clone = copy.copy(tx)
+    for name in CTransaction.shared_fields:
+        setattr(clone, name, copy.deepcopy(getattr(tx, name)))
+    return clone
+
+def legacy_serialize_block(block):
+    r = b""
+    r += block.serialize_header()
+    r += legacy_ser_vector(block.vtx, legacy_serialize_tx)
+    return r
+
+def legacy_calc_merkle_root(block):
+    hashes = [ser_uint256(tx.sha256) for tx in block.vtx]
+    while len(hashes) > 1:
+        hashes = [hashlib.sha256(hashlib.sha256(hashes[i] + hashes[min(i + 1, len(hashes) - 1)]).digest()).digest()
+                  for i in range(0, len(hashes), 2)]
+    return int.from_bytes(hashes[0], 'little')
+
+def legacy_deserialize_headers(f):
+    # Decoded as blocks, then copied (and hashed) into headers.
+    return [CBlockHeader(block) for block in deser_vector(f, CBlock)]
+
+# The revision that the decode and memory benchmarks compare against unless
+# --reference is given: the test framework before any of these optimizations.
+BASELINE = '52fed26'
+
+def reference_mininode(rev):
+    '''The mininode module of git revision rev, loaded alongside the current
+    test_framework package.'''
+    path = 'qa/rpc-tests/test_framework/mininode.py'
+    source = subprocess.check_output(['git', '-C', REPOROOT, 'show', '%s:%s' % (rev, path)])
+    name = 'test_framework.mininode_%s' % rev.replace('^', '_').replace('~', '_')
+    module = types.ModuleType(name)
+    module.__package__ = 'test_framework'
+    sys.modules[name] = module
+    exec(compile(source, '%s:%s' % (rev, path), 'exec'), module.__dict__)
+    return module
+
+@contextlib.contextmanager
+def uncached_serialization():
+    '''Temporarily serialize transactions afresh on every call, instead of
+    copying the encoding cached by the first one.'''
+    saved = CTransaction.serialize_into
+    CTransaction.serialize_into = CTransaction.serialize_fields_into
+    try:
+        yield
+    finally:
+        CTransaction.serialize_into = saved
+
+@contextlib.contextmanager
+def uncached_digests():
+    '''Temporarily compute the ZIP 244 digests afresh on every call.'''
+    saved = DigestCache.cached_digest
+    DigestCache.cached_digest = lambda self, name, compute: compute(self)
+    try:
+        yield
+    finally:
+        DigestCache.cached_digest = saved
+
+#
+# Benchmarks
+#
+
+def bench_serialize(args):
+    '''Serialize max-size blocks with the writer and with r += concatenation.'''
+    for outputs_per_tx in [1, 2000]:
+        block = max_size_block(outputs_per_tx)
+        expected = block.serialize()
+        assert legacy_serialize_block(block) == expected
+        label = '%d txs x %d outputs (%d bytes)' % (len(block.vtx), outputs_per_tx, len(expected))
+        with uncached_serialization():
+            assert block.serialize() == expected
+            writer = best_time(block.serialize, args.repeat)
+        legacy = best_time(lambda: legacy_serialize_block(block), args.repeat)
+        report('serialize/writer %s' % label, writer)
+        report('serialize/concat %s' % label, legacy, '(%.1fx)' % (legacy / writer))
+
+def bench_decode(args):
+    '''Decode max-size blocks from a BytesIO and a BytesCursor, and compare with the mininode.py of --reference (by default, the baseline).'''
+    revision = args.reference or BASELINE
+    reference = reference_mininode(revision)
+    for outputs_per_tx in [1, 20, 2000]:
+        data = max_size_block(outputs_per_tx).serialize()
+        def decode(cls, stream):
+            block = cls()
+            block.deserialize(stream(data))
+            return block
+        assert decode(CBlock, BytesCursor).serialize() == data
+        assert decode(reference.CBlock, BytesIO).serialize() == data
+        label = '%d outputs per tx (%d bytes)' % (outputs_per_tx, len(data))
+        # The reference may predate BytesCursor.
+        previous = best_time(lambda: decode(reference.CBlock, BytesIO), args.repeat)
+        report('decode/%s %s' % (revision, label), previous)
+        for stream in [BytesIO, BytesCursor]:
+            elapsed = best_time(lambda: decode(CBlock, stream), args.repeat)
+            report('decode/%s %s' % (stream.__name__, label), elapsed, '(%.1fx)' % (previous / elapsed))
+
+def bytes_per_object(cls, data, count, stream=BytesCursor):
+    '''Average memory held by `count` objects of cls decoded one after the
+    other from a stream of `count` copies of data, as the objects of a block
+    are.'''
+    f = stream(data * count)
+    objs = []
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(count):
+        obj = cls()
+        obj.deserialize(f)
+        objs.append(obj)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # Exclude the list holding the objects.
+    return (after - before - sys.getsizeof(objs)) / count
+
+def memory_samples(rng):
+    address = CAddress()
+    address.ip = '127.0.0.1'
+    address.port = 8233
+    spend = SpendDescription()
+    spend.cv = spend.anchor = spend.nullifier = spend.rk = rng.getrandbits(256)
+    spend.zkproof = Groth16Proof()
+    spend.zkproof.data = random_bytes(rng, 192)
+    spend.spendAuthSig = RedJubjubSignature()
+    spend.spendAuthSig.data = random_bytes(rng, 64)
+    output = sapling_tx(rng, 1).shieldedOutputs[0]
+    header = CBlockHeader()
+    header.nSolution = random_bytes(rng, 1344)
+    signature = RedPallasSignature()
+    signature.data = random_bytes(rng, 64)
+    action = random_bytes(rng, 32 * 5 + 580 + 80)
+    return [
+        (CTxIn, CTxIn(COutPoint(rng.getrandbits(256), 1), random_bytes(rng, 107), 0xffffffff).serialize()),
+        (CTxOut, CTxOut(rng.getrandbits(40), random_bytes(rng, 25)).serialize()),
+        (COutPoint, COutPoint(rng.getrandbits(256), 1).serialize()),
+        (CInv, CInv(2, rng.getrandbits(256)).serialize()),
+        (CAddress, address.serialize()),
+        (SpendDescription, spend.serialize()),
+        (OutputDescription, output.serialize()),
+        (OutputDescriptionV5, output.serialize()),
+        (OrchardAction, action),
+        (RedPallasSignature, signature.serialize()),
+        (Groth16Proof, spend.zkproof.serialize()),
+        (CBlockHeader, header.serialize()),
+    ]
+
+def bench_headers(args):
+    '''Decode, hash and link a full headers message.'''
+    rng = random.Random(0)
+    headers = []
+    prev = 0
+    for i in range(2000):
+        header = CBlockHeader()
+        header.hashPrevBlock = prev
+        header.nTime = i
+        header.nBits = 0x200f0f0f
+        header.nSolution = random_bytes(rng, 1344)
+        prev = header.rehash()
+        headers.append(header)
+    message = msg_headers()
+    message.headers = headers
+    data = message.serialize()
+    def legacy():
+        decoded = legacy_deserialize_headers(BytesCursor(data))
+        return all(decoded[i].hashPrevBlock == decoded[i - 1].sha256 for i in range(1, len(decoded)))
+    def objects():
+        decoded = msg_headers()
+        decoded.deserialize(BytesCursor(data))
+        return all(decoded.headers[i].hashPrevBlock == decoded.headers[i - 1].sha256
+                   for i in range(1, len(decoded.headers)))
+    def batch():
+        return HeaderBatch.from_payload(data).first_unlinked() is None
+    assert legacy() and objects() and batch()
+    label = '%d headers (%d bytes)' % (len(headers), len(data))
+    reference = best_time(legacy, args.repeat)
+    report('headers/legacy %s' % label, reference)
+    for (name, f) in [('msg_headers', objects), ('HeaderBatch', batch)]:
+        elapsed = best_time(f, args.repeat)
+        report('headers/%s %s' % (name, label), elapsed, '(%.1fx)' % (reference / elapsed))
+
+def bench_merkle(args):
+    '''Grow a block one transaction at a time, recomputing its merkle root after each.'''
+    rng = random.Random(0)
+    txs = []
+    for i in range(2000):
+        tx = CTransaction()
+        tx.vin.append(CTxIn(COutPoint(rng.getrandbits(256), 0), b'\x51', 0))
+        tx.vout.append(CTxOut(i, b'\x51'))
+        tx.calc_sha256()
+        txs.append(tx)
+    def grow(calc_root):
+        block = CBlock()
+        for tx in txs:
+            block.vtx.append(tx)
+            block.hashMerkleRoot = calc_root(block)
+        return block.hashMerkleRoot
+    assert grow(CBlock.calc_merkle_root) == grow(legacy_calc_merkle_root)
+    label = '%d transactions' % len(txs)
+    legacy = best_time(lambda: grow(legacy_calc_merkle_root), args.repeat)
+    incremental = best_time(lambda: grow(CBlock.calc_merkle_root), args.repeat)
+    report('merkle/rebuild %s' % label, legacy)
+    report('merkle/incremental %s' % label, incremental, '(%.1fx)' % (legacy / incremental))
+
+def bench_memory(args):
+    '''Report bytes per decoded object, and compare with the mininode.py of --reference (by default, the baseline).'''
+    rng = random.Random(0)
+    count = 10000
+    revision = args.reference or BASELINE
+    reference = reference_mininode(revision)
+    for (cls, data) in memory_samples(rng):
+        current = bytes_per_object(cls, data, count)
+        # The reference may predate BytesCursor.
+        previous = bytes_per_object(getattr(reference, cls.__name__), data, count, BytesIO)
+        print('memory/%-24s %8.1f bytes/object (%s %8.1f, %5.1f%% saved)' % (
+            cls.__name__, current, revision, previous, 100 * (previous - current) / previous))
+
+def bench_columnar(args):
+    '''Decode and hash large Orchard bundles as objects and as NumPy columns.'''
+    try:
+        from test_framework.columnar import ColumnarTransaction
+        ColumnarTransaction()
+    except ImportError:
+        print('columnar: skipped, NumPy is not installed')
+        return
+    rng = random.Random(0)
+    for n_actions in [1000, 20000]:
+        data = orchard_tx_bytes(rng, n_actions)
+        results = {}
+        def decode_and_hash(cls):
+            tx = cls()
+            tx.deserialize(BytesCursor(data))
+            tx.calc_sha256()
+            results[cls] = (tx.sha256, tx.auth_digest, tx.serialize())
+        objects = best_time(lambda: decode_and_hash(CTransaction), args.repeat)
+        columns = best_time(lambda: decode_and_hash(ColumnarTransaction), args.repeat)
+        assert results[CTransaction] == results[ColumnarTransaction]
+        label = '%d actions (%d bytes)' % (n_actions, len(data))
+        report('columnar/objects %s' % label, objects)
+        report('columnar/columns %s' % label, columns, '(%.1fx)' % (objects / columns))
+
+def equihash_digest(n, k, nonce):
+    digest = hashlib.blake2b(digest_size=(512//n)*n//8, person=equihash.zcash_person(n, k))
+    digest.update(CBlock().serialize_header()[:108])
+    equihash.hash_nonce(digest, nonce)
+    return digest
+
+def solver_peak_rss(solver, n, k, nonce):
+    '''The growth in peak RSS of this process while solver runs, in bytes.'''
+    digest = equihash_digest(n, k, nonce)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    getattr(equihash, solver)(digest, n, k)
+    return 1024 * (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+
+def bench_compact(args):
+    '''Solve Equihash (96, 5) with gbp_basic and with the index trees of gbp_compact.'''
+    (n, k) = (96, 5)
+    digest = equihash_digest(n, k, 0)
+    results = {}
+    def solve(solver):
+        results[solver] = getattr(equihash, solver)(digest, n, k)
+    # Each in a new process, started before this one has solved anything:
+    # the peak RSS of a process starts at that of its parent.
+    peaks = {}
+    for solver in ['gbp_basic', 'gbp_compact']:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            peaks[solver] = executor.submit(solver_peak_rss, solver, n, k, 0).result()
+    label = '(%d, %d)' % (n, k)
+    for solver in ['gbp_basic', 'gbp_compact']:
+        elapsed = best_time(lambda: solve(solver), args.repeat)
+        report('compact/%s %s' % (solver, label), elapsed, '(peak RSS +%.1f MiB)' % (peaks[solver] / 2**20))
+    assert results['gbp_basic'] == results['gbp_compact']
+
+def bench_corpus(args):
+    '''Save blocks to, and reload them from, a BlockStore and a corpus file.'''
+    try:
+        from test_framework.blockstore import BlockStore
+    except ImportError:
+        BlockStore = None
+    blocks = [max_size_block(1, seed) for seed in range(8)]
+    for block in blocks:
+        block.calc_sha256()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        def store_save():
+            store = BlockStore(tmpdir)
+            for block in blocks:
+                store.add_block(block)
+            store.close()
+        def store_load():
+            store = BlockStore(tmpdir)
+            for block in blocks:
+                store.get(block.sha256).vtx[-1]
+            store.close()
+        path = os.path.join(tmpdir, 'blocks.corpus')
+        def corpus_save():
+            if os.path.exists(path):
+                os.remove(path)
+            with CorpusWriter(path) as writer:
+                for block in blocks:
+                    writer.add_block(block)
+        def corpus_load():
+            with Corpus(path) as corpus:
+                for block in blocks:
+                    corpus.get(block.sha256).vtx[-1]
+        label = '%d blocks' % len(blocks)
+        report('corpus/corpus save %s' % label, best_time(corpus_save, args.repeat))
+        corpus = best_time(corpus_load, args.repeat)
+        report('corpus/corpus load %s' % label, corpus)
+        if BlockStore is None:
+            print('corpus: BlockStore skipped, dbm.ndbm is not available')
+            return
+        report('corpus/BlockStore save %s' % label, best_time(store_save, args.repeat))
+        store = best_time(store_load, args.repeat)
+        report('corpus/BlockStore load %s' % label, store, '(%.1fx)' % (store / corpus))
+
+def bench_opaque(args):
+    '''Decode shielded-heavy blocks with and without opaque shielded components.'''
+    rng = random.Random(0)
+    sprout = CBlock()
+    sprout.nSolution = random_bytes(rng, 1344)
+    sprout.vtx = [joinsplit_tx(rng, 1, 20) for _ in range(50)]
+    fixtures = [
+        ('sapling, 10 outputs per tx', max_size_block(10)),
+        ('sprout, 20 joinsplits per tx', sprout),
+    ]
+    for (label, block) in fixtures:
+        data = block.serialize()
+        def decode(cls):
+            decoded = cls()
+            decoded.deserialize(BytesCursor(data))
+            return decoded
+        assert decode(OpaqueBlock).serialize() == data
+        assert decode(CBlock).calc_merkle_root() == decode(OpaqueBlock).calc_merkle_root()
+        objects = best_time(lambda: decode(CBlock), args.repeat)
+        opaque = best_time(lambda: decode(OpaqueBlock), args.repeat)
+        label = '%s (%d bytes)' % (label, len(data))
+        report('opaque/objects %s' % label, objects)
+        report('opaque/opaque %s' % label, opaque, '(%.1fx)' % (objects / opaque))
+
+def bench_pipeline(args):
+    '''Hash a chain of serialized blocks in this process and in a process pool.'''
+    rng = random.Random(0)
+    chain = []
+    for _ in range(64):
+        block = CBlock()
+        block.nSolution = random_bytes(rng, 1344)
+        for _ in range(8):
+            tx = CTransaction()
+            tx.deserialize(BytesCursor(orchard_tx_bytes(rng, 4)))
+            block.vtx.append(tx)
+        chain.append(block.serialize())
+    results = {}
+    def run(workers):
+        results[workers] = list(hash_blocks(chain, workers=workers))
+    workers = os.cpu_count() or 1
+    serial = best_time(lambda: run(0), args.repeat)
+    pooled = best_time(lambda: run(workers), args.repeat)
+    assert results[0] == results[workers]
+    label = '%d blocks (%d bytes)' % (len(chain), sum(len(raw) for raw in chain))
+    report('pipeline/serial %s' % label, serial)
+    report('pipeline/%d workers %s' % (workers, label), pooled, '(%.1fx)' % (serial / pooled))
+
+def bench_zip244(args):
+    '''Compute the txid, auth digest and every shielded signature digest of v5 transactions.'''
+    rng = random.Random(0)
+    for n_actions in (2, 16, 64):
+        raw = orchard_tx_bytes(rng, n_actions)
+        def run():
+            # A freshly decoded transaction, so that nothing is cached yet.
+            tx = CTransaction()
+            tx.deserialize(BytesCursor(raw))
+            result = [zip244.txid_digest(tx), zip244.auth_digest(tx)]
+            for _ in range(n_actions):
+                result.append(zip244.signature_digest(tx, SIGHASH_ALL, None))
+            return result
+        with uncached_digests():
+            expected = run()
+            uncached = best_time(run, args.repeat)
+        assert run() == expected
+        cached = best_time(run, args.repeat)
+        label = '%d actions' % n_actions
+        report('zip244/uncached %s' % label, uncached)
+        report('zip244/memoized %s' % label, cached, '(%.1fx)' % (uncached / cached))
+
+def bench_sighash(args):
+    '''Compute the signature hash of every input one at a time and in a batch.'''
+    rng = random.Random(0)
+    script = CScript([OP_TRUE])
+    hashtypes = (SIGHASH_ALL, SIGHASH_SINGLE)
+    for n_inputs in (100, 1000):
+        v4 = sapling_tx(rng, 2)
+        v5 = CTransaction()
+        v5.deserialize(BytesCursor(orchard_tx_bytes(rng, 2)))
+        for tx in (v4, v5):
+            for i in range(n_inputs):
+                tx.vin.append(CTxIn(COutPoint(rng.getrandbits(256), i), b'', 0xffffffff))
+                tx.vout.append(CTxOut(rng.getrandbits(40), random_bytes(rng, 25)))
+        for (name, tx) in (('v4', v4), ('v5', v5)):
+            inputs = [(i, script, 1000) for i in range(n_inputs)]
+            def one_at_a_time():
+                # As when signing: filling in a scriptSig drops the digests
+                # cached on the transaction.
+                result = {}
+                for (i, script_code, amount) in inputs:
+                    for hashtype in hashtypes:
+                        (result[(i, hashtype)], _) = SignatureHash(
+                            script_code, tx, i, hashtype, amount, SAPLING_BRANCH_ID)
+                    tx.vin[i].scriptSig = b''
+                return result
+            expected = one_at_a_time()
+            assert SignatureHashes(tx, inputs, hashtypes, SAPLING_BRANCH_ID) == expected
+            single = best_time(one_at_a_time, args.repeat)
+            batch = best_time(lambda: SignatureHashes(tx, inputs, hashtypes, SAPLING_BRANCH_ID), args.repeat)
+            label = '%s %d inputs' % (name, n_inputs)
+            report('sighash/one at a time %s' % label, single)
+            report('sighash/batch %s' % label, batch, '(%.1fx)' % (single / batch))
+
+def bench_validate(args):
+    '''Check the Equihash solutions of a headers message one at a time and as a batch.'''
+    (n, k) = (48, 5)
+    mined = []
+    for nonce in range(8):
+        header = CBlockHeader()
+        header.nTime = nonce
+        header.nBits = 0x200f0f0f
+        block = CBlock(header)
+        block.solve(n, k, cache=False)
+        mined.append(CBlockHeader(block))
+    headers = [mined[i % len(mined)] for i in range(500)]
+    batch = HeaderBatch.from_headers(headers)
+    person = equihash.zcash_person(n, k)
+    def one_at_a_time():
+        valid = []
+        for header in headers:
+            digest = hashlib.blake2b(digest_size=(512//n)*n//8, person=person)
+            digest.update(header.serialize_header()[:108])
+            equihash.hash_nonce(digest, header.nNonce)
+            valid.append(equihash.gbp_validate(digest, header.nSolution, n, k))
+        return valid
+    def batched():
+        return [error == equihash.SOLUTION_VALID for error in batch.solution_errors(n, k)]
+    assert all(one_at_a_time()) and all(batched())
+    label = '(%d, %d) %d headers' % (n, k, len(headers))
+    reference = best_time(one_at_a_time, args.repeat)
+    report('validate/gbp_validate %s' % label, reference)
+    elapsed = best_time(batched, args.repeat)
+    extra = '(%.1fx%s)' % (reference / elapsed, '' if equihash.np is not None else ', without NumPy')
+    report('validate/HeaderBatch.solution_errors %s' % label, elapsed, extra)
+
+def bench_wagner(args):
+    '''Solve Equihash (48, 5) for a run of nonces with gbp_basic and gbp_vectorized.'''
+    if equihash.np is None:
+        print('wagner: skipped, NumPy is not installed')
+        return
+    (n, k) = (48, 5)
+    digest = hashlib.blake2b(digest_size=(512//n)*n//8, person=equihash.zcash_person(n, k))
+    digest.update(CBlock().serialize_header()[:108])
+    digests = []
+    for nonce in range(20):
+        curr_digest = digest.copy()
+        equihash.hash_nonce(curr_digest, nonce)
+        digests.append(curr_digest)
+    results = {}
+    def solve(solver):
+        results[solver] = [solver(d, n, k) for d in digests]
+    basic = best_time(lambda: solve(equihash.gbp_basic), args.repeat)
+    vectorized = best_time(lambda: solve(equihash.gbp_vectorized), args.repeat)
+    assert results[equihash.gbp_basic] == results[equihash.gbp_vectorized]
+    label = '(%d, %d) %d nonces' % (n, k, len(digests))
+    report('wagner/gbp_basic %s' % label, basic)
+    report('wagner/gbp_vectorized %s' % label, vectorized, '(%.1fx)' % (basic / vectorized))
+
+def bench_mining(args):
+    '''Mine a chain of regtest blocks with CBlock.solve serially, in a process pool and from a solution cache.'''
+    workers = os.cpu_count() or 1
+    def mine(**kwargs):
+        chain = []
+        prev = 0
+        for height in range(8):
+            block = CBlock()
+            block.hashPrevBlock = prev
+            block.nBits = 0x200f0f0f
+            block.nTime = 1500000000 + height
+            block.solve(**dict({'cache': False}, **kwargs))
+            chain.append((block.nNonce, block.nSolution))
+            prev = block.sha256
+        return chain
+    serial_chain = mine()
+    serial = best_time(mine, args.repeat)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        assert mine(executor=executor) == serial_chain
+        pooled = best_time(lambda: mine(executor=executor), args.repeat)
+    label = '8 blocks (%d nonces)' % sum(nonce + 1 for (nonce, _) in serial_chain)
+    report('mining/serial %s' % label, serial)
+    report('mining/%d workers %s' % (workers, label), pooled, '(%.1fx)' % (serial / pooled))
+    with tempfile.TemporaryDirectory() as directory:
+        cache = SolutionCache(directory)
+        assert mine(cache=cache) == serial_chain
+        cached = best_time(lambda: mine(cache=cache), args.repeat)
+    report('mining/cached %s' % label, cached, '(%.1fx)' % (serial / cached))
+
+def bench_parallel(args):
+    '''Find the block size above which hashing its transactions in a process pool pays off.'''
+    rng = random.Random(0)
+    workers = os.cpu_count() or 1
+    if workers == 1:
+        print('parallel: only one CPU; the pool can only add overhead')
+    txs = []
+    for _ in range(256):
+        tx = CTransaction()
+        tx.deserialize(BytesCursor(orchard_tx_bytes(rng, 4)))
+        txs.append(tx)
+    def serial(batch):
+        # rehash() also drops the bundle digests, which the workers compute
+        # from scratch.
+        for tx in batch:
+            tx.rehash()
+    break_even = None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Start the workers before timing anything.
+        hash_transactions(txs[:1], workers, executor)
+        for count in (8, 32, 128, 256):
+            batch = txs[:count]
+            def pooled():
+                for tx in batch:
+                    tx.invalidate()
+                hash_transactions(batch, workers, executor)
+            t_serial = best_time(lambda: serial(batch), args.repeat)
+            digests = [(tx.sha256, tx.auth_digest) for tx in batch]
+            t_pooled = best_time(pooled, args.repeat)
+            assert digests == [(tx.sha256, tx.auth_digest) for tx in batch]
+            label = '%d v5 txs (%d bytes)' % (count, sum(len(tx.serialize()) for tx in batch))
+            report('parallel/serial %s' % label, t_serial)
+            report('parallel/%d workers %s' % (workers, label), t_pooled, '(%.1fx)' % (t_serial / t_pooled))
+            if break_even is None and t_pooled < t_serial:
+                break_even = count
+    if break_even is None:
+        print('parallel: the pool was slower at every size measured')
+    else:
+        print('parallel: the pool pays off from %d transactions per block' % break_even)
+
+def message_samples(rng):
+    def address():
+        address = CAddress()
+        address.ip = '10.%d.%d.%d' % (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        address.port = 8233
+        return address
+    def inv():
+        return [CInv(rng.choice([1, 2, 5]), rng.getrandbits(256), rng.getrandbits(256)) for _ in range(1000)]
+    def locator():
+        locator = CBlockLocator()
+        locator.vHave = [rng.getrandbits(256) for _ in range(32)]
+        return locator
+
+    version = msg_version()
+    version.addrTo = address()
+    version.addrFrom = address()
+    addr = msg_addr()
+    addr.addrs = [address() for _ in range(1000)]
+    alert = msg_alert()
+    alert.alert.vchMsg = random_bytes(rng, 200)
+    alert.alert.vchSig = random_bytes(rng, 72)
+    getdata = msg_getdata(inv())
+    notfound = msg_notfound()
+    notfound.inv = inv()
+    getblocks = msg_getblocks()
+    getblocks.locator = locator()
+    getheaders = msg_getheaders()
+    getheaders.locator = locator()
+    reject = msg_reject()
+    reject.message = b"tx"
+    reject.code = 16
+    reject.reason = b"bad-txns-inputs-spent"
+    reject.data = rng.getrandbits(256)
+    filteradd = msg_filteradd()
+    filteradd.data = random_bytes(rng, 520)
+    unsigned_alert = CUnsignedAlert()
+    unsigned_alert.setCancel = list(range(50))
+    unsigned_alert.setSubVer = [b'/MagicBean:%d.0.0/' % i for i in range(20)]
+    unsigned_alert.strComment = b'comment'
+    return [
+        version,
+        msg_verack(),
+        addr,
+        alert,
+        msg_inv(inv()),
+        getdata,
+        notfound,
+        getblocks,
+        msg_getaddr(),
+        msg_ping(rng.getrandbits(64)),
+        msg_pong(rng.getrandbits(64)),
+        msg_mempool(),
+        getheaders,
+        reject,
+        filteradd,
+        msg_filterclear(),
+        unsigned_alert,
+        # Decoding a transaction uses the CTxIn, COutPoint and CTxOut codecs.
+        msg_tx(joinsplit_tx(rng, 500, 0)),
+    ]
+
+def bench_codecs(args):
+    '''Decode and encode every message type, and compare with the mininode.py of --reference if it is given.'''
+    rng = random.Random(0)
+    reference = reference_mininode(args.reference) if args.reference else None
+    for msg in message_samples(rng):
+        cls = type(msg)
+        data = msg.serialize()
+        # Enough repetitions to time small messages reliably.
+        count = max(10, min(2000, 1000000 // (len(data) + 1)))
+        def timings(cls):
+            # None if cls does not encode the message as it was decoded.
+            def decode():
+                for _ in range(count):
+                    decoded = cls()
+                    decoded.deserialize(BytesCursor(data))
+                return decoded
+            decoded = decode()
+            if decoded.serialize() != data:
+                return None
+            def encode():
+                for _ in range(count):
+                    if hasattr(decoded, 'tx'):
+                        # Drop the cached encoding.
+                        decoded.tx.invalidate()
+                    decoded.serialize()
+            return (best_time(decode, args.repeat), best_time(encode, args.repeat))
+        current = timings(cls)
+        assert current is not None
+        previous = None
+        if reference is not None:
+            previous = timings(getattr(reference, cls.__name__))
+            if previous is None:
+                print('codecs/%s: %s does not encode it as decoded, not compared' % (
+                    cls.__name__, args.reference))
+        for (i, what) in enumerate(['decode', 'encode']):
+            label = 'codecs/%s %s x%d (%d bytes)' % (what, cls.__name__, count, len(data))
+            if previous is None:
+                report(label, current[i])
+            else:
+                report(label, current[i], '(%s %.2f ms, %.1fx)' % (
+                    args.reference, previous[i] * 1000, previous[i] / current[i]))
+
+def bench_clone(args):
+    '''Clone transactions with copy-on-write and with deepcopy.'''
+    rng = random.Random(0)
+    fixtures = [
+        ('sapling, 1000 outputs', sapling_tx(rng, 1000)),
+        ('v2, 500 inputs, 20 joinsplits', joinsplit_tx(rng, 500, 20)),
+    ]
+    for (label, tx) in fixtures:
+        expected = tx.serialize()
+        assert legacy_clone(tx).serialize() == expected
+        assert CTransaction(tx).serialize() == expected
+        def touch_vin(clone):
+            clone.vin[0].nSequence = 0
+            return clone.serialize()
+        for (what, f) in [('clone', lambda clone: clone), ('clone+serialize', lambda clone: clone.serialize()),
+                          ('clone+mutate vin', touch_vin)]:
+            cow = best_time(lambda: f(CTransaction(tx)), args.repeat)
+            deep = best_time(lambda: f(legacy_clone(tx)), args.repeat)
+            report('clone/cow %s %s' % (what, label), cow)
+            report('clone/deepcopy %s %s' % (what, label), deep, '(%.1fx)' % (deep / cow))
+
+    # Test generators keep many clones of a template alive, and may go on
+    # modifying the template.
+    count = 8000
+    for (what, clone) in [('cow', CTransaction), ('deepcopy', legacy_clone)]:
+        template = joinsplit_tx(random.Random(0), 4, 0)
+        expected = template.serialize()
+        clones = []
+        def keep():
+            clones[:] = []
+            clones.extend(clone(template) for _ in range(count))
+        report('clone/%s keep %d clones, 4 inputs' % (what, count), best_time(keep, args.repeat))
+        start = time.perf_counter()
+        template.vin[0].nSequence = 0
+        report('clone/%s then write the template' % what, time.perf_counter() - start)
+        assert all(c.serialize() == expected for c in clones[::100])
+
+    # SignatureHash clones the transaction for every pre-Overwinter input.
+    tx = joinsplit_tx(rng, 100, 5)
+    script = CScript([OP_TRUE])
+    sighash = best_time(lambda: [SignatureHash(script, tx, i, SIGHASH_ALL, 0, 0) for i in range(len(tx.vin))], args.repeat)
+    report('clone/SignatureHash %d inputs, 5 joinsplits' % len(tx.vin), sighash)
+
+BENCHMARKS = {
+    'clone': bench_clone,
+    'codecs': bench_codecs,
+    'columnar': bench_columnar,
+    'compact': bench_compact,
+    'corpus': bench_corpus,
+    'decode': bench_decode,
+    'headers': bench_headers,
+    'memory': bench_memory,
+    'merkle': bench_merkle,
+    'mining': bench_mining,
+    'opaque': bench_opaque,
+    'parallel': bench_parallel,
+    'pipeline': bench_pipeline,
+    'serialize': bench_serialize,
+    'sighash': bench_sighash,
+    'validate': bench_validate,
+    'wagner': bench_wagner,
+    'zip244': bench_zip244,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Python test framework.')
+    parser.add_argument('benchmarks', nargs='*', help='benchmarks to run (default: all)')
+    parser.add_argument('--list', action='store_true', help='list available benchmarks')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions per measurement (best is reported)')
+    parser.add_argument('--reference', metavar='REV',
+                        help='git revision whose mininode.py the codecs, decode and memory '
+                        'benchmarks compare against (for decode and memory, by default %s)' % BASELINE)
+    args = parser.parse_args()
+
+    if args.list:
+        for name in sorted(BENCHMARKS):
+            print('%-16s %s' % (name, BENCHMARKS[name].__doc__))
+        return
+
+    names = args.benchmarks or sorted(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: %s' % name)
+    for name in names:
+        BENCHMARKS[name](args)
+
+if __name__ == '__main__':
+    main()
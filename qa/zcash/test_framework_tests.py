@@ -0,0 +1,718 @@
+#!/usr/bin/env python3
+#
+# Unit tests for the Python test framework in qa/rpc-tests/test_framework.
+#
+# Usage:
+#   qa/zcash/test_framework_tests.py [-v] [<test> ...]
+#
+
+import copy
+import gc
+import hashlib
+from io import BytesIO
+import os
+import pickle
+import random
+import struct
+import sys
+import tempfile
+import unittest
+
+REPOROOT = os.path.dirname(
+    os.path.dirname(
+        os.path.dirname(
+            os.path.abspath(__file__)
+        )
+    )
+)
+sys.path.insert(0, os.path.join(REPOROOT, 'qa', 'rpc-tests'))
+
+from test_framework.mininode import (
+    BytesCursor,
+    CBlock,
+    CBlockHeader,
+    CInv,
+    COutPoint,
+    CTransaction,
+    CTxIn,
+    CTxOut,
+    JSDescription,
+    OrchardAction,
+    RedPallasSignature,
+    ZCProof,
+    ZIP225_VERSION_GROUP_ID,
+    deser_uint256,
+    msg_headers,
+    ser_uint256,
+)
+from test_framework.blockfiles import REGTEST_MAGIC, BlockFile, block_file_paths, iter_blocks, read_chain
+from test_framework.codec import INT32, INT64, STRING, UINT256, UINT8, If, Vector, schema_codec
+from test_framework.columnar import ColumnarOrchardBundle, ColumnarTransaction
+from test_framework.corpus import MSG_BLOCK, MSG_TX, Corpus, CorpusError, CorpusWriter
+from test_framework.headers import HeaderBatch
+from test_framework.merkle import MerkleTree, auth_data_merkle_tree, txid_merkle_tree
+from test_framework.opaque import OpaqueTransaction
+from test_framework.pipeline import hash_blocks, hash_transactions
+from test_framework.solution_cache import SolutionCache, solution_key
+from test_framework import columnar, equihash, mininode
+
+
+def random_bytes(rng, n):
+    return bytes(rng.getrandbits(8) for _ in range(n))
+
+
+def joinsplit_tx(rng):
+    '''A v2 (pre-Overwinter) transaction with one JoinSplit.'''
+    tx = CTransaction()
+    tx.fOverwintered = False
+    tx.nVersion = 2
+    tx.nVersionGroupId = 0
+    tx.vin.append(CTxIn(COutPoint(rng.getrandbits(256), 0), random_bytes(rng, 107), 0xffffffff))
+    tx.vout.append(CTxOut(rng.getrandbits(40), random_bytes(rng, 25)))
+    js = JSDescription()
+    js.proof = ZCProof()
+    for name in ['g_A', 'g_A_prime', 'g_B_prime', 'g_C', 'g_C_prime', 'g_K', 'g_H']:
+        setattr(js.proof, name, {'y_lsb': 0, 'x': random_bytes(rng, 32)})
+    js.proof.g_B = {'y_gt': 0, 'x': random_bytes(rng, 64)}
+    js.ciphertexts = [random_bytes(rng, 601), random_bytes(rng, 601)]
+    tx.vJoinSplit.append(js)
+    tx.joinSplitPubKey = rng.getrandbits(256)
+    tx.joinSplitSig = random_bytes(rng, 64)
+    return tx
+
+
+def orchard_tx(rng, n_actions):
+    '''A v5 transaction with n_actions random Orchard actions.'''
+    tx = CTransaction()
+    tx.nVersion = 5
+    tx.nVersionGroupId = ZIP225_VERSION_GROUP_ID
+    tx.nConsensusBranchId = 0xc2d6d0b4
+    bundle = tx.orchardBundle
+    for _ in range(n_actions):
+        action = OrchardAction()
+        for name in ['cv', 'nullifier', 'rk', 'cmx', 'ephemeralKey']:
+            setattr(action, name, rng.getrandbits(256))
+        action.encCiphertext = random_bytes(rng, 580)
+        action.outCiphertext = random_bytes(rng, 80)
+        action.spendAuthSig = RedPallasSignature()
+        action.spendAuthSig.data = random_bytes(rng, 64)
+        bundle.actions.append(action)
+    bundle.enableSpends = True
+    bundle.enableOutputs = True
+    bundle.anchor = rng.getrandbits(256)
+    bundle.proofs = random_bytes(rng, 2720 + 2272 * n_actions)
+    bundle.bindingSig = RedPallasSignature()
+    bundle.bindingSig.data = random_bytes(rng, 64)
+    return tx
+
+
+def decode(data):
+    tx = CTransaction()
+    tx.deserialize(BytesCursor(data))
+    tx.calc_sha256()
+    return tx
+
+
+class DecodeTests(unittest.TestCase):
+    def test_truncated_transaction(self):
+        data = orchard_tx(random.Random(0), 2).serialize()
+        for cut in [500, len(data) - 10]:
+            for stream in [BytesIO, BytesCursor]:
+                with self.assertRaises(ValueError, msg='%d bytes cut, %s' % (cut, stream.__name__)):
+                    CTransaction().deserialize(stream(data[:-cut]))
+
+    def test_truncated_block(self):
+        rng = random.Random(0)
+        block = CBlock()
+        block.nSolution = random_bytes(rng, 1344)
+        block.vtx = [joinsplit_tx(rng), orchard_tx(rng, 1)]
+        data = block.serialize()
+        # Every short read raises ValueError, whichever field it cuts.
+        for end in range(0, len(data), 7):
+            for stream in [BytesIO, BytesCursor]:
+                with self.assertRaises(ValueError, msg='%d bytes, %s' % (end, stream.__name__)):
+                    CBlock().deserialize(stream(data[:end]))
+
+    def test_short_read(self):
+        cursor = BytesCursor(b'\x00' * 4)
+        self.assertEqual(bytes(cursor.read(3)), b'\x00' * 3)
+        self.assertRaises(ValueError, cursor.read, 2)
+
+    def test_short_uint256(self):
+        self.assertEqual(deser_uint256(BytesIO(bytes(range(32)))), int.from_bytes(bytes(range(32)), 'little'))
+        for stream in [BytesIO, BytesCursor]:
+            self.assertRaises(ValueError, deser_uint256, stream(b'\x01\x02'))
+
+
+class RehashTests(unittest.TestCase):
+    def test_untracked_change_in_joinsplit_proof(self):
+        tx = decode(joinsplit_tx(random.Random(0)).serialize())
+        (sha256, data) = (tx.sha256, tx.serialize())
+        # The dicts of a proof are not tracked.
+        tx.vJoinSplit[0].proof.g_A['y_lsb'] ^= 1
+        tx.rehash()
+        self.assertNotEqual(tx.serialize(), data)
+        self.assertNotEqual(tx.sha256, sha256)
+        self.assertEqual(tx.sha256, decode(tx.serialize()).sha256)
+
+    def test_writing_template_keeps_clones(self):
+        rng = random.Random(0)
+        template = CTransaction()
+        for i in range(4):
+            template.vin.append(CTxIn(COutPoint(rng.getrandbits(256), i), random_bytes(rng, 107), 0xffffffff))
+        data = template.serialize()
+        clones = [template.clone() for _ in range(100)]
+        template.vin[0].nSequence = 0
+        self.assertNotEqual(template.serialize(), data)
+        # The clones moved to a single copy of the inputs.
+        self.assertEqual(len(set(id(clone.peek('vin')) for clone in clones)), 1)
+        clones[0].vin[1].nSequence = 0
+        for clone in clones[1:]:
+            self.assertEqual(clone.serialize(), data)
+        self.assertNotEqual(clones[0].serialize(), data)
+
+    def test_untracked_change_in_orchard_bundle(self):
+        tx = decode(orchard_tx(random.Random(0), 2).serialize())
+        (sha256, auth_digest, data) = (tx.sha256, tx.auth_digest, tx.serialize())
+        action = tx.orchardBundle.actions[0]
+        object.__setattr__(action, 'cv', action.cv ^ 1)
+        object.__setattr__(action.spendAuthSig, 'data', bytes(64))
+        tx.rehash()
+        self.assertNotEqual(tx.serialize(), data)
+        self.assertNotEqual(tx.sha256, sha256)
+        self.assertNotEqual(tx.auth_digest, auth_digest)
+        expected = decode(tx.serialize())
+        self.assertEqual((tx.sha256, tx.auth_digest), (expected.sha256, expected.auth_digest))
+
+
+class OwnerTests(unittest.TestCase):
+    def test_removed_part_no_longer_invalidates(self):
+        out = CTxOut(1, b'\x51')
+        tx = CTransaction()
+        tx.vout.append(out)
+        tx.vout.append(out)
+        tx.vout.pop()
+        tx.calc_sha256()
+        # Still held once.
+        out.nValue = 2
+        self.assertIsNone(tx._txid)
+        tx.calc_sha256()
+        tx.vout[0] = CTxOut()
+        tx.calc_sha256()
+        txid = tx._txid
+        out.nValue = 3
+        self.assertIs(tx._txid, txid)
+        vout = tx.vout
+        tx.vout = []
+        tx.calc_sha256()
+        vout.append(out)
+        self.assertIsNotNone(tx._txid)
+
+    def test_decoded_parts_are_tracked_once_hashed(self):
+        tx = CTransaction()
+        tx.deserialize(BytesCursor(joinsplit_tx(random.Random(0)).serialize()))
+        self.assertIs(type(tx.vin[0].prevout), COutPoint)
+        tx.vin[0].prevout.n = 1
+        tx.calc_sha256()
+        prevout = tx.vin[0].prevout
+        self.assertIsNot(type(prevout), COutPoint)
+        prevout.n = 2
+        self.assertIsNone(tx._txid)
+        self.assertEqual(tx.sha256, decode(tx.serialize()).sha256)
+        self.assertIs(type(copy.deepcopy(tx).vin[0].prevout), type(prevout))
+
+    def test_owners_are_not_kept_alive(self):
+        out = CTxOut(1, b'\x51')
+        txs = [CTransaction() for _ in range(100)]
+        for tx in txs:
+            tx.vout.append(out)
+            tx.calc_sha256()
+        out.nValue = 2
+        self.assertTrue(all(tx._txid is None for tx in txs))
+        del txs, tx
+        gc.collect()
+        tx = CTransaction()
+        tx.vout.append(out)
+        tx.calc_sha256()
+        out.nValue = 3
+        self.assertEqual(len(mininode._part_owners[id(out)]), 1)
+
+
+    def test_owners_are_forgotten_with_them(self):
+        prevout = COutPoint(1, 0)
+        tx = CTransaction()
+        tx.vin.append(CTxIn(prevout))
+        tx.calc_sha256()
+        # Through the input, which is recorded by its id().
+        prevout.n = 1
+        self.assertIsNone(tx._txid)
+        del tx
+        gc.collect()
+        self.assertNotIn(id(prevout), mininode._part_owners)
+
+
+class CloneTests(unittest.TestCase):
+    def test_hashing_clone_leaves_parts_shared(self):
+        rng = random.Random(0)
+        tx = orchard_tx(rng, 2)
+        tx.vin.append(CTxIn(COutPoint(rng.getrandbits(256), 0), random_bytes(rng, 107), 0xffffffff))
+        tx.vout.append(CTxOut(rng.getrandbits(40), random_bytes(rng, 25)))
+        tx.calc_sha256()
+        clone = tx.clone()
+        clone.nLockTime += 1
+        clone.rehash()
+        for name in CTransaction.shared_fields:
+            self.assertIs(clone.peek(name), tx.peek(name), name)
+        self.assertNotEqual(clone.sha256, tx.sha256)
+        self.assertEqual(clone.sha256, decode(clone.serialize()).sha256)
+        self.assertEqual(tx.sha256, decode(tx.serialize()).sha256)
+
+
+class OpaqueTests(unittest.TestCase):
+    def test_copied_joinsplit_decodes(self):
+        data = joinsplit_tx(random.Random(0)).serialize()
+        expected = decode(data).vJoinSplit[0]
+        for copier in [copy.deepcopy, lambda tx: pickle.loads(pickle.dumps(tx)), lambda tx: tx.clone()]:
+            tx = OpaqueTransaction()
+            tx.deserialize(BytesCursor(data))
+            js = copier(tx).vJoinSplit[0]
+            self.assertTrue(js.is_opaque())
+            self.assertEqual(js.ciphertexts, expected.ciphertexts)
+            self.assertEqual(js.proof.g_B, expected.proof.g_B)
+            self.assertEqual(js.serialize(), expected.serialize())
+
+
+def reference_merkle_root(txids):
+    '''The hashMerkleRoot of a block with these txids, computed level by
+    level as before the tree was kept.'''
+    hashes = list(txids)
+    while len(hashes) > 1:
+        hashes = [hashlib.sha256(hashlib.sha256(hashes[i] + hashes[min(i + 1, len(hashes) - 1)]).digest()).digest()
+                  for i in range(0, len(hashes), 2)]
+    return hashes[0]
+
+
+class MerkleTreeTests(unittest.TestCase):
+    def check(self, tree):
+        self.assertEqual(tree.levels, MerkleTree(tree.combine, tree.missing_sibling, tree.leaves).levels)
+
+    def test_updates_match_rebuilt_tree(self):
+        rng = random.Random(0)
+        for make_tree in [txid_merkle_tree, auth_data_merkle_tree]:
+            tree = make_tree()
+            for _ in range(300):
+                leaves = tree.leaves
+                op = rng.randrange(5)
+                if op == 0 or not leaves:
+                    tree.append(random_bytes(rng, 32))
+                elif op == 1:
+                    tree.replace(rng.randrange(len(leaves)), random_bytes(rng, 32))
+                elif op == 2:
+                    tree.insert(rng.randrange(len(leaves) + 1), random_bytes(rng, 32))
+                elif op == 3:
+                    tree.remove(rng.randrange(len(leaves)))
+                else:
+                    new = list(leaves)
+                    for _ in range(rng.randrange(3)):
+                        new[rng.randrange(len(new))] = random_bytes(rng, 32)
+                    size = max(0, len(new) + rng.randrange(-3, 4))
+                    new = (new + [random_bytes(rng, 32) for _ in range(size)])[:size]
+                    tree.update(new)
+                self.check(tree)
+                if make_tree is txid_merkle_tree and len(tree) > 0:
+                    self.assertEqual(tree.root(), reference_merkle_root(tree.leaves))
+
+    def test_copy_is_independent(self):
+        tree = txid_merkle_tree([bytes([i]) * 32 for i in range(5)])
+        copied = tree.copy()
+        copied.append(b'\x05' * 32)
+        self.assertEqual(len(tree), 5)
+        self.check(tree)
+        self.check(copied)
+
+    def test_block_roots_follow_changes(self):
+        rng = random.Random(0)
+        block = CBlock()
+        for _ in range(5):
+            block.vtx.append(orchard_tx(rng, 1))
+        block.calc_merkle_root()
+        block.calc_auth_data_root()
+        block.vtx[2].nLockTime = 1
+        block.vtx.append(orchard_tx(rng, 1))
+        del block.vtx[0]
+        rebuilt = CBlock()
+        rebuilt.vtx = [decode(tx.serialize()) for tx in block.vtx]
+        self.assertEqual(block.calc_merkle_root(), rebuilt.calc_merkle_root())
+        self.assertEqual(block.calc_auth_data_root(), rebuilt.calc_auth_data_root())
+        self.check(block.merkle_tree)
+        self.check(block.auth_data_tree)
+
+
+def chain_of_blocks(rng, length):
+    '''length blocks, each with one Orchard transaction, each building on the
+    one before.'''
+    blocks = []
+    prev = 0
+    for height in range(length):
+        block = CBlock()
+        block.hashPrevBlock = prev
+        block.nTime = height
+        block.nSolution = random_bytes(rng, 1344)
+        block.vtx.append(orchard_tx(rng, 1))
+        block.hashMerkleRoot = block.calc_merkle_root()
+        block.calc_sha256()
+        blocks.append(block)
+        prev = block.sha256
+    return blocks
+
+
+def block_record(block):
+    data = block.serialize()
+    return REGTEST_MAGIC + struct.pack('<I', len(data)) + data
+
+
+class BlockFileTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.blocks = chain_of_blocks(random.Random(0), 5)
+        b = self.blocks
+        # Blocks stored out of chain order, across two files, followed by the
+        # zeros a node preallocates, and by a record it is still writing.
+        with open(os.path.join(self.tmpdir.name, 'blk00000.dat'), 'wb') as f:
+            f.write(block_record(b[0]) + block_record(b[2]) + block_record(b[1]) + bytes(100))
+        with open(os.path.join(self.tmpdir.name, 'blk00001.dat'), 'wb') as f:
+            f.write(block_record(b[4]) + block_record(b[3]) + block_record(b[4])[:-10])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_iter_blocks_in_storage_order(self):
+        stored = [block.serialize() for (_, block) in iter_blocks(self.tmpdir.name)]
+        self.assertEqual(stored, [self.blocks[i].serialize() for i in [0, 2, 1, 4, 3]])
+
+    def test_read_chain_in_height_order(self):
+        chain = []
+        for (extent, block) in read_chain(self.tmpdir.name, self.blocks[-1].sha256):
+            block.calc_sha256()
+            chain.append(block.sha256)
+            self.assertEqual(block.vtx[0].serialize(), self.blocks[len(chain) - 1].vtx[0].serialize())
+        self.assertEqual(chain, [block.sha256 for block in self.blocks])
+
+    def test_header_hash(self):
+        path = block_file_paths(self.tmpdir.name)[1]
+        with BlockFile(path) as block_file:
+            hashes = [block_file.header_hash(extent) for extent in block_file.extents()]
+        self.assertEqual(hashes, [self.blocks[4].sha256, self.blocks[3].sha256])
+
+    def test_record_size_mismatch(self):
+        data = self.blocks[0].serialize()
+        path = os.path.join(self.tmpdir.name, 'blk00002.dat')
+        # A length prefix that is too short, then one that is too long.
+        with open(path, 'wb') as f:
+            for payload in [data[:-3], data + bytes(3)]:
+                f.write(REGTEST_MAGIC + struct.pack('<I', len(payload)) + payload)
+        with BlockFile(path) as block_file:
+            extents = list(block_file.extents())
+            self.assertEqual(len(extents), 2)
+            for extent in extents:
+                self.assertRaises(ValueError, block_file.block, extent)
+
+
+class CorpusTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'test.corpus')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        rng = random.Random(0)
+        blocks = chain_of_blocks(rng, 3)
+        txs = [joinsplit_tx(rng), orchard_tx(rng, 2)]
+        with CorpusWriter(self.path) as writer:
+            for block in blocks:
+                writer.add_block(block)
+        # Appending keeps what is already there.
+        with CorpusWriter(self.path) as writer:
+            for tx in txs:
+                writer.add_transaction(tx)
+        with Corpus(self.path) as corpus:
+            self.assertEqual(len(corpus), 5)
+            self.assertEqual(corpus.keys(MSG_BLOCK), [block.sha256 for block in blocks])
+            self.assertEqual(corpus.keys(MSG_TX), [tx.sha256 for tx in txs])
+            for block in blocks:
+                self.assertEqual(corpus.get(block.sha256).serialize(), block.serialize())
+                self.assertIsNone(corpus.get_transaction(block.sha256))
+            for tx in txs:
+                self.assertEqual(corpus.get(tx.sha256).serialize(), tx.serialize())
+            self.assertNotIn(0, corpus)
+            responses = corpus.get_blocks([CInv(MSG_BLOCK, blocks[1].sha256), CInv(MSG_BLOCK, 0)])
+            self.assertEqual([msg.block.serialize() for msg in responses], [blocks[1].serialize()])
+
+    def test_unclosed_writer(self):
+        writer = CorpusWriter(self.path)
+        writer.add_transaction(orchard_tx(random.Random(0), 1))
+        writer.f.flush()
+        self.assertRaises(CorpusError, Corpus, self.path)
+        writer.close()
+        with Corpus(self.path) as corpus:
+            self.assertEqual(len(corpus), 1)
+
+
+def equihash_digests(n, k, count):
+    '''The digests of a block header hashed with count different nonces.'''
+    digests = []
+    for nonce in range(count):
+        digest = hashlib.blake2b(digest_size=(512//n)*n//8, person=equihash.zcash_person(n, k))
+        digest.update(bytes(108))
+        equihash.hash_nonce(digest, nonce)
+        digests.append(digest)
+    return digests
+
+
+class EquihashSolverTests(unittest.TestCase):
+    def check_solver(self, solver):
+        for (n, k) in [(48, 5), (32, 3)]:
+            found = 0
+            for digest in equihash_digests(n, k, 8):
+                expected = equihash.gbp_basic(digest.copy(), n, k)
+                self.assertEqual(solver(digest.copy(), n, k), expected, (n, k))
+                found += len(expected)
+            self.assertGreater(found, 0)
+
+    @unittest.skipIf(equihash.np is None, 'NumPy is not installed')
+    def test_vectorized_matches_basic(self):
+        self.check_solver(equihash.gbp_vectorized)
+
+    def test_compact_matches_basic(self):
+        self.check_solver(equihash.gbp_compact)
+
+
+@unittest.skipIf(columnar.np is None, 'NumPy is not installed')
+class ColumnarTests(unittest.TestCase):
+    def test_same_encoding_and_digests(self):
+        data = orchard_tx(random.Random(0), 3).serialize()
+        expected = decode(data)
+        tx = ColumnarTransaction()
+        tx.deserialize(BytesCursor(data))
+        tx.calc_sha256()
+        self.assertEqual(tx.serialize(), data)
+        self.assertEqual((tx.sha256, tx.auth_digest), (expected.sha256, expected.auth_digest))
+        bundle = tx.orchardBundle.to_bundle()
+        self.assertEqual(bundle.serialize(), expected.orchardBundle.serialize())
+        self.assertEqual(ColumnarOrchardBundle.from_bundle(bundle).serialize(), bundle.serialize())
+
+    def test_replacing_a_column_invalidates(self):
+        data = orchard_tx(random.Random(0), 3).serialize()
+        tx = ColumnarTransaction()
+        tx.deserialize(BytesCursor(data))
+        tx.calc_sha256()
+        tx.orchardBundle.actions = tx.orchardBundle.actions[:2]
+        tx.orchardBundle.spendAuthSigs = tx.orchardBundle.spendAuthSigs[:2]
+        expected = decode(data)
+        del expected.orchardBundle.actions[2]
+        expected.rehash()
+        self.assertEqual(tx.serialize(), expected.serialize())
+        self.assertEqual(tx.sha256, expected.sha256)
+
+
+@schema_codec
+class CodecSample(object):
+    schema = (
+        ("nVersion", INT32),
+        ("nFlags", UINT8),
+        ("hash", UINT256),
+        ("vData", STRING),
+        ("vHave", Vector(UINT256)),
+        If("self.nVersion >= 2", [("outpoint", COutPoint), ("nValue", INT64)]),
+    )
+
+
+class CodecTests(unittest.TestCase):
+    def sample(self, nVersion):
+        obj = CodecSample()
+        obj.nVersion = nVersion
+        obj.nFlags = 7
+        obj.hash = (1 << 255) | 3
+        obj.vData = b'\x01' * 300
+        obj.vHave = [5, 6]
+        obj.outpoint = COutPoint(9, 1)
+        obj.nValue = -2
+        return obj
+
+    def test_encoding(self):
+        obj = self.sample(2)
+        expected = (struct.pack('<iB', 2, 7) + ser_uint256(obj.hash) +
+                    b'\xfd\x2c\x01' + obj.vData +
+                    b'\x02' + ser_uint256(5) + ser_uint256(6) +
+                    obj.outpoint.serialize() + struct.pack('<q', -2))
+        w = bytearray()
+        obj.serialize_into(w)
+        self.assertEqual(bytes(w), expected)
+        self.assertEqual(obj.serialized_size(), len(expected))
+        decoded = CodecSample()
+        decoded.deserialize(BytesCursor(expected))
+        self.assertEqual(
+            (decoded.nVersion, decoded.nFlags, decoded.hash, decoded.vData, decoded.vHave,
+             decoded.outpoint.hash, decoded.outpoint.n, decoded.nValue),
+            (2, 7, obj.hash, obj.vData, [5, 6], 9, 1, -2))
+
+    def test_absent_fields(self):
+        obj = self.sample(1)
+        w = bytearray()
+        obj.serialize_into(w)
+        self.assertEqual(len(w), obj.serialized_size())
+        decoded = CodecSample()
+        decoded.deserialize(BytesCursor(bytes(w)))
+        self.assertIsNone(decoded.outpoint)
+        self.assertIsNone(decoded.nValue)
+        self.assertRaises(Exception, CodecSample().deserialize, BytesIO(bytes(w)[:-1]))
+
+    def test_truncated(self):
+        w = bytearray()
+        self.sample(2).serialize_into(w)
+        for end in range(len(w)):
+            for stream in [BytesIO, BytesCursor]:
+                with self.assertRaises(ValueError, msg='%d bytes, %s' % (end, stream.__name__)):
+                    CodecSample().deserialize(stream(bytes(w[:end])))
+
+
+class PipelineTests(unittest.TestCase):
+    def test_hash_blocks(self):
+        blocks = chain_of_blocks(random.Random(0), 5)
+        raw = [block.serialize() for block in blocks]
+        serial = list(hash_blocks(raw, workers=0))
+        self.assertEqual(list(hash_blocks(raw, workers=2, batch_size=2, max_pending=1)), serial)
+        self.assertEqual([digests.sha256 for digests in serial], [block.sha256 for block in blocks])
+        self.assertEqual([digests.merkle_root for digests in serial], [block.hashMerkleRoot for block in blocks])
+
+    def test_hash_transactions(self):
+        rng = random.Random(0)
+        txs = [orchard_tx(rng, 1) for _ in range(6)] + [joinsplit_tx(rng)]
+        for workers in [0, 2]:
+            for tx in txs:
+                tx.invalidate()
+            hash_transactions(txs, workers=workers)
+            for tx in txs:
+                expected = decode(tx.serialize())
+                self.assertEqual((tx.sha256, tx.auth_digest), (expected.sha256, expected.auth_digest))
+
+    def test_roots_in_pool(self):
+        block = CBlock()
+        block.vtx = [b.vtx[0] for b in chain_of_blocks(random.Random(0), 4)]
+        expected = (block.calc_merkle_root(), block.calc_auth_data_root())
+        for tx in block.vtx:
+            tx.invalidate()
+        self.assertEqual((block.calc_merkle_root(workers=2), block.calc_auth_data_root(workers=2)), expected)
+
+
+def mined_chain(length):
+    '''length regtest blocks with valid Equihash solutions, each building on
+    the one before.'''
+    blocks = []
+    prev = 0
+    for height in range(length):
+        block = CBlock()
+        block.hashPrevBlock = prev
+        block.nBits = 0x200f0f0f
+        block.nTime = 1500000000 + height
+        block.solve(cache=False)
+        blocks.append(block)
+        prev = block.sha256
+    return blocks
+
+
+class HeaderBatchTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.blocks = mined_chain(4)
+
+    def batch(self, blocks):
+        message = msg_headers()
+        message.headers = [CBlockHeader(block) for block in blocks]
+        return HeaderBatch.from_payload(message.serialize())
+
+    def test_valid_chain(self):
+        batch = self.batch(self.blocks)
+        self.assertEqual(batch.hashes(), [block.sha256 for block in self.blocks])
+        self.assertIsNone(batch.first_unlinked(prev_hash=0))
+        self.assertIsNone(batch.first_above_target())
+        self.assertIsNone(batch.first_invalid_solution())
+        self.assertEqual([header.sha256 for header in batch.headers()], batch.hashes())
+        message = msg_headers()
+        message.headers = [CBlockHeader(block) for block in self.blocks]
+        self.assertEqual(batch.payload(), message.serialize())
+
+    def test_broken_chain(self):
+        blocks = [CBlockHeader(block) for block in self.blocks]
+        self.assertEqual(self.batch([blocks[0], blocks[2], blocks[3]]).first_unlinked(), 1)
+        self.assertEqual(self.batch(blocks).first_unlinked(prev_hash=1), 0)
+
+    def test_solution_errors_match_solution_error(self):
+        headers = [CBlockHeader(block) for block in self.blocks]
+        solution = bytearray(headers[1].nSolution)
+        solution[5] ^= 1
+        headers[1].nSolution = bytes(solution)
+        # Swap the two halves of the solution, which unorders the index tree.
+        half = len(headers[2].nSolution) // 2
+        headers[2].nSolution = headers[2].nSolution[half:] + headers[2].nSolution[:half]
+        headers[3].nSolution = headers[3].nSolution[:-1]
+        batch = HeaderBatch.from_headers(headers)
+        expected = []
+        for header in headers:
+            digest = hashlib.blake2b(digest_size=(512//48)*48//8, person=equihash.zcash_person(48, 5))
+            digest.update(header.serialize()[:108])
+            equihash.hash_nonce(digest, header.nNonce)
+            expected.append(equihash.solution_error(digest, header.nSolution, 48, 5))
+        self.assertEqual(expected[0], equihash.SOLUTION_VALID)
+        self.assertNotIn(equihash.SOLUTION_VALID, expected[1:])
+        self.assertEqual(batch.solution_errors(), expected)
+        self.assertEqual(batch.first_invalid_solution(), 1)
+
+
+class SolutionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_put_get_evict(self):
+        cache = SolutionCache(self.tmpdir.name, max_entries=2)
+        prefixes = [bytes([i]) * 108 for i in range(3)]
+        cache.put(prefixes[0], 48, 5, 7, b'\x01' * 100)
+        self.assertEqual(cache.get(prefixes[0], 48, 5), (7, b'\x01' * 100))
+        self.assertIsNone(cache.get(prefixes[0], 96, 5))
+        cache.put(prefixes[1], 48, 5, 8, b'\x02' * 100)
+        # Make the first entry the least recently used.
+        os.utime(os.path.join(self.tmpdir.name, solution_key(prefixes[0], 48, 5)), (0, 0))
+        cache.put(prefixes[2], 48, 5, 9, b'\x03' * 100)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(prefixes[0], 48, 5))
+        cache.discard(prefixes[1], 48, 5)
+        self.assertIsNone(cache.get(prefixes[1], 48, 5))
+
+    def test_solve_uses_and_checks_the_cache(self):
+        cache = SolutionCache(self.tmpdir.name)
+        def block():
+            block = CBlock()
+            block.nBits = 0x200f0f0f
+            return block
+        mined = block()
+        mined.solve(cache=cache)
+        prefix = mined.serialize()[:108]
+        self.assertEqual(cache.get(prefix, 48, 5), (mined.nNonce, mined.nSolution))
+        cached = block()
+        cached.solve(cache=cache)
+        self.assertEqual(cached.serialize(), mined.serialize())
+        # A damaged entry is mined again, and replaced.
+        cache.put(prefix, 48, 5, mined.nNonce, bytes(len(mined.nSolution)))
+        remined = block()
+        remined.solve(cache=cache)
+        self.assertEqual(remined.serialize(), mined.serialize())
+        self.assertEqual(cache.get(prefix, 48, 5), (mined.nNonce, mined.nSolution))
+
+
+if __name__ == '__main__':
+    unittest.main()